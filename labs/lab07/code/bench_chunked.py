@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Uploads multi-gigabyte chunked bodies over localhost and reports the
+# throughput and the peak RSS of both ends: send_chunked() on the client,
+# and on the server httpparse with an on_body callback (streaming) or
+# without one (the whole body kept in memory, as hs2.py used to do). The
+# server checks the CRC-32 of what it decoded against the client's.
+
+import argparse, multiprocessing, socket, time, zlib
+import chunked, httpparse
+
+BLOCK = bytes(range(256)) * 256  # 64 KiB sent again and again
+
+def peak_rss():
+    """This process's peak resident set size, in MB."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) // 1024
+
+def serve(listener, stream, results):
+    sock, address = listener.accept()
+    crc = 0
+    def on_body(request, data):
+        nonlocal crc
+        crc = zlib.crc32(data, crc)
+    if stream:
+        parser = httpparse.RequestParser(on_body=on_body)
+    else:
+        parser = httpparse.RequestParser(max_body=float('inf'))
+    start = time.perf_counter()
+    request = httpparse.read_message(sock, parser)
+    elapsed = time.perf_counter() - start
+    if not stream:
+        crc = zlib.crc32(request.body)
+    sock.sendall(b'HTTP/1.1 204 No Content\r\n\r\n')
+    sock.close()
+    results.put((crc, elapsed, peak_rss()))
+
+def blocks(size):
+    """Yield `size` bytes of BLOCKs, the same object every time."""
+    for i in range(size // len(BLOCK)):
+        yield BLOCK
+
+def measure(size, stream, port):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(1)
+    results = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve,
+                                     args=(listener, stream, results))
+    server.start()
+    listener.close()
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(b'POST /upload HTTP/1.1\r\nHost: localhost\r\n'
+                 b'Transfer-Encoding: chunked\r\n\r\n')
+    sent = chunked.send_chunked(sock, blocks(size))
+    response = httpparse.read_message(sock, httpparse.ResponseParser())
+    assert response.status == 204
+    sock.close()
+    crc, elapsed, server_rss = results.get()
+    server.join()
+    expected = 0
+    for i in range(sent // len(BLOCK)):  # what crc32 of it all would be
+        expected = zlib.crc32(BLOCK, expected)
+    return sent, elapsed, crc == expected, server_rss, peak_rss()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='chunked upload memory use')
+    parser.add_argument('-p', metavar='port', type=int, default=8200,
+                        help='first TCP port to use (default 8200)')
+    parser.add_argument('-s', metavar='GB', type=float, nargs='+',
+                        default=[1, 4],
+                        help='body sizes to stream (default 1 4)')
+    parser.add_argument('-b', metavar='GB', type=float, default=0.5,
+                        help='body size to buffer whole (default 0.5)')
+    args = parser.parse_args()
+
+    runs = [(args.b, False)] + [(size, True) for size in args.s]
+    print('{:>10} {:>8} {:>9} {:>9} {:>7} {:>11} {:>11}'.format(
+        'server', 'GB', 'seconds', 'MB/s', 'CRC', 'server RSS', 'client RSS'))
+    port = args.p
+    for gb, stream in runs:
+        size = int(gb * 2**30)
+        sent, elapsed, ok, server_rss, client_rss = measure(size, stream, port)
+        port += 1
+        print('{:>10} {:>8.2f} {:>9.2f} {:>9.0f} {:>7} {:>8} MB {:>8} MB'.format(
+            'streaming' if stream else 'buffering', sent / 2**30, elapsed,
+            sent / elapsed / 1e6, 'ok' if ok else 'BAD', server_rss,
+            client_rss))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Requests per second and body MB/s for the byte-at-a-time request reader
+# s1.py used to have and for httpparse.py, over one keep-alive connection
+# on localhost, with bodies sent by Content-Length and chunked.
+
+import argparse, multiprocessing, socket, time
+import httpparse
+
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+
+def read_bytewise(sock):
+    """s1.py's old reader, without its printing: headers and chunk sizes
+    a byte per recv(), chunk data a byte per recv() too."""
+    request = b''
+    while b'\r\n\r\n' not in request:
+        n = sock.recv(1)
+        request += n
+        if not n:
+            return None
+    headers, body = request.split(b'\r\n\r\n', 1)
+    content_length = None
+    is_chunked = False
+    for line in headers.decode().split('\r\n'):
+        if line.lower().startswith('content-length'):
+            content_length = int(line.split(':')[1].strip())
+        elif (line.lower().startswith('transfer-encoding')
+              and 'chunked' in line.lower()):
+            is_chunked = True
+    if content_length is not None:
+        while len(body) < content_length:
+            body += sock.recv(1024)
+    elif is_chunked:
+        while True:
+            chunk_size_str = b''
+            while b'\r\n' not in chunk_size_str:
+                chunk_size_str += sock.recv(1)
+            chunk_size = int(chunk_size_str.strip(), 16)
+            if chunk_size == 0:
+                sock.recv(2)  # the final CRLF, which s1.py left unread
+                break
+            chunk_data = b''
+            while len(chunk_data) < chunk_size:
+                chunk_data += sock.recv(1)
+            body += chunk_data
+            sock.recv(2)
+    return body
+
+def read_parser(sock, parser):
+    request = httpparse.read_message(sock, parser)
+    return None if request is None else request.body
+
+def serve(listener, reader):
+    sock, address = listener.accept()
+    parser = httpparse.RequestParser()
+    while True:
+        if reader == 'bytewise':
+            body = read_bytewise(sock)
+        else:
+            body = read_parser(sock, parser)
+        if body is None:
+            break
+        sock.sendall(RESPONSE)
+    sock.close()
+
+def make_request(size, chunk):
+    body = b'x' * size
+    if not chunk:
+        return (b'POST /upload HTTP/1.1\r\nHost: localhost\r\n'
+                b'Content-Length: %d\r\n\r\n' % size) + body
+    pieces = [b'POST /upload HTTP/1.1\r\nHost: localhost\r\n'
+              b'Transfer-Encoding: chunked\r\n\r\n']
+    for i in range(0, size, chunk):
+        data = body[i:i + chunk]
+        pieces.append(b'%x\r\n' % len(data) + data + b'\r\n')
+    pieces.append(b'0\r\n\r\n')
+    return b''.join(pieces)
+
+def measure(reader, size, chunk, seconds, port):
+    """Return requests per second and body MB per second."""
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(1)
+    server = multiprocessing.Process(target=serve, args=(listener, reader))
+    server.start()
+    listener.close()
+    request = make_request(size, chunk)
+    sock = socket.create_connection(('127.0.0.1', port))
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        sock.sendall(request)
+        answer = b''
+        while len(answer) < len(RESPONSE):
+            answer += sock.recv(len(RESPONSE) - len(answer))
+        count += 1
+    elapsed = time.perf_counter() - start
+    sock.close()
+    server.join()
+    return count / elapsed, count * size / elapsed / 1e6
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP request reader speed')
+    parser.add_argument('-p', metavar='port', type=int, default=8090,
+                        help='first TCP port to use (default 8090)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=3.0,
+                        help='duration of each run (default 3)')
+    args = parser.parse_args()
+
+    cases = [('empty body', 0, 0),
+             ('64 KiB, Content-Length', 64 * 1024, 0),
+             ('64 KiB, 4 KiB chunks', 64 * 1024, 4096),
+             ('1 MiB, Content-Length', 1024 * 1024, 0),
+             ('1 MiB, 64 KiB chunks', 1024 * 1024, 64 * 1024)]
+    print('{:>24} {:>10} {:>12} {:>10} {:>12} {:>10}'.format(
+        'request', 'bytewise', '', 'httpparse', '', 'speedup'))
+    print('{:>24} {:>10} {:>12} {:>10} {:>12}'.format(
+        '', 'req/s', 'MB/s', 'req/s', 'MB/s'))
+    port = args.p
+    for name, size, chunk in cases:
+        results = []
+        for reader in ('bytewise', 'parser'):
+            results.append(measure(reader, size, chunk, args.t, port))
+            port += 1
+        (old, old_mb), (new, new_mb) = results
+        print('{:>24} {:>10.0f} {:>12.2f} {:>10.0f} {:>12.2f} {:>9.1f}x'.format(
+            name, old, old_mb, new, new_mb, new / old))
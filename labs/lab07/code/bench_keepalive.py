@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Many concurrent keep-alive clients against s1.py (one connection at a
+# time) and s2.py (all of them at once, pipelining allowed). Each client
+# sends `depth` requests at a time down its connection, reads the
+# responses, and starts again on a new connection whenever the server
+# closes the old one.
+
+import argparse, asyncio, multiprocessing, os, socket, subprocess, sys, time
+import httpparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REQUEST = b'GET /bench HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+def start_server(script, port, args=()):
+    server = subprocess.Popen(
+        [sys.executable, script, str(port)] + list(args), cwd=HERE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for i in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError('{} did not start'.format(script))
+
+async def conversation(port, depth, deadline, latencies, counts):
+    """Keep one client busy until the deadline."""
+    reader = None
+    answered = 0
+    while time.time() < deadline:
+        if reader is None:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection('127.0.0.1', port),
+                    deadline - time.time())
+            except (OSError, asyncio.TimeoutError):
+                counts['refused'] += 1
+                await asyncio.sleep(0.1)
+                continue
+            parser = httpparse.ResponseParser()
+            counts['connections'] += 1
+        start = time.perf_counter()
+        writer.write(REQUEST * depth)
+        got = closed = 0
+        try:
+            while got < depth:
+                data = await asyncio.wait_for(reader.read(65536),
+                                              deadline - time.time())
+                responses = parser.feed(data) if data else parser.eof()
+                got += len(responses)
+                closed = not data or any(not r.keep_alive for r in responses)
+                if closed:
+                    break
+        except (OSError, asyncio.TimeoutError, httpparse.HTTPError):
+            closed = True
+        if got:
+            latencies.append((time.perf_counter() - start) / got)
+            answered += got
+        if closed:
+            writer.close()
+            reader = None
+    if reader is not None:
+        writer.close()
+    counts['answered'] += answered
+    counts['starved'] += not answered
+
+def client(port, clients, depth, seconds, results):
+    async def run():
+        latencies = []
+        counts = dict.fromkeys(['answered', 'connections', 'refused',
+                                'starved'], 0)
+        deadline = time.time() + seconds
+        await asyncio.gather(*[conversation(port, depth, deadline, latencies,
+                                            counts) for i in range(clients)])
+        return latencies, counts
+    results.put(asyncio.run(run()))
+
+def measure(script, port, clients, processes, depth, seconds, args=()):
+    server = start_server(script, port, args)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=client, args=(
+        port, clients // processes + (i < clients % processes), depth,
+        seconds, results)) for i in range(processes)]
+    try:
+        for p in procs:
+            p.start()
+        latencies = []
+        counts = {}
+        for p in procs:
+            more, more_counts = results.get()
+            latencies += more
+            for key, value in more_counts.items():
+                counts[key] = counts.get(key, 0) + value
+        for p in procs:
+            p.join()
+    finally:
+        server.kill()
+        server.wait()
+    latencies.sort()
+    def percentile(p):
+        if not latencies:
+            return float('nan')
+        return 1000 * latencies[min(int(len(latencies) * p / 100),
+                                    len(latencies) - 1)]
+    return (counts['answered'] / seconds, percentile(50), percentile(99),
+            counts['connections'], counts['starved'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='keep-alive client load')
+    parser.add_argument('-p', metavar='port', type=int, default=8100,
+                        help='first TCP port to use (default 8100)')
+    parser.add_argument('-c', metavar='clients', type=int, default=200,
+                        help='concurrent keep-alive clients (default 200)')
+    parser.add_argument('-n', metavar='processes', type=int, default=2,
+                        help='client processes (default 2)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=5.0,
+                        help='duration of each run (default 5)')
+    args = parser.parse_args()
+
+    runs = [('s1.py', 1, ()), ('s2.py', 1, ()), ('s2.py', 8, ()),
+            ('s2.py', 8, ('--max-requests', '10'))]
+    print('{} keep-alive clients for {} s each'.format(args.c, args.t))
+    print('{:>32} {:>10} {:>8} {:>8} {:>12} {:>8}'.format(
+        'server', 'req/s', 'p50 ms', 'p99 ms', 'connections', 'starved'))
+    port = args.p
+    for script, depth, extra in runs:
+        rate, p50, p99, connections, starved = measure(
+            script, port, args.c, args.n, depth, args.t, extra)
+        port += 1
+        name = '{} depth {} {}'.format(script, depth, ' '.join(extra))
+        print('{:>32} {:>10.0f} {:>8.2f} {:>8.2f} {:>12} {:>8}'.format(
+            name, rate, p50, p99, connections, starved))
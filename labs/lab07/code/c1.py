@@ -1,73 +1,15 @@
 import socket,sys
+import httpparse
 
 def read_http_message(sock):
-    # Read headers until we find the empty line indicating the end of headers
-    response = b""
-    while b"\r\n\r\n" not in response:
-        response += sock.recv(1)
-
-    headers, body = response.split(b"\r\n\r\n", 1)
-    print(headers)
-    print(body)
-
-    # Parse headers to find Content-Length or Transfer-Encoding
-    headers_str = headers.decode()
-    content_length = None
-    is_chunked = False
-
-    for line in headers_str.split("\r\n"):
-        if line.lower().startswith("content-length"):
-            content_length = int(line.split(":")[1].strip())
-        elif line.lower().startswith("transfer-encoding") and "chunked" in line.lower():
-            is_chunked = True
-
-    if content_length is not None:
-        # If Content-Length is found, read the exact amount of remaining bytes
-        while len(body) < content_length:
-            body += sock.recv(1024)
-    elif is_chunked:
-        # If Transfer-Encoding is chunked, handle it accordingly
-        body += read_chunked_response(sock)
-    else:
-        # If neither is present, read until the connection is closed
-        body += read_until_close(sock)
-
-    return headers_str, body.decode()
-
-def read_chunked_response(sock):
-    response = b""
-    while True:
-        chunk_size_str = b""
- 
-        # Read chunk size in hexadecimal
-        while b"\r\n" not in chunk_size_str:
-            chunk_size_str += sock.recv(1)
-        chunk_size = int(chunk_size_str.strip(), 16)
-
-        # End of the message when chunk size is 0
-        if chunk_size == 0:
-            break
-
-        # Read the chunk data
-        chunk_data = b''
-        while len(chunk_data) < chunk_size:
-          chunk_data += sock.recv(1)
-
-        response += chunk_data
-
-        # Read the trailing \r\n
-        sock.recv(2) 
-
-    return response
-
-def read_until_close(sock):
-    response = b""
-    while True:
-        chunk = sock.recv(1024)
-        if not chunk:  # Server closed the connection
-            break
-        response += chunk
-    return response
+    # Read the response in large pieces; the parser finds the end of the
+    # headers and reads the body by Content-Length, by chunks, or until the
+    # server closes the connection
+    response = httpparse.read_message(sock, httpparse.ResponseParser())
+    if response is None:
+        raise EOFError("connection closed before a response")
+
+    return response.head, response.body.decode(errors="replace")
 
 def main():
     host = sys.argv[1] if len(sys.argv)>1 else 'www.google.com'
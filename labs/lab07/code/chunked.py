@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Streaming HTTP/1.1 chunked transfer coding, in constant memory however
+# long the body. send_chunked() sends a file or any iterable of bytes, one
+# sendmsg() call per chunk: size line, data and CRLF leave together without
+# being copied into one string first.
+# ChunkedDecoder takes the encoded body in pieces as they arrive and hands
+# each piece of data to a callback (a file's write(), say) as soon as it
+# has it, never holding more than a partial size line.
+#
+#   chunked.send_chunked(sock, open('big.iso', 'rb'))
+#   decoder = chunked.ChunkedDecoder(open('copy.iso', 'wb').write)
+#   used = decoder.feed(data)  # until decoder.done
+
+CHUNK_SIZE = 64 * 1024  # how much send_chunked() reads from a file at once
+MAX_LINE = 1024         # chunk size line, extensions included
+
+HEX_DIGITS = b'0123456789abcdefABCDEF'
+
+# Decoder states
+SIZE, DATA, DATA_END, TRAILER = range(4)
+
+class ChunkedError(ValueError):
+    """The encoded body is malformed."""
+
+class ChunkedDecoder(object):
+    """Incremental decoder for one chunked body. feed() it what arrives;
+    write(data) is called with each piece of chunk data, a memoryview that
+    is only valid during the call (copy it, or write it somewhere)."""
+
+    def __init__(self, write, max_line=MAX_LINE):
+        self.write = write
+        self.max_line = max_line
+        self.line = b''      # a size, chunk end or trailer line, in part
+        self.state = SIZE
+        self.remaining = 0   # of the current chunk
+        self.trailers = []   # raw trailer field lines, after the last chunk
+        self.done = False
+        self.size = 0        # of the data decoded so far
+
+    def feed(self, data):
+        """Decode what it can of `data`; return how many bytes it used.
+        That is all of them, unless the body ends within `data`: what
+        follows belongs to whatever comes after the body."""
+        with memoryview(data) as data:
+            pos = 0
+            end = len(data)
+            while pos < end and not self.done:
+                if self.state == DATA:
+                    n = min(self.remaining, end - pos)
+                    with data[pos:pos + n] as piece:
+                        self.write(piece)
+                    pos += n
+                    self.size += n
+                    self.remaining -= n
+                    if not self.remaining:
+                        self.state = DATA_END
+                else:
+                    pos += self.read_line(data, pos)
+            return pos
+
+    def read_line(self, data, pos):
+        # Lines are short and come once a chunk, so copying one into bytes
+        # to search it costs little next to the data.
+        window = self.line + bytes(data[pos:pos + self.max_line + 2])
+        i = window.find(b'\r\n')
+        if i < 0:
+            if len(window) > self.max_line + 1:
+                raise ChunkedError('chunked line too long')
+            used = len(window) - len(self.line)
+            self.line = window
+            return used
+        used = i + 2 - len(self.line)
+        self.line = b''
+        self.end_line(window[:i])
+        return used
+
+    def end_line(self, line):
+        if self.state == SIZE:
+            size = line.split(b';', 1)[0].strip()  # drop chunk extensions
+            if not size or size.strip(HEX_DIGITS):  # int() allows '0x', '_'
+                raise ChunkedError('bad chunk size {!r}'.format(size))
+            self.remaining = int(size, 16)
+            self.state = DATA if self.remaining else TRAILER
+        elif self.state == DATA_END:
+            if line:
+                raise ChunkedError('chunk longer than its size')
+            self.state = SIZE
+        elif line:
+            if len(self.trailers) >= 100:
+                raise ChunkedError('too many trailer fields')
+            self.trailers.append(line)
+        else:
+            self.done = True
+
+def send_chunked(sock, source, chunk_size=CHUNK_SIZE, trailers=()):
+    """Send `source` as a chunked body: a binary file, read `chunk_size`
+    bytes at a time into one reused buffer, or an iterable of bytes-like
+    objects, each sent as a chunk (empty ones are skipped, since an empty
+    chunk ends the body). `trailers` are (name, value) pairs sent after
+    the last chunk. Return the number of data bytes sent."""
+    if hasattr(source, 'readinto'):
+        source = read_into(source, bytearray(chunk_size))
+    total = 0
+    for data in source:
+        n = len(data)
+        if n:
+            sendmsg_all(sock, [b'%x\r\n' % n, data, b'\r\n'])
+            total += n
+    end = [b'0\r\n']
+    end += ['{}: {}\r\n'.format(name, value).encode('latin-1')
+            for name, value in trailers]
+    end.append(b'\r\n')
+    sock.sendall(b''.join(end))
+    return total
+
+def read_into(file, buffer):
+    """Yield successive pieces of `file`, each read into `buffer` and only
+    valid until the next one is read."""
+    with memoryview(buffer) as view:
+        while True:
+            n = file.readinto(buffer)
+            if not n:
+                return
+            yield view[:n]
+
+def sendmsg_all(sock, buffers):
+    """Like sendall(), for a list of buffers sent with sendmsg()."""
+    try:
+        sent = sock.sendmsg(buffers)
+    except NotImplementedError:  # e.g. an ssl.SSLSocket
+        sock.sendall(b''.join(buffers))
+        return
+    if sent == sum(len(b) for b in buffers):
+        return
+    buffers = [memoryview(b).cast('B') for b in buffers]
+    while True:
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if not buffers:
+            return
+        buffers[0] = buffers[0][sent:]
+        sent = sock.sendmsg(buffers)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# Incremental HTTP/1.1 message parser: feed it whatever recv() returned, in
+# pieces as large as you like, and it hands back each request (or response)
+# as soon as it is complete, with a Content-Length or chunked body decoded
+# into a bytearray. Nothing is read a byte at a time, several pipelined
+# messages may arrive in one piece, and the header block and body sizes
+# are bounded so that a client cannot make the server buffer without end.
+# Give the parser an on_body callback and bodies stream through it instead,
+# in constant memory whatever their size.
+#
+#   parser = httpparse.RequestParser()
+#   request = httpparse.read_message(sock, parser)  # None once sock closes
+#   print(request.method, request.target, request.header('host'))
+
+import collections
+import chunked
+
+MAX_HEAD = 64 * 1024     # request line or status line plus headers, bytes
+MAX_HEADERS = 100
+MAX_BODY = 64 * 1024 * 1024
+BUFSIZE = 64 * 1024      # how much read_message() asks recv_into() for
+
+# Parser states
+HEAD, BODY, CHUNKED, UNTIL_CLOSE, UPGRADED = range(5)
+
+class HTTPError(Exception):
+    """A malformed or oversized message. `status` is the response a server
+    should send before closing the connection: the parser cannot go on."""
+
+    def __init__(self, status, reason):
+        super().__init__('{} {}'.format(status, reason))
+        self.status = status
+        self.reason = reason
+
+class Message(object):
+    """One parsed request or response."""
+
+    def __init__(self, head, start, headers):
+        self.head = head        # raw request or status line and headers
+        self.start = start      # the three parts of the first line
+        self.headers = headers  # [(name, value)], names as sent
+        self.fields = {}        # lowercase name: value, repeats joined by ', '
+        for name, value in headers:
+            key = name.lower()
+            if key in self.fields:
+                self.fields[key] += ', ' + value
+            else:
+                self.fields[key] = value
+        self.body = bytearray()
+        self.trailers = []
+
+    # Requests: method, target, version. Responses: version, status, reason.
+    method = property(lambda self: self.start[0])
+    target = property(lambda self: self.start[1])
+    status = property(lambda self: int(self.start[1]))
+    reason = property(lambda self: self.start[2])
+
+    @property
+    def version(self):
+        if self.start[0].startswith('HTTP/'):
+            return self.start[0]
+        return self.start[2]
+
+    def header(self, name, default=None):
+        return self.fields.get(name.lower(), default)
+
+    @property
+    def keep_alive(self):
+        """Whether the connection may carry another message after this."""
+        connection = self.header('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+class Parser(object):
+    """State machine shared by RequestParser and ResponseParser. feed()
+    returns the messages that the new data completed, in order.
+
+    With on_body, each piece of a body is passed to on_body(message, data)
+    as it arrives instead of being kept in message.body, and max_body does
+    not apply. `data` is a memoryview only valid during the call.
+
+    After a message that switches protocols (a 101 response, or a request
+    with Connection: upgrade) the parser stops: whatever follows, e.g.
+    WebSocket frames sent right behind the handshake, is left in `buffer`
+    for the new protocol. Pass upgrade=False to parse on regardless, or
+    call resume() to go back to HTTP after declining an upgrade.
+    """
+
+    def __init__(self, max_head=MAX_HEAD, max_body=MAX_BODY, on_body=None,
+                 upgrade=True):
+        self.max_head = max_head
+        self.max_body = max_body
+        self.on_body = on_body
+        self.upgrade = upgrade
+        self.buffer = bytearray()
+        self.scanned = 0        # buffer bytes already searched for the head
+        self.state = HEAD
+        self.message = None     # the one being parsed
+        self.remaining = 0      # of a Content-Length body
+        self.decoder = None     # chunked.ChunkedDecoder of a chunked one
+        self.pending = collections.deque()  # for read_message()
+        self.recv_buffer = None
+
+    def feed(self, data):
+        done = []
+        if self.buffer or self.state in (HEAD, UPGRADED):
+            self.buffer += data
+        else:
+            # Body bytes need not go through the buffer: copy them once,
+            # straight from what recv() returned into the body.
+            data = memoryview(data)
+            used = self.take_body(data, done)
+            self.buffer += data[used:]
+            data.release()
+        self.parse(done)
+        return done
+
+    def eof(self):
+        """The peer has closed the connection: return the message that
+        this ends, if any; raise HTTPError if one was cut short."""
+        if self.state == UNTIL_CLOSE:
+            message = self.message
+            self.reset()
+            return [message]
+        if self.state == UPGRADED:
+            return []
+        if self.state != HEAD or self.buffer:
+            raise HTTPError(400, 'Connection closed mid-message')
+        return []
+
+    def resume(self):
+        """Parse HTTP again after an upgrade that was not made; return
+        the messages already buffered."""
+        done = []
+        if self.state == UPGRADED:
+            self.reset()
+            self.parse(done)
+        return done
+
+    def take_body(self, data, done):
+        """Add what it can of memoryview `data` to the body; return how
+        many bytes it used."""
+        if self.state == CHUNKED:
+            try:
+                used = self.decoder.feed(data)
+            except chunked.ChunkedError as e:
+                raise HTTPError(400, str(e).capitalize()) from None
+            if self.decoder.done:
+                self.message.trailers = [split_field(line) for line
+                                         in self.decoder.trailers]
+                self.finish(done)
+            return used
+        if self.state == UNTIL_CLOSE:
+            used = len(data)
+        else:
+            used = min(self.remaining, len(data))
+            self.remaining -= used
+        with data[:used] as piece:
+            self.add_body(piece)
+        if self.state == BODY and not self.remaining:
+            self.finish(done)
+        return used
+
+    def add_body(self, data):
+        if self.on_body is not None:
+            self.on_body(self.message, data)
+            return
+        body = self.message.body
+        if len(body) + len(data) > self.max_body:
+            raise HTTPError(413, 'Content Too Large')
+        body += data
+
+    def reset(self):
+        self.state = HEAD
+        self.message = None
+        self.decoder = None
+
+    def finish(self, done):
+        """The message being parsed is complete."""
+        message = self.message
+        done.append(message)
+        self.reset()
+        if self.upgrade and self.switches(message):
+            self.state = UPGRADED
+
+    def parse(self, done):
+        buffer = self.buffer
+        pos = 0
+        try:
+            while pos < len(buffer) and self.state != UPGRADED:
+                if self.state != HEAD:
+                    with memoryview(buffer) as view, view[pos:] as rest:
+                        pos += self.take_body(rest, done)
+                    continue
+                end = buffer.find(b'\r\n\r\n', max(pos, self.scanned - 3))
+                if end < 0:
+                    if len(buffer) - pos > self.max_head:
+                        raise HTTPError(431, 'Request Header Fields Too Large')
+                    self.scanned = len(buffer)
+                    break
+                if end - pos > self.max_head:
+                    raise HTTPError(431, 'Request Header Fields Too Large')
+                self.start_message(bytes(buffer[pos:end]), done)
+                pos = end + 4
+        finally:
+            del buffer[:pos]
+            self.scanned = max(self.scanned - pos, 0)
+
+    def start_message(self, head, done):
+        lines = head.split(b'\r\n')
+        while lines and not lines[0]:
+            del lines[0]  # stray CRLFs before a request are allowed
+        if not lines:
+            return
+        if len(lines) > MAX_HEADERS + 1:
+            raise HTTPError(431, 'Too many header fields')
+        start = self.split_start(lines[0].decode('latin-1'))
+        headers = [split_field(line) for line in lines[1:]]
+        message = Message(head.decode('latin-1'), start, headers)
+        self.message = message
+        encoding = message.header('transfer-encoding')
+        length = message.header('content-length')
+        if not self.has_body(message):
+            self.finish(done)
+        elif encoding is not None:
+            codings = [c.strip().lower() for c in encoding.split(',')]
+            if codings[-1] == 'chunked':
+                self.state = CHUNKED
+                self.decoder = chunked.ChunkedDecoder(self.add_body)
+            elif isinstance(self, ResponseParser):
+                self.state = UNTIL_CLOSE
+            else:
+                raise HTTPError(400, 'Transfer-Encoding without chunked')
+        elif length is not None:
+            lengths = set(v.strip() for v in length.split(','))
+            length = lengths.pop()
+            if lengths or not (length.isascii() and length.isdigit()):
+                raise HTTPError(400, 'Bad Content-Length')
+            self.remaining = int(length)
+            if self.on_body is None and self.remaining > self.max_body:
+                raise HTTPError(413, 'Content Too Large')
+            self.state = BODY
+            if not self.remaining:
+                self.finish(done)
+        elif isinstance(self, ResponseParser):
+            self.state = UNTIL_CLOSE
+        else:
+            self.finish(done)  # a request without a body
+
+    def has_body(self, message):
+        return True
+
+class RequestParser(Parser):
+
+    def switches(self, message):
+        tokens = [t.strip() for t in
+                  message.header('connection', '').lower().split(',')]
+        return 'upgrade' in tokens and message.header('upgrade') is not None
+
+    def split_start(self, line):
+        parts = line.split(' ')
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise HTTPError(400, 'Bad request line {!r}'.format(line[:100]))
+        return tuple(parts)
+
+class ResponseParser(Parser):
+    """Set `head_request` before a response to HEAD arrives: it has no
+    body whatever its headers say."""
+
+    head_request = False
+
+    def split_start(self, line):
+        parts = line.split(' ', 2)
+        if len(parts) == 2:
+            parts.append('')  # the reason phrase may be left out
+        if (len(parts) != 3 or not parts[0].startswith('HTTP/')
+                or not parts[1].isdigit()):
+            raise HTTPError(400, 'Bad status line {!r}'.format(line[:100]))
+        return tuple(parts)
+
+    def has_body(self, message):
+        return not (self.head_request or message.status < 200
+                    or message.status in (204, 304))
+
+    def switches(self, message):
+        return message.status == 101
+
+def split_field(line):
+    name, colon, value = line.decode('latin-1').partition(':')
+    if not colon or not name or name != name.strip():
+        raise HTTPError(400, 'Bad header field {!r}'.format(line[:100]))
+    return name, value.strip()
+
+def read_message(sock, parser, bufsize=BUFSIZE):
+    """Return the next message from a blocking socket, or None if the peer
+    closed the connection between messages. Messages that arrive along
+    with it wait in the parser for the next call."""
+    pending = parser.pending
+    if pending:
+        return pending.popleft()
+    if parser.recv_buffer is None:
+        parser.recv_buffer = bytearray(bufsize)
+    with memoryview(parser.recv_buffer) as view:
+        while not pending:
+            n = sock.recv_into(view)
+            if n:
+                pending.extend(parser.feed(view[:n]))
+            else:
+                pending.extend(parser.eof())
+                if not pending:
+                    return None
+    return pending.popleft()
+
+def error_response(error):
+    """The bytes a server sends for an HTTPError before closing."""
+    body = '{} {}\n'.format(error.status, error.reason).encode()
+    return ('HTTP/1.1 {} {}\r\nContent-Type: text/plain\r\n'
+            'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+                error.status, error.reason, len(body))).encode() + body
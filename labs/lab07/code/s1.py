@@ -1,77 +1,31 @@
 import socket, sys
 import urllib
+import httpparse
 
-def read_http_request(sock):
-    # Read headers until we find the empty line indicating the end of headers
-    request = b""
-    while b"\r\n\r\n" not in request:
-        n = sock.recv(1)
-        request += n
-        if not n:
-            return "", "", True
+def read_http_request(sock, parser):
+    # Read the next request: the parser takes whatever recv() returns, in
+    # large pieces, and keeps any part of a following request for later
+    request = httpparse.read_message(sock, parser)
+    if request is None:
+        return "", "", True
 
     print("\n============Raw request==========")
-    print(request)
+    print(request.head.encode("latin-1") + b"\r\n\r\n")
+    print("{} byte body".format(len(request.body)))
 
-    headers, body = request.split(b"\r\n\r\n", 1)
     print("\n============Parsed request==========")
-    print("Request Headers:\n", headers.decode())
-    
-    # Parse headers to find Content-Length or Transfer-Encoding
-    headers_str = headers.decode()
-    content_length = None
-    is_chunked = False
-    connection_close = False
+    print("Request Headers:\n", request.head)
 
-    for line in headers_str.split("\r\n"):
-        if line.lower().startswith("content-length"):
-            content_length = int(line.split(":")[1].strip())
-        elif line.lower().startswith("transfer-encoding") and "chunked" in line.lower():
-            is_chunked = True
-        elif line.lower().startswith("connection") and "close" in line.lower():
-            connection_close = True
-
-    if content_length is not None:
-        # If Content-Length is found, read the exact amount of remaining bytes
-        while len(body) < content_length:
-            body += sock.recv(1024)
-    elif is_chunked:
-        # If Transfer-Encoding is chunked, handle it accordingly
-        body += read_chunked_request(sock)
-
-    return headers_str, body.decode(), connection_close
-
-def read_chunked_request(sock):
-    request = b""
-    while True:
-        chunk_size_str = b""
-
-        # Read chunk size in hexadecimal
-        while b"\r\n" not in chunk_size_str:
-            chunk_size_str += sock.recv(1)
-        chunk_size = int(chunk_size_str.strip(), 16)
-
-        # End of the message when chunk size is 0
-        if chunk_size == 0:
-            break
-
-        # Read the chunk data
-        chunk_data = b''
-        while len(chunk_data) < chunk_size:
-          chunk_data += sock.recv(1)
-
-        request += chunk_data
-
-        # Read the trailing \r\n
-        sock.recv(2) 
-
-    return request
+    # The parser has already read the body, whether it came with a
+    # Content-Length or chunked, and knows if the connection should close
+    return request.head, request.body.decode(errors="replace"), not request.keep_alive
 
 def handle_client_connection(client_socket):
+    parser = httpparse.RequestParser(upgrade=False)  # never switches
     try:
         while True:
             # Read the HTTP request from the client
-            headers, body, connection_close = read_http_request(client_socket)
+            headers, body, connection_close = read_http_request(client_socket, parser)
             if not headers:
                 break
             
@@ -109,8 +63,13 @@ Connection: keep-alive\r\n\r\n
             if connection_close:
                 print("Connection will be closed as per the request.")
                 break
+    except httpparse.HTTPError as e:
+        # Malformed or too large: say so, then hang up
+        print("\n🚫 Bad request: {}\n".format(e))
+        client_socket.sendall(httpparse.error_response(e))
     except:
         print("\n🔗☠️ Connection closed.\n")
+    finally:
         client_socket.close()
 
 def main():
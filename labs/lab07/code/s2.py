@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# The s1.py server for many clients at once: one asyncio event loop serves
+# every connection, so a browser holding a keep-alive connection open no
+# longer blocks everyone else. Requests are parsed with httpparse.py as
+# they arrive; a client may pipeline several, and gets the responses back
+# in the same order. Idle connections are closed after --idle-timeout
+# seconds, and every connection after --max-requests responses.
+#
+#   python3 s2.py 8080
+#   curl -v http://127.0.0.1:8080/a http://127.0.0.1:8080/b  # one connection
+
+import argparse, asyncio, html
+import httpparse
+
+def respond(request, keep_alive):
+    """Return the response to a request as bytes: s1.py's request details
+    page, or 404 for the favicon."""
+    if 'favicon.ico' in request.target:
+        status, content_type, body = '404 Not Found', 'text/plain', b''
+    else:
+        text = "<h1>Request Details</h1>"
+        text += "<h2>Headers:</h2><pre>{}</pre>".format(
+            html.escape(request.head).replace('\r\n', '<br/>'))
+        text += "<h2>Body:</h2><pre>{}</pre>".format(
+            html.escape(request.body.decode(errors='replace'))
+            if request.body else "No body received.")
+        status, content_type, body = '200 OK', 'text/html', text.encode()
+    head = ("HTTP/1.1 {}\r\n"
+            "Content-Type: {}\r\n"
+            "Content-Length: {}\r\n"
+            "Connection: {}\r\n\r\n").format(
+                status, content_type, len(body),
+                'keep-alive' if keep_alive else 'close')
+    if request.method == 'HEAD':
+        return head.encode()
+    return head.encode() + body
+
+class HTTPServerProtocol(asyncio.Protocol):
+    """One client connection, answered in the order its requests arrive."""
+
+    idle_timeout = 15.0  # seconds without a byte from the client
+    max_requests = 100   # per connection, then Connection: close
+    write_high = 64 * 1024  # stop reading while this much is unsent
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+        self.parser = httpparse.RequestParser(upgrade=False)  # never switches
+        self.served = 0
+        self.loop = asyncio.get_running_loop()
+        self.last_data = self.loop.time()
+        self.timer = self.loop.call_later(self.idle_timeout, self.check_idle)
+        transport.set_write_buffer_limits(self.write_high)
+        print('Accepted connection from {}'.format(self.address))
+
+    def data_received(self, data):
+        self.last_data = self.loop.time()
+        try:
+            requests = self.parser.feed(data)
+        except httpparse.HTTPError as e:
+            print('Bad request from {}: {}'.format(self.address, e))
+            self.transport.write(httpparse.error_response(e))
+            self.transport.close()
+            return
+        # Answer all the pipelined requests this data completed with one
+        # write; they were parsed, and are answered, in order.
+        responses = []
+        last = False
+        for request in requests:
+            self.served += 1
+            last = (not request.keep_alive
+                    or self.served >= self.max_requests)
+            responses.append(respond(request, keep_alive=not last))
+            if last:
+                break  # anything pipelined after it goes unanswered
+        if responses:
+            self.transport.write(b''.join(responses))
+        if last:
+            self.transport.close()
+
+    def pause_writing(self):
+        # The client pipelines faster than it reads its responses: stop
+        # reading its requests until the transport has sent what it holds.
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def check_idle(self):
+        # One timer per connection, moved on only when it fires, rather
+        # than cancelled and rescheduled for every piece of data.
+        deadline = self.last_data + self.idle_timeout
+        if self.loop.time() >= deadline:
+            print('Closing idle connection from {}'.format(self.address))
+            self.transport.close()
+        else:
+            self.timer = self.loop.call_at(deadline, self.check_idle)
+
+    def connection_lost(self, exc):
+        self.timer.cancel()
+        print('Closed connection from {} after {} request(s)'.format(
+            self.address, self.served))
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent HTTP server')
+    parser.add_argument('port', nargs='?', type=int, default=8080,
+                        help='port to listen on (default 8080)')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--idle-timeout', type=float,
+                        default=HTTPServerProtocol.idle_timeout,
+                        help='close a connection idle this many seconds '
+                             '(default %(default)s)')
+    parser.add_argument('--max-requests', type=int,
+                        default=HTTPServerProtocol.max_requests,
+                        help='close a connection after this many requests '
+                             '(default %(default)s)')
+    args = parser.parse_args()
+    HTTPServerProtocol.idle_timeout = args.idle_timeout
+    HTTPServerProtocol.max_requests = args.max_requests
+
+    async def serve():
+        server = await asyncio.get_running_loop().create_server(
+            HTTPServerProtocol, args.host, args.port, backlog=1024)
+        print(f"Listening on http://{args.host}:{args.port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
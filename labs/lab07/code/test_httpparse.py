@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# max_body limits only bodies the parser keeps: streamed through on_body,
+# a body of any size is accepted, with either framing.
+#
+#   python3 -m pytest test_httpparse.py
+
+import pytest
+import httpparse
+
+SIZE = 100 * 1024 * 1024  # over MAX_BODY
+
+def stream(head, body_pieces):
+    received = [0]
+    def on_body(message, data):
+        received[0] += len(data)
+    parser = httpparse.RequestParser(on_body=on_body)
+    messages = parser.feed(head)
+    for piece in body_pieces:
+        messages += parser.feed(piece)
+    return messages, received[0]
+
+def content_length_body():
+    piece = b'x' * (1024 * 1024)
+    return [piece] * (SIZE // len(piece))
+
+def chunked_body():
+    piece = b'x' * (1024 * 1024)
+    chunk = b'%x\r\n' % len(piece) + piece + b'\r\n'
+    return [chunk] * (SIZE // len(piece)) + [b'0\r\n\r\n']
+
+def test_content_length_streams_past_max_body():
+    head = b'POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % SIZE
+    messages, received = stream(head, content_length_body())
+    assert len(messages) == 1 and received == SIZE
+
+def test_chunked_streams_past_max_body():
+    head = b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+    messages, received = stream(head, chunked_body())
+    assert len(messages) == 1 and received == SIZE
+
+def test_content_length_over_max_body_kept_is_refused():
+    head = b'POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % SIZE
+    with pytest.raises(httpparse.HTTPError) as error:
+        httpparse.RequestParser().feed(head)
+    assert error.value.status == 413
+
+def test_chunked_over_max_body_kept_is_refused():
+    head = b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+    parser = httpparse.RequestParser(max_body=1024)
+    with pytest.raises(httpparse.HTTPError) as error:
+        parser.feed(head + chunked_body()[0])
+    assert error.value.status == 413
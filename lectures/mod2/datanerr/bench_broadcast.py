@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# Fan-out latency of ws.py --broadcast: thousands of local subscribers,
+# one publisher sending timestamped messages; reports how long after it
+# was sent each subscriber got each message, and how long a message took
+# to reach the last of them. A second test stalls some subscribers (they
+# never read) and compares the server's memory with the per-client send
+# queue bounded and unbounded.
+
+import argparse, asyncio, multiprocessing, os, socket, struct, subprocess
+import sys, time
+import lab07  # noqa: F401, see lab07.py
+import httpparse, wsframe
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAMP = struct.Struct('!dI')  # when the message was sent, its number
+
+class Subscriber(asyncio.Protocol):
+    """A client that records the latency of every message it receives;
+    `done` is set once it has `expected` of them. A stalled one stops
+    reading right after the handshake."""
+
+    def __init__(self, expected, stall=False):
+        self.expected = expected
+        self.stall = stall
+        self.latencies = []  # (message number, seconds)
+        self.lost = False
+        loop = asyncio.get_running_loop()
+        self.ready = loop.create_future()
+        self.done = loop.create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        request, self.key = wsframe.handshake_request('localhost')
+        transport.write(request)
+        self.parser = httpparse.ResponseParser()
+        self.decoder = None
+
+    def data_received(self, data):
+        if self.decoder is None:
+            responses = self.parser.feed(data)
+            if not responses:
+                return
+            wsframe.check_response(responses[0], self.key)
+            self.decoder = wsframe.Decoder(masked=False)
+            data = bytes(self.parser.buffer)
+            if self.stall:
+                self.transport.pause_reading()
+            self.ready.set_result(None)
+        now = time.time()
+        for opcode, payload in self.decoder.feed(data):
+            sent, number = STAMP.unpack_from(payload)
+            self.latencies.append((number, now - sent))
+        if len(self.latencies) >= self.expected and not self.done.done():
+            self.done.set_result(None)
+
+    def connection_lost(self, exc):
+        self.lost = True
+        if not self.ready.done():
+            self.ready.set_exception(EOFError('closed during the handshake'))
+
+async def connect(port, expected, stall=False):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    if stall:
+        # A small receive window, so that what the stalled client does not
+        # read piles up in the server rather than in this kernel
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await loop.sock_connect(sock, ('127.0.0.1', port))
+    transport, subscriber = await loop.create_connection(
+        lambda: Subscriber(expected, stall), sock=sock)
+    await subscriber.ready
+    return subscriber
+
+def subscribe(port, count, stalled, expected, ready, results):
+    async def run():
+        limit = asyncio.Semaphore(200)  # connections being opened at once
+        async def one(stall):
+            async with limit:
+                return await connect(port, expected, stall)
+        subscribers = await asyncio.gather(
+            *[one(i < stalled) for i in range(count)])
+        ready.put(None)
+        fast = [s for s in subscribers if not s.stall]
+        await asyncio.wait([s.done for s in fast], timeout=60)
+        # A paused transport does not notice that the server hung up:
+        # read again to find out which stalled subscribers it dropped
+        for s in subscribers:
+            if s.stall and not s.lost:
+                s.transport.resume_reading()
+        await asyncio.sleep(1)
+        latencies = [l for s in fast for l in s.latencies]
+        complete = sum(s.done.done() for s in fast)
+        lost = sum(s.lost for s in subscribers if s.stall)
+        for s in subscribers:
+            s.transport.abort()
+        return latencies, complete, lost
+    results.put(asyncio.run(run()))
+
+async def publish(port, messages, size, interval):
+    publisher = await connect(port, messages)
+    padding = bytes(max(0, size - STAMP.size))
+    for number in range(messages):
+        payload = STAMP.pack(time.time(), number) + padding
+        publisher.transport.write(wsframe.encode(wsframe.BINARY, payload,
+                                                 mask=True))
+        await asyncio.sleep(interval)
+    await asyncio.wait_for(publisher.done, 60)
+    publisher.transport.abort()
+
+def server_rss(pid):
+    """Peak resident set size of process `pid`, in MB."""
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) // 1024
+
+def measure(port, subscribers, stalled, processes, messages, size, interval,
+            options=()):
+    server = subprocess.Popen([sys.executable, 'ws.py', str(port), '-q',
+                               '--broadcast'] + list(options),
+                              cwd=HERE, stdout=subprocess.DEVNULL)
+    try:
+        for i in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=subscribe, args=(
+            port, subscribers // processes, stalled // processes, messages,
+            ready, results)) for i in range(processes)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            ready.get()
+        asyncio.run(publish(port, messages, size, interval))
+        latencies, complete, lost = [], 0, 0
+        for p in procs:
+            l, c, s = results.get()
+            latencies += l
+            complete += c
+            lost += s
+        for p in procs:
+            p.join()
+        rss = server_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return latencies, complete, lost, rss
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebSocket fan-out latency')
+    parser.add_argument('-p', metavar='port', type=int, default=8400,
+                        help='first TCP port to use (default 8400)')
+    parser.add_argument('-s', metavar='subscribers', type=int, default=10000,
+                        help='subscribers (default 10000)')
+    parser.add_argument('-n', metavar='processes', type=int, default=4,
+                        help='subscriber processes (default 4)')
+    parser.add_argument('-m', metavar='messages', type=int, default=10,
+                        help='messages published per run (default 10)')
+    parser.add_argument('-i', metavar='seconds', type=float, default=0.5,
+                        help='interval between messages (default 0.5)')
+    args = parser.parse_args()
+    port = args.p
+
+    print('{} subscribers, {} messages {} s apart'.format(args.s, args.m,
+                                                          args.i))
+    print('{:>8} {:>10} {:>9} {:>9} {:>9} {:>12}'.format(
+        'payload', 'delivered', 'p50 ms', 'p99 ms', 'max ms', 'fan-out ms'))
+    for size in (64, 4096):
+        latencies, complete, lost, rss = measure(
+            port, args.s, 0, args.n, args.m, size, args.i)
+        port += 1
+        last = {}  # message number: latency of its last delivery
+        for number, seconds in latencies:
+            last[number] = max(last.get(number, 0), seconds)
+        latencies = sorted(seconds for number, seconds in latencies)
+        print('{:>8} {:>10} {:>9.1f} {:>9.1f} {:>9.1f} {:>12.1f}'.format(
+            size, len(latencies), percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, latencies[-1] * 1000,
+            sum(last.values()) / len(last) * 1000))
+
+    # Enough for each stalled subscriber to fill the kernel's socket
+    # buffers (up to 4 MB) and then the server's queue
+    subscribers, stalled, messages, size = 400, 40, 160, 65536
+    print()
+    print('{} subscribers, {} of them never reading; {} messages of {} '
+          'bytes'.format(subscribers, stalled, messages, size))
+    print('{:>18} {:>15} {:>20} {:>11}'.format(
+        'send queue', 'fast complete', 'stalled disconnected', 'server RSS'))
+    for label, options in (
+            ('1 MiB, close', ['--max-queue', str(1 << 20)]),
+            ('1 MiB, drop', ['--max-queue', str(1 << 20), '--slow', 'drop']),
+            ('unbounded', ['--max-queue', str(1 << 62)])):
+        latencies, complete, lost, rss = measure(
+            port, subscribers, stalled, args.n, messages, size, 0.01, options)
+        port += 1
+        print('{:>18} {:>9}/{:<5} {:>14}/{:<5} {:>8} MB'.format(
+            label, complete, subscribers - stalled, lost, stalled, rss))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Messages per second through the ws.py echo server, with clients sending
+# one message at a time or pipelining several, and the cost of unmasking
+# a payload byte by byte versus wsframe.unmask().
+
+import argparse, asyncio, multiprocessing, os, socket, subprocess, sys, time
+import timeit
+import lab07  # noqa: F401, see lab07.py
+import httpparse, wsframe
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def unmask_bytewise(data, mask):
+    """How ws.py would have had to unmask, one byte at a time."""
+    return bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+def bench_unmask():
+    print('{:>9} {:>14} {:>14} {:>9}'.format(
+        'payload', 'bytewise MB/s', 'unmask() MB/s', 'speedup'))
+    mask = os.urandom(4)
+    for size in (125, 1024, 4096, 65536, 1 << 20):
+        data = os.urandom(size)
+        assert unmask_bytewise(data, mask) == wsframe.unmask(data, mask)
+        rates = []
+        for function in (unmask_bytewise, wsframe.unmask):
+            number = max(1, 2000000 // size)
+            seconds = timeit.timeit(lambda: function(data, mask),
+                                    number=number) / number
+            rates.append(size / seconds / 1e6)
+        print('{:>9} {:>14.1f} {:>14.1f} {:>8.0f}x'.format(
+            size, rates[0], rates[1], rates[1] / rates[0]))
+
+async def open_websocket(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    request, key = wsframe.handshake_request('localhost')
+    writer.write(request)
+    parser = httpparse.ResponseParser()
+    responses = []
+    while not responses:
+        data = await reader.read(65536)
+        if not data:
+            raise EOFError('closed during the handshake')
+        responses = parser.feed(data)
+    wsframe.check_response(responses[0], key)
+    decoder = wsframe.Decoder(masked=False)
+    return reader, writer, decoder, decoder.feed(bytes(parser.buffer))
+
+async def conversation(port, size, depth, deadline, counts):
+    reader, writer, decoder, events = await open_websocket(port)
+    # The same masked frames every time: masking them afresh would load
+    # the client, which shares the CPU with the server, not the server.
+    batch = wsframe.encode(wsframe.BINARY, os.urandom(size), mask=True) * depth
+    while time.time() < deadline:
+        writer.write(batch)
+        got = len(events)
+        while got < depth:
+            data = await reader.read(262144)
+            if not data:
+                raise EOFError('server closed the connection')
+            got += len(decoder.feed(data))
+        events = []
+        counts[0] += depth
+    writer.write(wsframe.encode_close(mask=True))
+    writer.close()
+
+def client(port, connections, size, depth, seconds, results):
+    async def run():
+        counts = [0]
+        deadline = time.time() + seconds
+        await asyncio.gather(*[conversation(port, size, depth, deadline,
+                                            counts)
+                               for i in range(connections)])
+        return counts[0]
+    results.put(asyncio.run(run()))
+
+def measure(port, connections, processes, size, depth, seconds):
+    server = subprocess.Popen([sys.executable, 'ws.py', str(port), '-q'],
+                              cwd=HERE, stdout=subprocess.DEVNULL)
+    try:
+        for i in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client, args=(
+            port, connections // processes, size, depth, seconds, results))
+            for i in range(processes)]
+        for p in procs:
+            p.start()
+        messages = sum(results.get() for p in procs)
+        for p in procs:
+            p.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return messages / seconds
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebSocket echo speed')
+    parser.add_argument('-p', metavar='port', type=int, default=8300,
+                        help='first TCP port to use (default 8300)')
+    parser.add_argument('-c', metavar='connections', type=int, default=50,
+                        help='client connections (default 50)')
+    parser.add_argument('-n', metavar='processes', type=int, default=2,
+                        help='client processes (default 2)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=3.0,
+                        help='duration of each run (default 3)')
+    args = parser.parse_args()
+
+    bench_unmask()
+    print()
+    print('{} connections echoing through ws.py, {} s per run'.format(
+        args.c, args.t))
+    print('{:>9} {:>7} {:>12} {:>10}'.format('payload', 'depth', 'messages/s',
+                                             'MB/s'))
+    port = args.p
+    for size, depth in [(16, 1), (16, 32), (4096, 1), (4096, 16),
+                        (65536, 4)]:
+        rate = measure(port, args.c, args.n, size, depth, args.t)
+        port += 1
+        print('{:>9} {:>7} {:>12.0f} {:>10.1f}'.format(
+            size, depth, rate, rate * size / 1e6))
@@ -1,5 +1,8 @@
 import socket
 
+import lab07  # noqa: F401, see lab07.py
+import chunked
+
 def client():
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client_socket.connect(('localhost', 8080))
@@ -11,11 +14,12 @@ def client():
         "Transfer-Encoding: chunked\r\n"
         "Content-Type: text/plain\r\n"
         "\r\n"
-        "5\r\nHello\r\n7\r\n, Chunked\r\n0\r\n\r\n"
     )
 
-    # Send the HTTP request
+    # Send the HTTP request headers, then the body a chunk at a time as it
+    # is produced: here two pieces, but any iterable or an open file works
     client_socket.sendall(request.encode())
+    chunked.send_chunked(client_socket, [b"Hello", b", Chunked"])
 
     # Receive the HTTP response
     response = b''
@@ -1,23 +1,23 @@
 import socket
 
-def handle_client(conn):
-    # Read the HTTP request headers
-    headers = b''
-    while b'\r\n\r\n' not in headers:
-        headers += conn.recv(1)
+import lab07  # noqa: F401, see lab07.py
+import httpparse
 
-    # Parse headers
-    headers = headers.decode()
-    print(f"Headers received:\n{headers}")
+def handle_client(conn):
+    # Read the HTTP request: headers, then a Content-Length body, fed to
+    # the parser as it arrives however recv() splits it
+    try:
+        request = httpparse.read_message(conn, httpparse.RequestParser())
+    except httpparse.HTTPError as e:
+        conn.sendall(httpparse.error_response(e))
+        conn.close()
+        return
+    if request is None:
+        conn.close()
+        return
+    print(f"Headers received:\n{request.head}")
 
-    # Extract Content-Length
-    content_length = 0
-    for line in headers.splitlines():
-        if line.startswith("Content-Length"):
-            content_length = int(line.split(":")[1].strip())
-    
-    # Read the body based on Content-Length
-    body = conn.recv(content_length).decode()
+    body = request.body.decode()
     print(f"Body received: {body}")
 
     # Send HTTP response
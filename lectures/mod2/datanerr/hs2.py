@@ -1,45 +1,38 @@
 import socket
 
-def handle_client(conn):
-    # Read the HTTP request headers
-    headers = b''
-    while b'\r\n\r\n' not in headers:
-        headers += conn.recv(1)
-
-    # Parse headers
-    headers = headers.decode()
-    print(f"Headers received:\n{headers}")
-
-    # Read the body chunk by chunk
-    body = ''
-    while True:
-        # Read chunk size (in hex)
-        chunk_size_line = b''
-        while b'\r\n' not in chunk_size_line:
-            chunk_size_line += conn.recv(1)
-
-        # Convert chunk size from hex to integer
-        try:
-            chunk_size = int(chunk_size_line.decode().strip(), 16)
-        except ValueError:
-            break
+import lab07  # noqa: F401, see lab07.py
+import httpparse
 
-        if chunk_size == 0:
-            # Final chunk (size 0) marks the end of the body
-            conn.recv(2)  # Consume the trailing \r\n after the last chunk
-            break
+PREVIEW = 1024  # bytes of the body to print
 
-        # Read the chunk data (until chunk_size)
-        chunk_data = b''
-        while len(chunk_data) < chunk_size:
-            chunk_data += conn.recv(chunk_size - len(chunk_data))
-
-        body += chunk_data.decode()
-
-        # Read the trailing \r\n after each chunk
-        conn.recv(2)
-
-    print(f"Body received (chunked): {body}")
+def handle_client(conn):
+    # Read the HTTP request; the parser decodes the chunked body as it
+    # arrives, reading the socket in large pieces rather than a byte at a
+    # time, and passes each piece to on_body() instead of keeping it all:
+    # a body of any size takes no more memory than a short one
+    size = 0
+    preview = bytearray()
+
+    def on_body(request, data):
+        nonlocal size
+        size += len(data)
+        if len(preview) < PREVIEW:
+            preview.extend(data[:PREVIEW - len(preview)])
+
+    try:
+        request = httpparse.read_message(
+            conn, httpparse.RequestParser(on_body=on_body))
+    except httpparse.HTTPError as e:
+        conn.sendall(httpparse.error_response(e))
+        conn.close()
+        return
+    if request is None:
+        conn.close()
+        return
+    print(f"Headers received:\n{request.head}")
+
+    body = preview.decode(errors="replace")
+    print(f"Body received (chunked, {size} bytes): {body}")
 
     # Send HTTP response
     response = (
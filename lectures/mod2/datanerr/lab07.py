@@ -0,0 +1,11 @@
+# The HTTP parser (httpparse.py) and the chunked encoder/decoder
+# (chunked.py) live with the lab07 HTTP server in labs/lab07/code. The
+# scripts here import this module first, which puts that directory on
+# sys.path, so that they share those files rather than copy them.
+
+import os, sys
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    '..', '..', '..', 'labs', 'lab07', 'code')
+if CODE not in sys.path:
+    sys.path.insert(0, CODE)
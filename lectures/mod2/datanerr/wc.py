@@ -1,55 +1,53 @@
-import socket
-import base64
-import hashlib
-
-def generate_websocket_key():
-    """Generate a random WebSocket key."""
-    return base64.b64encode(hashlib.sha1().digest()).decode().strip()
-
-def client():
+import socket, sys
+
+import lab07  # noqa: F401, see lab07.py
+import httpparse
+import wsframe
+
+def receive(sock, decoder, pending):
+    """Return the next message or control frame from the server; any that
+    arrived along with it wait in the list `pending`."""
+    while not pending:
+        data = sock.recv(65536)
+        if not data:
+            raise EOFError('server closed the connection')
+        pending.extend(decoder.feed(data))
+    return pending.pop(0)
+
+def client(port=8080):
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client_socket.connect(('localhost', 8080))
+    client_socket.connect(('localhost', port))
 
     # Perform WebSocket handshake
-    websocket_key = generate_websocket_key()
-    handshake_request = (
-        "GET / HTTP/1.1\r\n"
-        "Host: localhost\r\n"
-        "Upgrade: websocket\r\n"
-        "Connection: Upgrade\r\n"
-        "Sec-WebSocket-Key: " + websocket_key + "\r\n"
-        "Sec-WebSocket-Version: 13\r\n"
-        "\r\n"
-    )
-    client_socket.sendall(handshake_request.encode())
-
-    # Receive WebSocket handshake response
-    response = client_socket.recv(1024).decode()
-    print(f"Handshake response:\n{response}")
-
-    # Send a WebSocket frame
+    handshake_request, websocket_key = wsframe.handshake_request('localhost')
+    client_socket.sendall(handshake_request)
+
+    # Receive WebSocket handshake response, and check that the server
+    # answered our key
+    parser = httpparse.ResponseParser()
+    response = httpparse.read_message(client_socket, parser)
+    print(f"Handshake response:\n{response.head}\n")
+    wsframe.check_response(response, websocket_key)
+
+    # Frames from the server are not masked; any that came right behind
+    # the handshake response are still in the parser
+    decoder = wsframe.Decoder(masked=False)
+    pending = decoder.feed(bytes(parser.buffer))
+
+    # Send a WebSocket frame: from a client, the payload must be masked
     message = "Hello, Server!"
-    payload = message.encode()
-    payload_length = len(payload)
-
-    frame = bytearray()
-    frame.append(0x81)  # Text frame opcode and FIN bit
-    if payload_length <= 125:
-        frame.append(payload_length)
-    elif payload_length <= 65535:
-        frame.append(126)
-        frame.extend(payload_length.to_bytes(2, byteorder='big'))
-    else:
-        frame.append(127)
-        frame.extend(payload_length.to_bytes(8, byteorder='big'))
-    frame.extend(payload)
-
-    client_socket.sendall(frame)
-
-    # Receive and print the echoed message
-    response = client_socket.recv(1024)
-    print(f"Echoed message: {response[2:].decode()}")  # Skip the WebSocket frame header
+    client_socket.sendall(wsframe.encode(wsframe.TEXT, message, mask=True))
+
+    # Receive and print the echoed message, however the frame arrives
+    opcode, payload = receive(client_socket, decoder, pending)
+    print(f"Echoed message: {payload}")
+
+    # Close the connection the WebSocket way: send a close frame and wait
+    # for the server's
+    client_socket.sendall(wsframe.encode_close(mask=True))
+    opcode, payload = receive(client_socket, decoder, pending)
+    print(f"Closed: {wsframe.parse_close(payload)}")
 
     client_socket.close()
 
-client()
+client(int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
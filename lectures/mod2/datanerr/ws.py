@@ -1,60 +1,156 @@
-import socket
-import base64
-import hashlib
-
-def generate_websocket_accept_key(websocket_key):
-    """Generate WebSocket accept key for handshake."""
-    websocket_guid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
-    accept_key = base64.b64encode(hashlib.sha1((websocket_key + websocket_guid).encode()).digest()).decode()
-    return accept_key
-
-def handle_client(conn):
-    # Perform WebSocket handshake
-    request = conn.recv(1024).decode()
-    headers = dict(line.split(': ', 1) for line in request.splitlines()[1:] if ': ' in line)
-    websocket_key = headers.get('Sec-WebSocket-Key')
-    accept_key = generate_websocket_accept_key(websocket_key)
-
-    handshake_response = (
-        "HTTP/1.1 101 Switching Protocols\r\n"
-        "Upgrade: websocket\r\n"
-        "Connection: Upgrade\r\n"
-        "Sec-WebSocket-Accept: " + accept_key + "\r\n"
-        "\r\n"
-    )
-    conn.sendall(handshake_response.encode())
-
-    while True:
-        # Read WebSocket frame
-        frame = conn.recv(1024)
-        if not frame:
-            break
-
-        # Parse WebSocket frame (simplified)
-        payload_length = frame[1] & 127
-        if payload_length == 126:
-            payload_length = int.from_bytes(frame[2:4], byteorder='big')
-        elif payload_length == 127:
-            payload_length = int.from_bytes(frame[2:10], byteorder='big')
-        
-        payload = frame[2 + (4 if payload_length == 126 else 10 if payload_length == 127 else 0):]
-
-        print(f"Received message: {payload.decode()}")
-
-        # Echo the received message
-        conn.sendall(frame)  # Echo back the frame (simplified)
-
-    conn.close()
+import argparse, asyncio
+
+import lab07  # noqa: F401, see lab07.py
+import httpparse
+import wsframe
+
+class Hub(object):
+    """Broadcast mode: every message any client sends goes to all of them.
+    The frame is encoded once and the same bytes object is written to
+    every subscriber (the transport copies it only if the socket will not
+    take it all at once). A subscriber with more than `max_queue` bytes
+    still unsent is too slow to keep up: it misses the message if
+    `slow` is 'drop', or is disconnected if it is 'close'."""
+
+    def __init__(self, max_queue=1024 * 1024, slow='close'):
+        self.subscribers = set()
+        self.max_queue = max_queue
+        self.slow = slow
+        self.dropped = 0       # messages not sent to slow subscribers
+        self.disconnected = 0  # slow subscribers hung up on
+
+    def publish(self, opcode, payload):
+        frame = wsframe.encode(opcode, payload)
+        for subscriber in list(self.subscribers):
+            transport = subscriber.transport
+            if transport.get_write_buffer_size() <= self.max_queue:
+                transport.write(frame)
+            elif self.slow == 'drop':
+                self.dropped += 1
+            else:
+                # abort(), not close(): what it has not read yet is gone
+                # at once rather than sent first
+                print(f"Disconnecting slow subscriber {subscriber.address}")
+                self.subscribers.discard(subscriber)
+                self.disconnected += 1
+                transport.abort()
+
+class WebSocketServer(asyncio.Protocol):
+    """One client connection: the HTTP upgrade handshake, then an echo of
+    every message it sends, or in broadcast mode its messages published
+    to all clients through the hub. Frames may arrive split across reads
+    or many to a read; all the replies to one read go out in one write."""
+
+    quiet = False
+    hub = None  # a Hub in broadcast mode
+    write_high = 256 * 1024  # stop reading while this much is unsent
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+        self.parser = httpparse.RequestParser()  # until the upgrade
+        self.decoder = None
+        transport.set_write_buffer_limits(self.write_high)
+        print(f"Connected by {self.address}")
+
+    def data_received(self, data):
+        if self.decoder is None:
+            data = self.handshake(data)
+            if not data:
+                return
+        try:
+            events = self.decoder.feed(data)
+        except wsframe.WebSocketError as e:
+            print(f"Protocol error from {self.address}: {e}")
+            self.transport.write(wsframe.encode_close(e.code, str(e)))
+            self.transport.close()
+            return
+        replies = []
+        for opcode, payload in events:
+            if opcode in (wsframe.TEXT, wsframe.BINARY):
+                if not self.quiet:
+                    print(f"Received message: {payload}")
+                if self.hub:
+                    self.hub.publish(opcode, payload)
+                else:
+                    replies.append(wsframe.encode(opcode, payload))  # echo
+            elif opcode == wsframe.PING:
+                replies.append(wsframe.encode(wsframe.PONG, payload))
+            elif opcode == wsframe.CLOSE:
+                # Echo the status code, then hang up
+                replies.append(wsframe.encode(wsframe.CLOSE, payload[:2]))
+                self.transport.write(b''.join(replies))
+                self.transport.close()
+                return
+        if replies:
+            self.transport.write(b''.join(replies))
+
+    def handshake(self, data):
+        """Read the upgrade request; return whatever data followed it."""
+        try:
+            requests = self.parser.feed(data)
+            if not requests:
+                return b''
+            response = wsframe.handshake_response(requests[0])
+        except (httpparse.HTTPError, wsframe.HandshakeError) as e:
+            print(f"Bad handshake from {self.address}: {e}")
+            error = e if isinstance(e, httpparse.HTTPError) else \
+                httpparse.HTTPError(400, 'Bad Request')
+            self.transport.write(httpparse.error_response(error))
+            self.transport.close()
+            return b''
+        self.transport.write(response)
+        self.decoder = wsframe.Decoder()
+        if self.hub:
+            self.hub.subscribers.add(self)
+        data = bytes(self.parser.buffer)  # frames sent right behind it
+        self.parser = None
+        return data
+
+    def pause_writing(self):
+        # The client sends faster than it reads: stop reading until the
+        # replies it has not taken yet are sent.
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        if self.hub:
+            self.hub.subscribers.discard(self)
+        print(f"Disconnected {self.address}")
 
 def server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(('localhost', 8080))
-    server_socket.listen(1)
-    print("WebSocket server is listening on port 8080...")
+    parser = argparse.ArgumentParser(description='WebSocket echo server')
+    parser.add_argument('port', nargs='?', type=int, default=8080,
+                        help='port to listen on (default 8080)')
+    parser.add_argument('-q', action='store_true',
+                        help='do not print every message')
+    parser.add_argument('--broadcast', action='store_true',
+                        help='send every message to all clients, not back')
+    parser.add_argument('--max-queue', metavar='BYTES', type=int,
+                        default=1024 * 1024,
+                        help='unsent bytes allowed per client in broadcast '
+                        'mode (default 1 MiB)')
+    parser.add_argument('--slow', choices=['drop', 'close'], default='close',
+                        help='what happens to a client over --max-queue: '
+                        'it misses messages, or is disconnected (default)')
+    args = parser.parse_args()
+    WebSocketServer.quiet = args.q
+    if args.broadcast:
+        WebSocketServer.hub = Hub(args.max_queue, args.slow)
+
+    async def serve():
+        server = await asyncio.get_running_loop().create_server(
+            WebSocketServer, 'localhost', args.port, backlog=1024)
+        print(f"WebSocket server is listening on port {args.port}...")
+        async with server:
+            await server.serve_forever()
 
-    while True:
-        conn, addr = server_socket.accept()
-        print(f"Connected by {addr}")
-        handle_client(conn)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
 
-server()
+if __name__ == '__main__':
+    server()
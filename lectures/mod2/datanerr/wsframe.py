@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# WebSocket (RFC 6455) framing without a library: an incremental decoder
+# that takes whatever recv() returned (a frame split across reads, or many
+# frames in one read) and returns whole messages, reassembled from their
+# fragments and unmasked; an encoder for single or fragmented messages,
+# masked or not; and the opening handshake for both sides.
+#
+#   decoder = wsframe.Decoder()  # a server's: client frames must be masked
+#   for opcode, payload in decoder.feed(sock.recv(65536)):
+#       sock.sendall(wsframe.encode(opcode, payload))  # echo
+
+import base64, hashlib, os, struct
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Opcodes
+CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+CONTROL = (CLOSE, PING, PONG)
+
+# Close codes
+NORMAL, GOING_AWAY, PROTOCOL_ERROR, INVALID_DATA, TOO_BIG = (
+    1000, 1001, 1002, 1007, 1009)
+
+MAX_MESSAGE = 16 * 1024 * 1024
+SMALL = 4096  # payloads up to this many bytes are unmasked as one integer
+
+class WebSocketError(Exception):
+    """The peer broke the protocol; `code` is the close code to send."""
+
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+
+class HandshakeError(Exception):
+    """The opening handshake failed."""
+
+_tables = {}  # key byte: bytes.translate() table XORing every byte with it
+
+def unmask(data, mask):
+    """Return `data` XORed with the 4-byte `mask`, repeated. A short
+    payload is XORed as one big integer, a long one in four strided
+    passes of bytes.translate(): either way in C, not byte by byte."""
+    n = len(data)
+    if n <= SMALL:
+        key = (mask * (n // 4 + 1))[:n]
+        return (int.from_bytes(data, 'little')
+                ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+    data = bytes(data)
+    out = bytearray(n)
+    for i in range(4):
+        table = _tables.get(mask[i])
+        if table is None:
+            table = _tables[mask[i]] = bytes(b ^ mask[i] for b in range(256))
+        out[i::4] = data[i::4].translate(table)
+    return bytes(out)
+
+def header(opcode, length, fin=True, mask=None):
+    """Return the header of a frame with `length` bytes of payload."""
+    first = (0x80 if fin else 0) | opcode
+    bit = 0x80 if mask else 0
+    if length < 126:
+        head = struct.pack('!BB', first, bit | length)
+    elif length < 65536:
+        head = struct.pack('!BBH', first, bit | 126, length)
+    else:
+        head = struct.pack('!BBQ', first, bit | 127, length)
+    return head + mask if mask else head
+
+def encode(opcode, payload, fin=True, mask=False):
+    """Return one frame. Clients must pass mask=True: the payload is then
+    masked with a fresh random key."""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if mask:
+        key = os.urandom(4)
+        return header(opcode, len(payload), fin, key) + unmask(payload, key)
+    return header(opcode, len(payload), fin) + payload
+
+def encode_message(opcode, payload, fragment=None, mask=False):
+    """Return the frames of a message as one bytes object, split into
+    fragments of at most `fragment` bytes if given."""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if not fragment or len(payload) <= fragment:
+        return encode(opcode, payload, mask=mask)
+    frames = []
+    for start in range(0, len(payload), fragment):
+        frames.append(encode(opcode if not start else CONTINUATION,
+                             payload[start:start + fragment],
+                             fin=start + fragment >= len(payload), mask=mask))
+    return b''.join(frames)
+
+def encode_close(code=NORMAL, reason='', mask=False):
+    return encode(CLOSE, struct.pack('!H', code) + reason.encode()[:123],
+                  mask=mask)
+
+def parse_close(payload):
+    """Return the (code, reason) of a close frame's payload."""
+    if len(payload) < 2:
+        return 1005, ''  # no status code present
+    code, = struct.unpack('!H', payload[:2])
+    return code, payload[2:].decode('utf-8', 'replace')
+
+class Decoder(object):
+    """Incremental frame decoder for one connection. feed() returns the
+    (opcode, payload) of each message and control frame that the data
+    completes: TEXT payloads as str, others as bytes. A server's decoder
+    requires masked frames; pass masked=False for a client's."""
+
+    def __init__(self, masked=True, max_message=MAX_MESSAGE):
+        self.masked = masked
+        self.max_message = max_message
+        self.buffer = bytearray()
+        self.fragments = []   # of a message still being received
+        self.opcode = None    # of that message
+        self.size = 0         # of its fragments so far
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        events = []
+        pos = 0
+        try:
+            while len(buffer) - pos >= 2:
+                first, second = buffer[pos], buffer[pos + 1]
+                start = pos + 2
+                length = second & 0x7F
+                if length == 126:
+                    if len(buffer) - start < 2:
+                        break
+                    length, = struct.unpack_from('!H', buffer, start)
+                    start += 2
+                elif length == 127:
+                    if len(buffer) - start < 8:
+                        break
+                    length, = struct.unpack_from('!Q', buffer, start)
+                    start += 8
+                masked = second & 0x80
+                if masked and len(buffer) - start < 4:
+                    break
+                self.check(first, masked, length)
+                if masked:
+                    mask = bytes(buffer[start:start + 4])
+                    start += 4
+                if len(buffer) - start < length:
+                    break
+                payload = buffer[start:start + length]
+                if masked:
+                    payload = unmask(payload, mask)
+                pos = start + length
+                self.frame(first & 0x80, first & 0x0F, payload, events)
+        finally:
+            del buffer[:pos]
+        return events
+
+    def check(self, first, masked, length):
+        """Reject a frame from its header, before its payload arrives."""
+        opcode = first & 0x0F
+        if first & 0x70:
+            raise WebSocketError(PROTOCOL_ERROR, 'reserved bits set')
+        if bool(masked) != self.masked:
+            raise WebSocketError(PROTOCOL_ERROR, 'masked frame from a server'
+                                 if masked else 'unmasked frame from a client')
+        if opcode in CONTROL:
+            if not first & 0x80 or length > 125:
+                raise WebSocketError(PROTOCOL_ERROR, 'bad control frame')
+        elif opcode not in (CONTINUATION, TEXT, BINARY):
+            raise WebSocketError(PROTOCOL_ERROR,
+                                 'unknown opcode {}'.format(opcode))
+        elif self.size + length > self.max_message:
+            raise WebSocketError(TOO_BIG, 'message too big')
+
+    def frame(self, fin, opcode, payload, events):
+        if opcode in CONTROL:
+            events.append((opcode, bytes(payload)))
+            return
+        if opcode == CONTINUATION:
+            if self.opcode is None:
+                raise WebSocketError(PROTOCOL_ERROR, 'nothing to continue')
+        elif self.opcode is not None:
+            raise WebSocketError(PROTOCOL_ERROR, 'expected a continuation')
+        else:
+            self.opcode = opcode
+        if not fin:
+            self.fragments.append(payload)
+            self.size += len(payload)
+            return
+        if self.fragments:
+            self.fragments.append(payload)
+            payload = b''.join(self.fragments)
+            self.fragments = []
+            self.size = 0
+        opcode, self.opcode = self.opcode, None
+        if opcode == TEXT:
+            try:
+                payload = bytes(payload).decode('utf-8')
+            except UnicodeDecodeError:
+                raise WebSocketError(INVALID_DATA, 'text is not UTF-8') \
+                    from None
+        else:
+            payload = bytes(payload)
+        events.append((opcode, payload))
+
+def accept_key(key):
+    """The Sec-WebSocket-Accept value answering a Sec-WebSocket-Key."""
+    digest = hashlib.sha1((key + GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+def handshake_response(request):
+    """Return the 101 response accepting `request`, a parsed HTTP request
+    with a header() method (httpparse.Message); raise HandshakeError if it
+    is not a WebSocket upgrade."""
+    key = request.header('sec-websocket-key')
+    if (request.method != 'GET'
+            or 'websocket' not in request.header('upgrade', '').lower()
+            or 'upgrade' not in request.header('connection', '').lower()
+            or request.header('sec-websocket-version') != '13' or not key):
+        raise HandshakeError('not a WebSocket version 13 upgrade')
+    return ('HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {}\r\n\r\n'.format(accept_key(key))).encode()
+
+def handshake_request(host, path='/'):
+    """Return a client's upgrade request and the key it sent."""
+    key = base64.b64encode(os.urandom(16)).decode()
+    request = ('GET {} HTTP/1.1\r\n'
+               'Host: {}\r\n'
+               'Upgrade: websocket\r\n'
+               'Connection: Upgrade\r\n'
+               'Sec-WebSocket-Key: {}\r\n'
+               'Sec-WebSocket-Version: 13\r\n\r\n'.format(path, host, key))
+    return request.encode(), key
+
+def check_response(response, key):
+    """Raise HandshakeError unless `response` (httpparse.Message) accepts
+    the upgrade requested with `key`."""
+    if (response.status != 101
+            or response.header('sec-websocket-accept') != accept_key(key)):
+        raise HandshakeError('server refused the upgrade: {} {}'.format(
+            response.status, response.reason))
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+
+# asyncio engine for the BerryTella P2P framework (btpeer.py)
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+import traceback
+
+from btpeer import *
+
+
+#==============================================================================
+class AsyncBTPeer( BTPeer ):
+	""" A BTPeer whose server, outgoing connections and stabilizers all run
+	on one asyncio event loop instead of a thread per connection.
+
+	Handlers and routers are registered exactly as with BTPeer. A handler
+	may be a coroutine function, which runs on the event loop, or a plain
+	function, which runs on a bounded thread pool (self.maxworkers
+	threads) so that it may block and call connectandsend as before.
+	Existing BTPeer subclasses therefore run unchanged when mixed in
+	before this class, e.g.
+
+		class AsyncFilerPeer( FilerPeer, AsyncBTPeer ): pass
+
+	"""
+
+	loop = None         # event loop, set while mainloop is running
+	executor = None     # runs plain (blocking) handlers and stabilizers
+	maxworkers = 32     # size of that thread pool
+
+
+
+	#--------------------------------------------------------------------------
+	def __debug( self, msg ):
+	#--------------------------------------------------------------------------
+		if self.debug:
+			btdebug( msg )
+
+
+
+	#--------------------------------------------------------------------------
+	def __stabilizers( self ):
+	#--------------------------------------------------------------------------
+		# created lazily: subclasses such as FilerPeer call BTPeer.__init__
+		# directly, so this class cannot rely on its own constructor
+		if '_stabilizers' not in self.__dict__:
+			self._stabilizers = []
+		return self._stabilizers
+
+
+
+	#--------------------------------------------------------------------------
+	def __clients( self ):
+	#--------------------------------------------------------------------------
+		# tasks serving incoming connections, cancelled at shutdown;
+		# created lazily like the stabilizer list
+		if '_clients' not in self.__dict__:
+			self._clients = set()
+		return self._clients
+
+
+
+	#--------------------------------------------------------------------------
+	async def __call( self, func, *args ):
+	#--------------------------------------------------------------------------
+		""" Awaits func(*args) if it is a coroutine function, otherwise runs
+		it on the thread pool. """
+		if asyncio.iscoroutinefunction( func ):
+			return await func( *args )
+		return await self.loop.run_in_executor( self.executor, func, *args )
+
+
+
+	#--------------------------------------------------------------------------
+	async def __dispatch( self, peerconn, msgtype, msgdata ):
+	#--------------------------------------------------------------------------
+		msgtype = msgtype.upper()
+		if msgtype not in self.handlers:
+			self.__debug( 'Not handled: %s: %s' % (msgtype, msgdata) )
+			return
+		self.__debug( 'Handling peer msg: %s: %s' % (msgtype, msgdata) )
+		try:
+			await self.__call( self.handlers[ msgtype ], peerconn, msgdata )
+		except Exception:
+			if self.debug:
+				traceback.print_exc()
+
+
+
+	#--------------------------------------------------------------------------
+	async def __handlepeer( self, reader, writer ):
+	#--------------------------------------------------------------------------
+		"""
+		handlepeer( stream reader, stream writer ) -> ()
+
+		Coroutine version of BTPeer's handlepeer: dispatches one message,
+		or serves a multiplexed connection until the client leaves or the
+		peer shuts down.
+		"""
+		peerconn = AsyncBTPeerConnection( None, reader, writer, self.loop )
+		task = asyncio.current_task()
+		self.__clients().add( task )
+		try:
+			msgtype, msgdata = await peerconn.recvdata()
+			if msgtype and msgtype.upper() == MUXCONNECT:
+				peerconn.senddata( MUXACCEPT, '' )
+				await self.__handlemux( peerconn )
+			elif msgtype:
+				await self.__dispatch( peerconn, msgtype, msgdata )
+			await writer.drain()
+		except asyncio.CancelledError:
+			# shutdown; returning normally keeps asyncio from reporting
+			# the cancelled task as an unhandled error
+			pass
+		except Exception:
+			if self.debug:
+				traceback.print_exc()
+		finally:
+			self.__clients().discard( task )
+			writer.close()
+
+
+
+	#--------------------------------------------------------------------------
+	async def __handlemux( self, peerconn ):
+	#--------------------------------------------------------------------------
+		""" Serves a multiplexed connection. As in the threaded engine,
+		requests on one connection are handled concurrently, here each in
+		its own task. """
+
+		async def serve( reqid, msgtype, msgdata ):
+			await self.__dispatch( BTMuxReply( peerconn, reqid ),
+									msgtype, msgdata )
+			peerconn.sendmux( reqid, MUXDONE, '' )
+			await peerconn.writer.drain()
+
+		tasks = set()
+		recv = None    # reads the next frame; never cancelled mid-frame
+		try:
+			while not self.shutdown:
+				if recv is None:
+					recv = asyncio.ensure_future( peerconn.recvmux() )
+				if tasks:
+					# as in the threaded engine, the idle timeout applies
+					# only while no request is in progress
+					await asyncio.wait( tasks | { recv },
+									return_when=asyncio.FIRST_COMPLETED )
+					if not recv.done():
+						continue
+				else:
+					await asyncio.wait( { recv }, timeout=self.muxidle )
+					if not recv.done():
+						break
+				reqid, msgtype, msgdata = recv.result()
+				recv = None
+				if msgtype is None:
+					break
+				task = asyncio.ensure_future( serve( reqid, msgtype, msgdata ) )
+				tasks.add( task )
+				task.add_done_callback( tasks.discard )
+			if tasks:
+				await asyncio.wait( tasks )
+		except asyncio.CancelledError:
+			for task in tasks:
+				task.cancel()
+			raise
+		finally:
+			if recv is not None:
+				recv.cancel()
+
+
+
+	#--------------------------------------------------------------------------
+	def spawn( self, target, args=() ):
+	#--------------------------------------------------------------------------
+		""" Background work goes to the bounded thread pool rather than a
+		new thread each time (a plain thread before mainloop starts). """
+		if not self.executor:
+			return BTPeer.spawn( self, target, args )
+		self.executor.submit( target, *args )
+
+
+
+	#--------------------------------------------------------------------------
+	async def __runstabilizer( self, stabilizer, delay ):
+	#--------------------------------------------------------------------------
+		while not self.shutdown:
+			try:
+				await self.__call( stabilizer )
+			except Exception:
+				if self.debug:
+					traceback.print_exc()
+			await asyncio.sleep( delay )
+
+
+
+	#--------------------------------------------------------------------------
+	def startstabilizer( self, stabilizer, delay ):
+	#--------------------------------------------------------------------------
+		""" Registers a stabilizer function (plain or coroutine) to be run
+		every <delay> seconds as a periodic task on the event loop. May be
+		called before or after mainloop has started.
+
+		"""
+		self.__stabilizers().append( (stabilizer, delay) )
+		if self.loop:
+			self.loop.call_soon_threadsafe( asyncio.ensure_future,
+							self.__runstabilizer( stabilizer, delay ) )
+
+
+
+	#--------------------------------------------------------------------------
+	async def aconnectandsend( self, host, port, msgtype, msgdata,
+		pid=None, waitreply=True ):
+	#--------------------------------------------------------------------------
+		"""
+		aconnectandsend( host, port, message type, message data, peer id,
+		wait for a reply ) -> [ ( reply type, reply data ), ... ]
+
+		Coroutine version of connectandsend. With a pool enabled (see
+		enablepool), the request goes over the pooled connection, whose
+		blocking calls run on the thread pool.
+		"""
+		if self.pool:
+			return await asyncio.get_running_loop().run_in_executor(
+						self.executor,
+						lambda: BTPeer.connectandsend( self, host, port,
+									msgtype, msgdata, pid=pid,
+									waitreply=waitreply ) )
+		msgreply = []
+		writer = None
+		try:
+			reader, writer = await asyncio.open_connection( host, int(port) )
+			peerconn = AsyncBTPeerConnection( pid, reader, writer, self.loop )
+			peerconn.senddata( msgtype, msgdata )
+			await writer.drain()
+			self.__debug( 'Sent %s: %s' % (pid, msgtype) )
+
+			if waitreply:
+				onereply = await peerconn.recvdata()
+				while (onereply != (None,None)):
+					msgreply.append( onereply )
+					self.__debug( 'Got reply %s: %s'
+						% ( pid, str(msgreply) ) )
+					onereply = await peerconn.recvdata()
+		except Exception:
+			if self.debug:
+				traceback.print_exc()
+		finally:
+			if writer:
+				writer.close()
+
+		return msgreply
+
+
+
+	#--------------------------------------------------------------------------
+	async def asendtopeer( self, peerid, msgtype, msgdata, waitreply=True ):
+	#--------------------------------------------------------------------------
+		""" Coroutine version of sendtopeer. """
+		if self.router:
+			nextpid, host, port = self.router( peerid )
+		if not self.router or not nextpid:
+			self.__debug( 'Unable to route %s to %s' % (msgtype, peerid) )
+			return None
+		return await self.aconnectandsend( host, port, msgtype, msgdata,
+							pid=nextpid, waitreply=waitreply )
+
+
+
+	#--------------------------------------------------------------------------
+	def connectandsend( self, host, port, msgtype, msgdata,
+		pid=None, waitreply=True ):
+	#--------------------------------------------------------------------------
+		""" Blocking connectandsend for plain handlers and other threads:
+		the request itself runs on the event loop. Before mainloop starts
+		(e.g. buildpeers during startup), or with a pool enabled, this is
+		BTPeer.connectandsend.
+
+		"""
+		loop = self.loop
+		if self.pool or not loop or not loop.is_running() or self.__inloop():
+			return BTPeer.connectandsend( self, host, port, msgtype, msgdata,
+								pid=pid, waitreply=waitreply )
+		future = asyncio.run_coroutine_threadsafe(
+						self.aconnectandsend( host, port, msgtype, msgdata,
+											pid=pid, waitreply=waitreply ),
+						loop )
+		return future.result()
+
+
+
+	#--------------------------------------------------------------------------
+	def __inloop( self ):
+	#--------------------------------------------------------------------------
+		try:
+			return asyncio.get_running_loop() is self.loop
+		except RuntimeError:
+			return False
+
+
+
+	#--------------------------------------------------------------------------
+	def checklivepeers( self, timeout=2, maxparallel=512, maxfailures=3 ):
+	#--------------------------------------------------------------------------
+		""" Blocking checklivepeers, like connectandsend: from other
+		threads the pings run on the event loop (see achecklivepeers);
+		before mainloop starts, or on the loop's own thread, this is
+		BTPeer.checklivepeers. """
+		loop = self.loop
+		if not loop or not loop.is_running() or self.__inloop():
+			return BTPeer.checklivepeers( self, timeout, maxparallel,
+										maxfailures )
+		asyncio.run_coroutine_threadsafe(
+						self.achecklivepeers( timeout, maxparallel,
+											maxfailures ),
+						loop ).result()
+
+
+
+	#--------------------------------------------------------------------------
+	async def achecklivepeers( self, timeout=2, maxparallel=512,
+								maxfailures=3 ):
+	#--------------------------------------------------------------------------
+		""" Coroutine version of checklivepeers: pings the known peers that
+		are due for a check, up to maxparallel at once, and records their
+		RTT or failure with recordcheck. Register it with startstabilizer
+		to run it on the event loop.
+
+		"""
+		sem = asyncio.Semaphore( maxparallel )
+
+		async def ping( pid, host, port ):
+			async with sem:
+				start = time.time()
+				try:
+					reader, writer = await asyncio.wait_for(
+							asyncio.open_connection( host, port ), timeout )
+				except Exception:
+					return pid, None
+			rtt = time.time() - start
+			AsyncBTPeerConnection( pid, reader, writer,
+									self.loop ).senddata( 'PING', '' )
+			writer.close()
+			return pid, rtt
+
+		now = time.time()
+		with self.peerlock:
+			peers = [ (pid, host, port) for pid, (host, port)
+						in self.peers.items()
+						if self.health.get( pid, {} ).get( 'nextcheck', 0 ) <= now ]
+		results = await asyncio.gather( *[ ping( *peer ) for peer in peers ] )
+		with self.peerlock:
+			for pid, rtt in results:
+				if pid in self.peers:
+					self.recordcheck( pid, rtt, maxfailures=maxfailures )
+
+
+
+	#--------------------------------------------------------------------------
+	async def amainloop( self ):
+	#--------------------------------------------------------------------------
+		self.loop = asyncio.get_running_loop()
+		self.executor = concurrent.futures.ThreadPoolExecutor( self.maxworkers )
+		server = await asyncio.start_server( self.__handlepeer,
+							port=self.serverport, reuse_address=True,
+							backlog=1024 )
+		self.__debug( 'Server started: %s (%s:%d)'
+						% ( self.myid, self.serverhost, self.serverport ) )
+
+		tasks = [ asyncio.ensure_future( self.__runstabilizer( s, d ) )
+					for s, d in self.__stabilizers() ]
+		try:
+			while not self.shutdown:
+				await asyncio.sleep( 0.5 )
+		finally:
+			self.__debug( 'Main loop exiting' )
+			server.close()
+			for t in tasks:
+				t.cancel()
+			clients = list( self.__clients() )
+			for t in clients:
+				t.cancel()
+			await asyncio.gather( *tasks, *clients, return_exceptions=True )
+			self.loop = None
+			self.executor.shutdown( wait=False )
+			self.executor = None
+			if self.pool:
+				self.pool.closeall()
+
+
+
+	#--------------------------------------------------------------------------
+	def mainloop( self ):
+	#--------------------------------------------------------------------------
+		""" Runs the event loop until self.shutdown is set. Like
+		BTPeer.mainloop, this blocks the calling thread. """
+		try:
+			asyncio.run( self.amainloop() )
+		except KeyboardInterrupt:
+			print ('KeyboardInterrupt: stopping mainloop')
+			self.shutdown = True
+
+# end AsyncBTPeer class
+
+
+
+
+# **********************************************************
+
+
+
+
+class AsyncBTPeerConnection:
+	""" BTPeerConnection over asyncio streams. senddata keeps the blocking
+	API's signature so the same handlers work with both engines: it only
+	queues the frame on the transport, from the loop or from any thread.
+
+	"""
+
+	#--------------------------------------------------------------------------
+	def __init__( self, peerid, reader, writer, loop ):
+	#--------------------------------------------------------------------------
+		self.id = peerid
+		self.reader = reader
+		self.writer = writer
+		self.loop = loop
+		self.thread = threading.get_ident()   # the loop's thread
+
+
+	#--------------------------------------------------------------------------
+	def __write( self, header, msgdata ):
+	#--------------------------------------------------------------------------
+		# one call per frame, so frames queued from several threads
+		# cannot interleave
+		if threading.get_ident() == self.thread:
+			self.writer.writelines( (header, msgdata) )
+		else:
+			self.loop.call_soon_threadsafe( self.writer.writelines,
+											(header, msgdata) )
+		return True
+
+
+	#--------------------------------------------------------------------------
+	def senddata( self, msgtype, msgdata ):
+	#--------------------------------------------------------------------------
+		msgtype, msgdata = tobytes( msgtype ), tobytes( msgdata )
+		return self.__write( HEADER.pack( msgtype, len(msgdata) ), msgdata )
+
+
+	#--------------------------------------------------------------------------
+	def sendmux( self, reqid, msgtype, msgdata ):
+	#--------------------------------------------------------------------------
+		msgtype, msgdata = tobytes( msgtype ), tobytes( msgdata )
+		return self.__write( MUXHEADER.pack( msgtype, reqid, len(msgdata) ),
+								msgdata )
+
+
+	#--------------------------------------------------------------------------
+	def sendfile( self, msgtype, fileobj, offset=0, count=None ):
+	#--------------------------------------------------------------------------
+		""" Blocking sendfile for plain handlers running on the thread pool;
+		coroutine handlers await asendfile instead. """
+		return asyncio.run_coroutine_threadsafe(
+						self.asendfile( msgtype, fileobj, offset, count ),
+						self.loop ).result()
+
+
+	#--------------------------------------------------------------------------
+	async def asendfile( self, msgtype, fileobj, offset=0, count=None ):
+	#--------------------------------------------------------------------------
+		""" Sends count bytes of a binary file from offset as one message,
+		using loop.sendfile (os.sendfile where the platform has it). """
+		try:
+			if count is None:
+				count = os.fstat( fileobj.fileno() ).st_size - offset
+			self.writer.write( HEADER.pack( tobytes( msgtype ), count ) )
+			if count:
+				await self.loop.sendfile( self.writer.transport, fileobj,
+											offset, count )
+		except Exception:
+			return False
+		return True
+
+
+	#--------------------------------------------------------------------------
+	def sendmuxfile( self, reqid, msgtype, fileobj, offset=0, count=None ):
+	#--------------------------------------------------------------------------
+		""" Frames of concurrent requests would interleave with a streamed
+		body, so on a multiplexed connection the range is queued as one
+		ordinary frame. Bulk transfers should use their own connection. """
+		fileobj.seek( offset )
+		return self.sendmux( reqid, msgtype,
+						fileobj.read( -1 if count is None else count ) )
+
+
+	#--------------------------------------------------------------------------
+	async def recvdata( self ):
+	#--------------------------------------------------------------------------
+		"""
+		recvdata() -> (msgtype, msgdata)
+
+		Returns (None, None) at end of stream or on any error.
+		"""
+		try:
+			msgtype, msglen = HEADER.unpack(
+									await self.reader.readexactly( HEADER.size ) )
+			msg = await self.reader.readexactly( msglen )
+			msgtype = msgtype.decode()
+		except (asyncio.IncompleteReadError, ConnectionError,
+				UnicodeDecodeError):
+			return (None, None)
+		return ( msgtype, frompayload( msg ) )
+
+
+	#--------------------------------------------------------------------------
+	async def recvmux( self ):
+	#--------------------------------------------------------------------------
+		"""
+		recvmux() -> (reqid, msgtype, msgdata)
+
+		Returns (None, None, None) at end of stream or on any error.
+		"""
+		try:
+			msgtype, reqid, msglen = MUXHEADER.unpack(
+								await self.reader.readexactly( MUXHEADER.size ) )
+			msg = await self.reader.readexactly( msglen )
+			msgtype = msgtype.decode()
+		except (asyncio.IncompleteReadError, ConnectionError,
+				UnicodeDecodeError):
+			return (None, None, None)
+		return ( reqid, msgtype, frompayload( msg ) )
+
+
+	#--------------------------------------------------------------------------
+	def __str__( self ):
+	#--------------------------------------------------------------------------
+		return f"|{self.id}|"
+
+# end AsyncBTPeerConnection class
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Concurrent-connection capacity of the threaded BTPeer engine versus the
+# asyncio engine in aiobtpeer.py: N clients connect at the same time and
+# each sends a HOLD request that the server keeps open for a while.
+# Each server runs in its own process so that its threads and peak RSS
+# can be reported.
+
+import argparse, asyncio, multiprocessing, resource, struct, threading, time
+
+from btpeer import *
+from aiobtpeer import AsyncBTPeer
+
+HOLD = "HOLD"
+
+
+def serve(engine, port, hold, pipe):
+    if engine == 'threaded':
+        peer = BTPeer(0, port, serverhost='127.0.0.1')
+
+        def handler(peerconn, data):
+            time.sleep(hold)
+            peerconn.senddata(HOLD, data)
+    else:
+        peer = AsyncBTPeer(0, port, serverhost='127.0.0.1')
+
+        async def handler(peerconn, data):
+            await asyncio.sleep(hold)
+            peerconn.senddata(HOLD, data)
+    peer.addhandler(HOLD, handler)
+
+    maxthreads = [0]
+
+    def sample():
+        while not peer.shutdown:
+            maxthreads[0] = max(maxthreads[0], threading.active_count())
+            time.sleep(0.05)
+
+    threading.Thread(target=sample, daemon=True).start()
+    threading.Thread(target=peer.mainloop, daemon=True).start()
+    pipe.send('ready')
+    pipe.recv()                      # wait for the load to finish
+    peer.shutdown = True
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pipe.send((maxthreads[0], rss))
+
+
+async def one_client(port, sem):
+    async with sem:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(struct.pack('!4sL', HOLD.encode(), 2) + b'ok')
+        await writer.drain()
+        header = await reader.readexactly(8)
+        await reader.readexactly(struct.unpack('!4sL', header)[1])
+        return True
+    except Exception:
+        return False
+    finally:
+        writer.close()
+
+
+async def load(port, clients):
+    sem = asyncio.Semaphore(500)     # limit connects in flight, not clients
+    results = await asyncio.gather(*[one_client(port, sem)
+                                     for i in range(clients)],
+                                   return_exceptions=True)
+    return sum(1 for r in results if r is True)
+
+
+def run(engine, port, clients, hold):
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=serve,
+                                   args=(engine, port, hold, child))
+    proc.start()
+    parent.recv()
+    time.sleep(0.5)                  # let the server bind
+    start = time.perf_counter()
+    ok = asyncio.run(load(port, clients))
+    elapsed = time.perf_counter() - start
+    parent.send('done')
+    threads, rss = parent.recv()
+    proc.join()
+    return ok, elapsed, threads, rss
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BTPeer engine load test')
+    parser.add_argument('-p', metavar='port', type=int, default=7770,
+                        help='TCP port for the test peer (default 7770)')
+    parser.add_argument('-c', metavar='clients', type=int, nargs='+',
+                        default=[100, 1000, 3000],
+                        help='concurrent clients (default 100 1000 3000)')
+    parser.add_argument('--hold', type=float, default=1.0,
+                        help='seconds each request is held (default 1.0)')
+    args = parser.parse_args()
+
+    print('{:>9} {:>8} {:>6} {:>9} {:>9} {:>10}'.format(
+        'engine', 'clients', 'ok', 'seconds', 'threads', 'peak RSS'))
+    port = args.p
+    for clients in args.c:
+        for engine in ('threaded', 'asyncio'):
+            ok, elapsed, threads, rss = run(engine, port, clients, args.hold)
+            print('{:>9} {:>8} {:>6} {:>9.2f} {:>9} {:>7} MB'.format(
+                engine, clients, ok, elapsed, threads, rss // 1024))
+            port += 1
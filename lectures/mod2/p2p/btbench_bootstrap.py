@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Time for a new FilerPeer to join a local overlay of N peers with
+# buildpeers: the original recursive depth-first walk (three sequential
+# round trips per peer) versus the concurrent breadth-first bootstrap.
+# The overlay runs on one event loop (AsyncFilerPeer). The joining peer
+# adds a simulated network delay, fixed per overlay peer, to each
+# request, so the runs also show how close the chosen peers are.
+
+import argparse, asyncio, random, threading, time
+
+from btfiler import *
+
+
+class JoiningPeer(FilerPeer):
+    def __init__(self, port, maxpeers, delays):
+        FilerPeer.__init__(self, maxpeers, port, serverhost='127.0.0.1')
+        self.delays = delays         # overlay port --> seconds per request
+        self.requests = 0
+
+    def connectandsend(self, host, port, msgtype, msgdata, pid=None,
+                       waitreply=True):
+        self.requests += 1
+        time.sleep(self.delays.get(int(port), 0))
+        return FilerPeer.connectandsend(self, host, port, msgtype, msgdata,
+                                        pid=pid, waitreply=waitreply)
+
+
+def legacy_buildpeers(peer, host, port, hops=1):
+    """The original depth-first buildpeers, kept only for comparison."""
+    if peer.maxpeersreached() or not hops:
+        return
+    peerid = None
+    try:
+        _, peerid = peer.connectandsend(host, port, PEERNAME, '')[0]
+        resp = peer.connectandsend(host, port, INSERTPEER, '%s %s %d' % (
+            peer.myid, peer.serverhost, peer.serverport))[0]
+        if (resp[0] != REPLY) or (peerid in peer.getpeerids()):
+            return
+        peer.addpeer(peerid, host, port)
+        resp = peer.connectandsend(host, port, LISTPEERS, '', pid=peerid)
+        if len(resp) > 1:
+            resp.reverse()
+            resp.pop()
+            while len(resp):
+                nextpid, host, port = resp.pop()[1].split()
+                if nextpid != peer.myid:
+                    legacy_buildpeers(peer, host, port, hops - 1)
+    except Exception:
+        peer.removepeer(peerid)
+
+
+def start_overlay(size, baseport, degree, seed):
+    rnd = random.Random(seed)
+    peers = [AsyncFilerPeer(0, baseport + i, serverhost='127.0.0.1')
+             for i in range(size)]
+    for p in peers:
+        for q in rnd.sample(peers, degree // 2):
+            if q is not p:
+                p.addpeer(q.myid, q.serverhost, q.serverport)
+                q.addpeer(p.myid, p.serverhost, p.serverport)
+
+    async def run():
+        await asyncio.gather(*[p.amainloop() for p in peers])
+
+    threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+    while not all(p.loop for p in peers):
+        time.sleep(0.1)
+    time.sleep(0.5)                  # let the servers bind
+    return peers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FilerPeer bootstrap benchmark')
+    parser.add_argument('-n', metavar='peers', type=int, default=1000,
+                        help='overlay size (default 1000)')
+    parser.add_argument('-p', metavar='port', type=int, default=9000,
+                        help='first overlay port (default 9000)')
+    parser.add_argument('-d', metavar='degree', type=int, default=8,
+                        help='average neighbors per overlay peer (default 8)')
+    parser.add_argument('-m', metavar='maxpeers', type=int, nargs='+',
+                        default=[16, 64],
+                        help='peer list sizes to fill (default 16 64)')
+    parser.add_argument('--hops', type=int, default=4,
+                        help='search depth (default 4)')
+    parser.add_argument('--delay', type=float, nargs=2, default=[5, 100],
+                        metavar=('MIN', 'MAX'),
+                        help='range of simulated per-peer delays in ms '
+                             '(default 5 100)')
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    overlay = start_overlay(args.n, args.p, args.d, 1)
+    delays = {p.serverport: rnd.uniform(*args.delay) / 1000 for p in overlay}
+    mean = 1000 * sum(delays.values()) / len(delays)
+    print('{} peers, mean delay {:.1f} ms'.format(args.n, mean))
+    print('{:>10} {:>9} {:>9} {:>9} {:>9} {:>14}'.format(
+        'buildpeers', 'maxpeers', 'seconds', 'joined', 'requests',
+        'mean delay ms'))
+
+    port = args.p + args.n
+    for maxpeers in args.m:
+        for name in ('legacy', 'parallel'):
+            peer = JoiningPeer(port, maxpeers, delays)
+            port += 1
+            start = time.perf_counter()
+            if name == 'legacy':
+                legacy_buildpeers(peer, '127.0.0.1', args.p, args.hops)
+            else:
+                peer.buildpeers('127.0.0.1', args.p, args.hops)
+            elapsed = time.perf_counter() - start
+            joined = [delays[peer.getpeer(pid)[1]] for pid in peer.getpeerids()]
+            print('{:>10} {:>9} {:>9.2f} {:>9} {:>9} {:>14.1f}'.format(
+                name, maxpeers, elapsed, len(joined), peer.requests,
+                1000 * sum(joined) / max(len(joined), 1)))
+
+    for p in overlay:
+        p.shutdown = True
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Queries/sec of FilerPeer's file lookup as the catalog grows: the original
+# linear substring scan over every file name versus the trigram index of
+# btcatalog.FileCatalog. Both return every matching name.
+
+import argparse, random, string, time
+
+from btcatalog import FileCatalog
+
+WORDS = ['alpha', 'bravo', 'delta', 'echo', 'kilo', 'lima', 'nova', 'oscar',
+         'sierra', 'tango', 'video', 'music', 'photo', 'notes', 'draft']
+
+
+def make_names(count, rnd):
+    names = set()
+    while len(names) < count:
+        tag = ''.join(rnd.choice(string.ascii_lowercase) for i in range(6))
+        names.add('%s_%s_%s.%s' % (rnd.choice(WORDS), tag, rnd.choice(WORDS),
+                                   rnd.choice(['mp3', 'txt', 'pdf', 'jpg'])))
+    return sorted(names)
+
+
+def make_keys(names, count, rnd):
+    keys = []
+    for i in range(count):
+        name = rnd.choice(names)
+        start = rnd.randrange(len(name) - 5)
+        keys.append(name[start:start + rnd.randint(4, 8)])
+    return keys
+
+
+def linear(files, key):
+    return [(fname, files[fname]) for fname in files.keys() if key in fname]
+
+
+def rate(search, keys):
+    start = time.perf_counter()
+    for key in keys:
+        search(key)
+    return len(keys) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='file catalog benchmark')
+    parser.add_argument('-s', metavar='size', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 300000],
+                        help='catalog sizes (default 1000 10000 100000 300000)')
+    parser.add_argument('-q', metavar='queries', type=int, default=200,
+                        help='queries per measurement (default 200)')
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    print('{:>8} {:>14} {:>14} {:>9}'.format('files', 'linear q/s',
+                                             'indexed q/s', 'speedup'))
+    for size in args.s:
+        names = make_names(size, rnd)
+        keys = make_keys(names, args.q, rnd)
+        files = dict.fromkeys(names)
+        catalog = FileCatalog()
+        for name in names:
+            catalog.addlocal(name)
+        assert all(sorted(linear(files, k)) == sorted(catalog.search(k))
+                   for k in keys[:20])
+        a = rate(lambda key: linear(files, key), keys)
+        b = rate(catalog.search, keys)
+        print('{:>8} {:>14.0f} {:>14.0f} {:>8.1f}x'.format(size, a, b, b / a))
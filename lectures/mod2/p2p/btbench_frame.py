@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Microbenchmark of BTPeerConnection framing over a local socket pair: the
+# current recv_into/sendmsg implementation versus the original one, which
+# went through makefile('rwb', 0), built a struct format per message and
+# grew the payload with msg += data in 2048-byte reads.
+
+import argparse, socket, struct, threading, time
+
+from btpeer import BTPeerConnection
+
+
+class LegacyConnection:
+    """The original framing, kept only for comparison (with b"" instead of
+    "" as the initial payload so that it runs under Python 3)."""
+
+    def __init__(self, sock):
+        self.sd = sock.makefile('rwb', 0)
+
+    def senddata(self, msgtype, msgdata):
+        msglen = len(msgdata)
+        self.sd.write(struct.pack("!4sL%ds" % msglen, msgtype, msglen, msgdata))
+        self.sd.flush()
+
+    def recvdata(self):
+        msgtype = self.sd.read(4)
+        msglen = int(struct.unpack("!L", self.sd.read(4))[0])
+        msg = b""
+        while len(msg) != msglen:
+            data = self.sd.read(min(2048, msglen - len(msg)))
+            if not len(data):
+                break
+            msg += data
+        return (msgtype, msg)
+
+
+def measure(make, size, count):
+    """Send `count` messages of `size` bytes; return (MB/s, msg/s)."""
+    a, b = socket.socketpair()
+    sender, receiver = make(a), make(b)
+    payload = b'x' * size
+
+    def send():
+        for i in range(count):
+            sender.senddata(b'DATA', payload)
+
+    t = threading.Thread(target=send)
+    start = time.perf_counter()
+    t.start()
+    for i in range(count):
+        msgtype, msg = receiver.recvdata() if make is LegacyConnection \
+            else receiver.recvframe()
+        assert len(msg) == size
+    t.join()
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return size * count / elapsed / 2**20, count / elapsed
+
+
+def current(sock):
+    return BTPeerConnection(None, None, None, sock)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BTPeer framing benchmark')
+    parser.add_argument('--legacy-max', type=int, default=2**20,
+                        help='largest message size to run through the '
+                             'quadratic legacy reader (default 1 MB)')
+    args = parser.parse_args()
+
+    cases = [('1 KB', 2**10, 20000), ('1 MB', 2**20, 50),
+             ('100 MB', 100 * 2**20, 2)]
+    print('{:>7} {:>9} {:>10} {:>10}'.format('size', 'framing', 'MB/s', 'msg/s'))
+    for label, size, count in cases:
+        for name, make in (('legacy', LegacyConnection), ('current', current)):
+            if make is LegacyConnection and size > args.legacy_max:
+                print('{:>7} {:>9} {:>10}'.format(label, name, 'skipped'))
+                continue
+            mbps, rate = measure(make, size, count)
+            print('{:>7} {:>9} {:>10.1f} {:>10.0f}'.format(label, name, mbps, rate))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Time one BTPeer.checklivepeers sweep over thousands of known peers: some
+# accept connections, some refuse them, and some never answer (they sit
+# in the backlog of a listener nobody accepts from), so each of those
+# costs a full timeout. The old serial check needed a timeout per dead
+# peer; the concurrent one should need about one timeout in total.
+
+import argparse, socket, threading, time
+
+from btpeer import *
+
+
+def listener(backlog):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    s.listen(backlog)
+    return s
+
+
+def serve_forever(s):
+    while True:
+        conn, addr = s.accept()
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='liveness check benchmark')
+    parser.add_argument('-n', metavar='peers', type=int, default=3000,
+                        help='known peers (default 3000)')
+    parser.add_argument('--timeout', type=float, default=2.0,
+                        help='per-peer connect timeout (default 2.0)')
+    args = parser.parse_args()
+
+    live = listener(4096)
+    threading.Thread(target=serve_forever, args=(live,), daemon=True).start()
+    refused = listener(1)
+    refusedport = refused.getsockname()[1]
+    refused.close()                  # nothing listens there any more
+    stuck = listener(0)              # full backlog: SYNs are left unanswered
+    filler = []
+    for i in range(4):
+        f = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        f.setblocking(False)
+        f.connect_ex(stuck.getsockname())
+        filler.append(f)
+    time.sleep(0.5)
+
+    peer = BTPeer(0, 0, serverhost='127.0.0.1')
+    targets = [live.getsockname()[1], refusedport, stuck.getsockname()[1]]
+    for i in range(args.n):
+        peer.addpeer('peer%d' % i, '127.0.0.1', targets[i % 3])
+
+    start = time.time()
+    peer.checklivepeers(timeout=args.timeout)
+    elapsed = time.time() - start
+    failed = sum(1 for h in peer.health.values() if h['failures'])
+    rtts = [h['rtt'] for h in peer.health.values() if h['rtt'] is not None]
+    print('{} peers checked in {:.2f} s (timeout {} s): {} reachable, '
+          '{} failed, mean RTT {:.2f} ms'.format(
+              args.n, elapsed, args.timeout, len(rtts), failed,
+              1000 * sum(rtts) / max(len(rtts), 1)))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Messages/sec of BTPeer.connectandsend with one TCP connection per message
+# (the original behaviour) versus the pooled, multiplexed connections
+# enabled by BTPeer.enablepool().
+
+import argparse, threading, time
+
+from btpeer import *
+
+ECHO = "ECHO"
+
+
+def start_server(port):
+    server = BTPeer(0, port, serverhost='127.0.0.1')
+    server.addhandler(ECHO, lambda peerconn, data: peerconn.senddata(ECHO, data))
+    threading.Thread(target=server.mainloop, daemon=True).start()
+    time.sleep(0.5)  # give mainloop time to bind
+    return server
+
+
+def run(client, port, messages, threads):
+    """Send `messages` ECHO requests from `threads` threads; return msg/s."""
+    per_thread = messages // threads
+    failures = []
+
+    def worker():
+        for i in range(per_thread):
+            reply = client.connectandsend('127.0.0.1', port, ECHO, 'x' * 32)
+            if reply != [(ECHO, 'x' * 32)]:
+                failures.append(reply)
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if failures:
+        print('  {} requests failed'.format(len(failures)))
+    return per_thread * threads / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BTPeer connection pool benchmark')
+    parser.add_argument('-p', metavar='port', type=int, default=7760,
+                        help='TCP port for the test peer (default 7760)')
+    parser.add_argument('-n', metavar='messages', type=int, default=5000,
+                        help='messages per run (default 5000)')
+    parser.add_argument('-t', metavar='threads', type=int, nargs='+',
+                        default=[1, 8], help='client threads (default 1 8)')
+    args = parser.parse_args()
+
+    server = start_server(args.p)
+    oneshot = BTPeer(0, args.p + 1, serverhost='127.0.0.1')
+    pooled = BTPeer(0, args.p + 2, serverhost='127.0.0.1')
+    pooled.enablepool()
+
+    print('{:>8} {:>14} {:>14} {:>8}'.format('threads', 'one-shot msg/s',
+                                             'pooled msg/s', 'speedup'))
+    for threads in args.t:
+        a = run(oneshot, args.p, args.n, threads)
+        b = run(pooled, args.p, args.n, threads)
+        print('{:>8} {:>14.0f} {:>14.0f} {:>7.1f}x'.format(threads, a, b, b / a))
+
+    pooled.pool.closeall()
+    server.shutdown = True
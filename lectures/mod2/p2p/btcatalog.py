@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# Indexed catalog of shared file names for the BerryTella file sharer
+
+import threading
+from array import array
+
+
+#==============================================================================
+class FileCatalog:
+#==============================================================================
+  """ Keeps the names of locally shared files apart from the remote files
+  learned from QRESPONSE messages, and answers substring queries over
+  both with a trigram index instead of scanning every name.
+
+  Every name gets an integer id; for each distinct 3-character substring
+  (trigram) of a name, the index holds an array of the ids of the names
+  that contain it. A query of three or more characters only has to check
+  the names in the shortest posting array among its own trigrams.
+  Removed names leave stale ids behind, which searches skip; once they
+  outnumber half the live names, the ids and the index are rebuilt.
+
+  """
+
+  GRAM = 3
+  MINDEAD = 64   # stale ids always tolerated before a rebuild
+
+  #--------------------------------------------------------------------------
+  def __init__(self):
+  #--------------------------------------------------------------------------
+    self.local = set()   # names of files shared by this peer
+    self.remote = {}     # name --> peer id of a peer that has the file
+    self.names = []      # id --> name (None once removed)
+    self.ids = {}        # name --> id
+    self.index = {}      # trigram --> array of ids
+    self.dead = 0        # stale ids in names and the index
+    self.lock = threading.Lock()
+
+
+
+  #--------------------------------------------------------------------------
+  def __grams(self, name):
+  #--------------------------------------------------------------------------
+    n = self.GRAM
+    return set(name[i:i + n] for i in range(len(name) - n + 1))
+
+
+
+  #--------------------------------------------------------------------------
+  def __index(self, name):
+  #--------------------------------------------------------------------------
+    if name in self.ids:
+      return
+    nid = len(self.names)
+    self.names.append(name)
+    self.ids[name] = nid
+    for gram in self.__grams(name):
+      posting = self.index.get(gram)
+      if posting is None:
+        posting = self.index[gram] = array('I')
+      posting.append(nid)
+
+
+
+  #--------------------------------------------------------------------------
+  def addlocal(self, name):
+  #--------------------------------------------------------------------------
+    """ Registers a locally stored file (replacing any remote entry). """
+    with self.lock:
+      self.remote.pop(name, None)
+      self.local.add(name)
+      self.__index(name)
+
+
+
+  #--------------------------------------------------------------------------
+  def addremote(self, name, peerid):
+  #--------------------------------------------------------------------------
+    """ Registers a file held by peerid. Returns False, changing nothing,
+    if the name is already known. """
+    with self.lock:
+      if name in self.local or name in self.remote:
+        return False
+      self.remote[name] = peerid
+      self.__index(name)
+      return True
+
+
+
+  #--------------------------------------------------------------------------
+  def remove(self, name):
+  #--------------------------------------------------------------------------
+    with self.lock:
+      self.local.discard(name)
+      self.remote.pop(name, None)
+      nid = self.ids.pop(name, None)
+      if nid is not None:
+        self.names[nid] = None
+        self.dead += 1
+        if self.dead > max(self.MINDEAD, len(self.ids) // 2):
+          self.__rebuild()
+
+
+
+  #--------------------------------------------------------------------------
+  def __rebuild(self):
+  #--------------------------------------------------------------------------
+    """ Renumbers the live names and rebuilds the index without the
+    stale ids, in time linear in their total length. """
+    names = [name for name in self.names if name is not None]
+    self.names = []
+    self.ids = {}
+    self.index = {}
+    self.dead = 0
+    for name in names:
+      self.__index(name)
+
+
+
+  #--------------------------------------------------------------------------
+  def islocal(self, name):
+  #--------------------------------------------------------------------------
+    return name in self.local
+
+
+
+  #--------------------------------------------------------------------------
+  def getpeer(self, name):
+  #--------------------------------------------------------------------------
+    """ Returns the peer id holding a remote file, or None. """
+    return self.remote.get(name)
+
+
+
+  #--------------------------------------------------------------------------
+  def search(self, key):
+  #--------------------------------------------------------------------------
+    """ search(key) -> [ (file name, peer id or None if local), ... ]
+
+    Returns every known file whose name contains key.
+
+    """
+    with self.lock:
+      if len(key) < self.GRAM:
+        # too short for the index; such keys match most names anyway
+        candidates = range(len(self.names))
+      else:
+        candidates = None
+        for gram in self.__grams(key):
+          posting = self.index.get(gram)
+          if posting is None:
+            return []
+          if candidates is None or len(posting) < len(candidates):
+            candidates = posting
+
+      matches = []
+      for nid in candidates:
+        name = self.names[nid]
+        if name is not None and key in name:
+          matches.append((name, self.remote.get(name)))
+      return matches
+
+
+
+  #--------------------------------------------------------------------------
+  def items(self):
+  #--------------------------------------------------------------------------
+    """ Returns a name --> peer id (None if local) dictionary of every
+    known file. """
+    with self.lock:
+      files = dict(self.remote)
+      files.update(dict.fromkeys(self.local))
+      return files
+
+
+
+  #--------------------------------------------------------------------------
+  def __contains__(self, name):
+  #--------------------------------------------------------------------------
+    return name in self.local or name in self.remote
+
+
+
+  #--------------------------------------------------------------------------
+  def __len__(self):
+  #--------------------------------------------------------------------------
+    return len(self.local) + len(self.remote)
@@ -1,18 +1,95 @@
 #!/usr/bin/env python3
 
+import hashlib
+import mmap
+import os
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from btpeer import *
+from aiobtpeer import AsyncBTPeer
+from btcatalog import FileCatalog
 
 PEERNAME = "NAME"   # request a peer's canonical id
 LISTPEERS = "LIST"
 INSERTPEER = "JOIN"
 QUERY = "QUER"
 QRESPONSE = "RESP"
+QUERYHIT = "QHIT"   # query response routed back along the query's path
 FILEGET = "FGET"
+FILEINFO = "FINF"   # file size and per-piece hashes for swarm downloads
 PEERQUIT = "QUIT"
 
 REPLY = "REPL"
 ERROR = "ERRO"
 
+PIECESIZE = 1 << 20   # default piece size of a swarm download
+FETCHTIMEOUT = 30     # seconds a download waits for a peer to connect or
+                      # send more data before giving up on it
+QIDS = "qids"         # ends a QUERY ACK from a peer that understands query
+                      # ids; only such peers are sent the 5-field QUERY
+LEGACYWINDOW = 2      # seconds in which a query without an id counts as
+                      # a duplicate of an earlier one
+
+
+def throughput(nbytes, seconds):
+  """ Transfer rate in MB/s. """
+  return nbytes / max(seconds, 1e-9) / 2**20
+
+
+
+#==============================================================================
+class SeenCache:
+#==============================================================================
+  """ Remembers recently seen keys (query ids) with a value each, for at
+  most ttl seconds and at most maxsize keys; the oldest go first. """
+
+  #--------------------------------------------------------------------------
+  def __init__(self, maxsize=10000, ttl=30):
+  #--------------------------------------------------------------------------
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.entries = OrderedDict()   # key --> (expiry time, value)
+    self.lock = threading.Lock()
+
+
+
+  #--------------------------------------------------------------------------
+  def __expire(self, now):
+  #--------------------------------------------------------------------------
+    # entries are kept in insertion order, which is also expiry order
+    while self.entries:
+      key, (expiry, value) = next(iter(self.entries.items()))
+      if expiry > now and len(self.entries) <= self.maxsize:
+        break
+      del self.entries[key]
+
+
+
+  #--------------------------------------------------------------------------
+  def add(self, key, value=None):
+  #--------------------------------------------------------------------------
+    """ Records key; returns False if it was already there. """
+    now = time.time()
+    with self.lock:
+      self.__expire(now)
+      if key in self.entries:
+        return False
+      self.entries[key] = (now + self.ttl, value)
+      self.__expire(now)
+      return True
+
+
+
+  #--------------------------------------------------------------------------
+  def get(self, key):
+  #--------------------------------------------------------------------------
+    with self.lock:
+      self.__expire(time.time())
+      entry = self.entries.get(key)
+      return entry[1] if entry else None
+
 
 # Assumption in this program:
 #   peer id's in this application are just "host:port" strings
@@ -26,17 +103,21 @@ class FilerPeer(BTPeer):
   """
 
   #--------------------------------------------------------------------------
-  def __init__(self, maxpeers, serverport):
+  def __init__(self, maxpeers, serverport, serverhost=None):
   #--------------------------------------------------------------------------
     """ Initializes the peer to support connections up to maxpeers number
     of peers, with its server listening on the specified port. Also sets
-    the dictionary of local files to empty and adds handlers to the 
-    BTPeer framework.
+    up an empty file catalog and adds handlers to the BTPeer framework.
 
     """
-    BTPeer.__init__(self, maxpeers, serverport)
+    BTPeer.__init__(self, maxpeers, serverport, serverhost=serverhost)
     
-    self.files = {}  # available files: name --> peerid mapping
+    self.catalog = FileCatalog()  # local and remote files, indexed
+    self.seeders = {}  # remote files: name --> peerids of every holder
+    self.pieceinfo = {}  # (name, piece size) --> (mtime, FILEINFO reply)
+    self.seen = SeenCache()  # query id --> peer id the query came from;
+                             # None disables duplicate suppression
+    self.qidpeers = set()  # neighbors known to understand query ids
 
     self.addrouter(self.__router)
 
@@ -45,7 +126,9 @@ class FilerPeer(BTPeer):
           PEERNAME: self.__handle_peername,
           QUERY: self.__handle_query,
           QRESPONSE: self.__handle_qresponse,
+          QUERYHIT: self.__handle_queryhit,
           FILEGET: self.__handle_fileget,
+          FILEINFO: self.__handle_fileinfo,
           PEERQUIT: self.__handle_quit
         }
     for mt in handlers:
@@ -138,60 +221,176 @@ class FilerPeer(BTPeer):
 
 
 
-  # QUERY arguments: "return-peerid key ttl"
+  # QUERY arguments: "return-peerid key ttl [query-id [from-peerid]]"
   #--------------------------------------------------------------------------
   def __handle_query(self, peerconn, data):
   #--------------------------------------------------------------------------
     """ Handles the QUERY message type. The message data should be in the
-    format of a string, "return-peer-id  key  ttl", where return-peer-id
-    is the name of the peer that initiated the query, key is the (portion
-    of the) file name being searched for, and ttl is how many further 
-    levels of peers this query should be propagated on.
+    format of a string, "return-peer-id  key  ttl  query-id  from-peer-id",
+    where return-peer-id is the name of the peer that initiated the query,
+    key is the (portion of the) file name being searched for, ttl is how
+    many further levels of peers this query should be propagated on,
+    query-id identifies the query, and from-peer-id is the neighbor that
+    passed it on. A query id seen before is acknowledged but dropped.
+
+    Peers that send neither of the last two fields speak the original
+    protocol: their query is answered as before, with a QRESPONSE
+    straight to its origin. It gets an id derived from origin, key and
+    the current LEGACYWINDOW-second slot, the same wherever it enters
+    the peers that understand ids, so that its copies are dropped there
+    but a later repeat of the search is not.
 
     """
     # self.peerlock.acquire()
     try:
-        peerid, key, ttl = data.split()
-        peerconn.senddata(REPLY, 'Query ACK: %s' % key)
+        fields = data.split()
+        peerid, key, ttl = fields[:3]
+        ttl = int(ttl)
+        if len(fields) > 3:
+          qid = fields[3]
+          upstream = fields[4] if len(fields) > 4 else None
+        else:
+          slot = int(time.time() // LEGACYWINDOW)
+          qid = hashlib.sha1(('%s %s %d' % (peerid, key, slot)).encode()
+                             ).hexdigest()[:16]
+          upstream = None
+        if self.seen is None:
+          peerconn.senddata(REPLY, 'Query ACK: %s' % key)
+        else:
+          peerconn.senddata(REPLY, 'Query ACK: %s %s' % (key, QIDS))
     except:
         self.__debug('invalid query %s: %s' % (str(peerconn), data))
         peerconn.senddata(ERROR, 'Query: incorrect arguments')
+        return
     # self.peerlock.release()
 
-    t = threading.Thread(target=self.__processquery, 
-              args=[peerid, key, int(ttl)])
-    t.start()
+    if self.seen is not None:
+      if upstream:
+        self.qidpeers.add(upstream)   # it sent us a query with an id
+      if not self.seen.add(qid, upstream):
+        self.__debug('Dropping duplicate query %s' % qid)
+        return
+    self.spawn(self.__processquery, [peerid, key, ttl, qid, upstream])
 
 
 
   # 
   #--------------------------------------------------------------------------
-  def __processquery(self, peerid, key, ttl):
+  def __processquery(self, peerid, key, ttl, qid=None, upstream=None):
   #--------------------------------------------------------------------------
     """ Handles the processing of a query message after it has been 
     received and acknowledged, by either replying with a QRESPONSE message
     if the file is found in the local list of files, or propagating the
     message onto all immediate neighbors.
 
+    With duplicate suppression on (self.seen), matches to a query that
+    came with an id travel back to the originator hop by hop as a
+    QUERYHIT through the neighbor each peer got the query from, and
+    queries are not sent back where they came from. Otherwise (upstream
+    None) the original protocol is followed.
+
     """
-    for fname in self.files.keys():
-      if key in fname:
-        fpeerid = self.files[fname]
-        if not fpeerid:   # local files mapped to None
-          fpeerid = self.myid
-        host,port = peerid.split(':')
-        # can't use sendtopeer here because peerid is not necessarily
-        # an immediate neighbor
-        self.connectandsend(host, int(port), QRESPONSE, 
-                '%s %s' % (fname, fpeerid),
-                pid=peerid)
+    matches = self.catalog.search(key)
+    if matches:
+      # one line per matching file; local files map to None
+      lines = ['%s %s' % (fname, fpeerid or self.myid)
+            for fname, fpeerid in matches]
+      if self.seen is not None and upstream:
+        self.__sendhit(upstream, '%s %s\n%s' % (qid, peerid, '\n'.join(lines)))
         return
+      self.__sendqresponse(peerid, lines,
+                           peerid in self.qidpeers or upstream == peerid)
+      return
     # will only reach here if key not found... in which case
     # propagate query to neighbors
     if ttl > 0:
-      msgdata = '%s %s %d' % (peerid, key, ttl - 1)
-      for nextpid in self.getpeerids():
-        self.sendtopeer(nextpid, QUERY, msgdata)
+      for nextpid in list(self.getpeerids()):
+        if self.seen is None or nextpid not in (upstream, peerid):
+          self.__sendquery(nextpid, peerid, key, ttl - 1, qid)
+
+
+
+  #--------------------------------------------------------------------------
+  def __sendquery(self, nextpid, peerid, key, ttl, qid):
+  #--------------------------------------------------------------------------
+    """ Sends a QUERY to a neighbor: with the query id and this peer as
+    from-peer-id if the neighbor is known to understand them, in the
+    original 3-field form otherwise. A neighbor that acknowledges with
+    QIDS is sent the long form from then on. """
+    if self.seen is not None and nextpid in self.qidpeers:
+      msgdata = '%s %s %d %s %s' % (peerid, key, ttl, qid, self.myid)
+    else:
+      msgdata = '%s %s %d' % (peerid, key, ttl)
+    for msgtype, ack in self.sendtopeer(nextpid, QUERY, msgdata) or []:
+      if msgtype == REPLY and str(ack).endswith(' ' + QIDS):
+        self.qidpeers.add(nextpid)
+
+
+
+  #--------------------------------------------------------------------------
+  def __sendqresponse(self, peerid, lines, multi=False):
+  #--------------------------------------------------------------------------
+    """ Sends the "file-name  peer-id" lines matching a query straight
+    to its originator: all in one QRESPONSE if the originator is known
+    to read several lines (multi), one QRESPONSE per line otherwise, as
+    peers speaking the original protocol expect. """
+    host,port = peerid.split(':')
+    # can't use sendtopeer here because peerid is not necessarily
+    # an immediate neighbor
+    for msgdata in ['\n'.join(lines)] if multi else lines:
+      self.connectandsend(host, int(port), QRESPONSE, msgdata, pid=peerid)
+
+
+
+  #--------------------------------------------------------------------------
+  def __sendhit(self, nextpid, data):
+  #--------------------------------------------------------------------------
+    """ Passes a QUERYHIT one hop back towards the originator. """
+    host,port = nextpid.split(':')
+    self.connectandsend(host, int(port), QUERYHIT, data, pid=nextpid)
+
+
+
+  #--------------------------------------------------------------------------
+  def __handle_queryhit(self, peerconn, data):
+  #--------------------------------------------------------------------------
+    """ Handles the QUERYHIT message type. The message data should be a
+    line "query-id  return-peer-id" followed by QRESPONSE lines. The
+    originator records the files; any other peer passes the message on
+    to the neighbor it got the query from, or, if it no longer
+    remembers the query, straight to the originator as a QRESPONSE.
+
+    """
+    try:
+      header, lines = data.split('\n', 1)
+      qid, peerid = header.split()
+    except:
+      self.__debug('invalid query hit %s: %s' % (str(peerconn), data))
+      return
+    if peerid == self.myid:
+      self.__handle_qresponse(peerconn, lines)
+      return
+    upstream = self.seen.get(qid) if self.seen is not None else None
+    if upstream:
+      self.__sendhit(upstream, data)
+    else:
+      self.__sendqresponse(peerid, lines.splitlines(),
+                           peerid in self.qidpeers)
+
+
+
+  #--------------------------------------------------------------------------
+  def query(self, key, ttl=4):
+  #--------------------------------------------------------------------------
+    """ Starts a search for key among the neighbors, who propagate it up
+    to ttl further levels. Results arrive as QRESPONSE or QUERYHIT
+    messages and are added to the catalog. Returns the query id. """
+    qid = os.urandom(8).hex()
+    if self.seen is not None:
+      self.seen.add(qid, None)
+    for pid in list(self.getpeerids()):
+      self.__sendquery(pid, self.myid, key, ttl, qid)
+    return qid
 
 
 
@@ -199,18 +398,20 @@ class FilerPeer(BTPeer):
   def __handle_qresponse(self, peerconn, data):
   #--------------------------------------------------------------------------
     """ Handles the QRESPONSE message type. The message data should be
-    in the format of a string, "file-name  peer-id", where file-name is
-    the file that was queried about and peer-id is the name of the peer
-    that has a copy of the file.
+    one or more lines in the format of a string, "file-name  peer-id",
+    where file-name is a file matching the query and peer-id is the name
+    of the peer that has a copy of the file.
 
     """
     try:
-      fname, fpeerid = data.split()
-      if fname in self.files:
-        self.__debug('Can\'t add duplicate file %s %s' % 
-            (fname, fpeerid))
-      else:
-        self.files[fname] = fpeerid
+      for line in data.splitlines():
+        fname, fpeerid = line.split()
+        seeders = self.seeders.setdefault(fname, [])
+        if fpeerid not in seeders:
+          seeders.append(fpeerid)
+        if not self.catalog.addremote(fname, fpeerid):
+          self.__debug('Can\'t add duplicate file %s %s' % 
+              (fname, fpeerid))
     except:
       #if self.debug:
       traceback.print_exc()
@@ -221,30 +422,98 @@ class FilerPeer(BTPeer):
   def __handle_fileget(self, peerconn, data):
   #--------------------------------------------------------------------------
     """ Handles the FILEGET message type. The message data should be in
-    the format of a string, "file-name", where file-name is the name
-    of the file to be fetched.
+    the format of a string, "file-name [offset [length]]", where file-name
+    is the name of the file to be fetched and the optional offset and
+    length select a byte range (the default is the whole file). The range
+    is streamed from disk as a single binary REPLY.
 
     """
-    fname = data
-    if fname not in self.files:
+    fname, offset, length = data, 0, None
+    fields = data.split()
+    if 1 < len(fields) <= 3 and all(f.isdigit() for f in fields[1:]):
+      fname = fields[0]
+      offset = int(fields[1])
+      if len(fields) == 3:
+        length = int(fields[2])
+
+    if not self.catalog.islocal(fname):
       self.__debug('File not found %s' % fname)
       peerconn.senddata(ERROR, 'File not found')
       return
     try:
-      fd = open(fname, 'r')
-      filedata = ''
-      while True:
-        data = fd.read(2048)
-        if not len(data):
-          break;
-        filedata += data
-      fd.close()
+      fd = open(fname, 'rb')
     except:
         self.__debug('Error reading file %s' % fname)
         peerconn.senddata(ERROR, 'Error reading file')
         return
-    
-    peerconn.senddata(REPLY, filedata)
+
+    with fd:
+      size = os.fstat(fd.fileno()).st_size
+      offset = min(offset, size)
+      count = size - offset if length is None else min(length, size - offset)
+      start = time.time()
+      if peerconn.sendfile(REPLY, fd, offset, count):
+        self.__debug('Sent %s [%d:%d] at %.1f MB/s' % (fname, offset,
+              offset + count, throughput(count, time.time() - start)))
+
+
+
+  #--------------------------------------------------------------------------
+  def __handle_fileinfo(self, peerconn, data):
+  #--------------------------------------------------------------------------
+    """ Handles the FILEINFO message type. The message data should be in
+    the format of a string, "file-name [piece-size]". The reply is
+    "size piece-size hash ...", the SHA-1 of every piece of the file,
+    which lets swarmfetch verify pieces fetched from different peers.
+
+    """
+    try:
+      fields = data.split()
+      fname = fields[0]
+      piecesize = int(fields[1]) if len(fields) > 1 else PIECESIZE
+      assert piecesize > 0
+    except:
+      self.__debug('invalid fileinfo %s: %s' % (str(peerconn), data))
+      peerconn.senddata(ERROR, 'Fileinfo: incorrect arguments')
+      return
+
+    if not self.catalog.islocal(fname):
+      self.__debug('File not found %s' % fname)
+      peerconn.senddata(ERROR, 'File not found')
+      return
+    try:
+      info = self.__pieceinfo(fname, piecesize)
+    except:
+      self.__debug('Error reading file %s' % fname)
+      peerconn.senddata(ERROR, 'Error reading file')
+      return
+    peerconn.senddata(REPLY, info)
+
+
+
+  #--------------------------------------------------------------------------
+  def __pieceinfo(self, fname, piecesize):
+  #--------------------------------------------------------------------------
+    """ Returns the FILEINFO reply for a local file, hashing it only when
+    it has changed since the last request. """
+    mtime = os.stat(fname).st_mtime_ns
+    cached = self.pieceinfo.get((fname, piecesize))
+    if cached and cached[0] == mtime:
+      return cached[1]
+
+    hashes = []
+    size = 0
+    with open(fname, 'rb') as fd:
+      buf = bytearray(piecesize)
+      while True:
+        n = fd.readinto(buf)
+        if not n:
+          break
+        hashes.append(hashlib.sha1(memoryview(buf)[:n]).hexdigest())
+        size += n
+    info = ' '.join(['%d %d' % (size, piecesize)] + hashes)
+    self.pieceinfo[(fname, piecesize)] = (mtime, info)
+    return info
 
 
 
@@ -274,54 +543,293 @@ class FilerPeer(BTPeer):
 
 
 
-  # precondition: may be a good idea to hold the lock before going
-  #               into this function
   #--------------------------------------------------------------------------
-  def buildpeers(self, host, port, hops=1):
+  def buildpeers(self, host, port, hops=1, maxparallel=32):
   #--------------------------------------------------------------------------
-    """ buildpeers(host, port, hops) 
+    """ buildpeers(host, port, hops, maxparallel)
 
     Attempt to build the local peer list up to the limit stored by
-    self.maxpeers, using a simple depth-first search given an
-    initial host and port as starting point. The depth of the
-    search is limited by the hops parameter.
+    self.maxpeers, using a breadth-first search given an initial host
+    and port as starting point. The depth of the search is limited by
+    the hops parameter.
+
+    Each level of the search is contacted concurrently, up to
+    maxparallel requests at a time: every candidate is asked for its
+    name (timing the round trip) and for its peer list at once. The
+    candidates that answered are then asked to insert this peer in
+    order of round-trip time, so the closest ones fill the free slots;
+    the peers they listed make up the next level.
 
     """
-    if self.maxpeersreached() or not hops:
-      return
+    frontier = [(host, str(port))]
+    visited = set(frontier)
+
+    with ThreadPoolExecutor(maxparallel) as executor:
+      while frontier and hops and not self.maxpeersreached():
+        self.__debug("Building peers from %d candidates" % len(frontier))
+        probes = [(h, p, executor.submit(self.__timedrequest, h, p, PEERNAME),
+               executor.submit(self.__timedrequest, h, p, LISTPEERS))
+              for h, p in frontier]
+
+        candidates = []
+        frontier = []
+        for h, p, name, listing in probes:
+          try:
+            rtt, resp = name.result()
+            if not resp or resp[0][0] != REPLY:
+              continue
+            candidates.append((rtt, resp[0][1], h, p))
+            for _, entry in listing.result()[1][1:]:
+              nextpid, nexthost, nextport = entry.split()
+              if nextpid != self.myid and (nexthost, nextport) not in visited:
+                visited.add((nexthost, nextport))
+                frontier.append((nexthost, nextport))
+          except:
+            if self.debug:
+              traceback.print_exc()
+
+        candidates.sort()
+        self.__joinpeers(executor, candidates)
+        hops -= 1
 
-    peerid = None
 
-    self.__debug("Building peers from (%s,%s)" % (host,port))
 
-    try:
-      _, peerid = self.connectandsend(host, port, PEERNAME, '')[0]
-
-      self.__debug("contacted " + peerid)
-      resp = self.connectandsend(host, port, INSERTPEER, 
-          '%s %s %d' % (self.myid, 
-                  self.serverhost, 
-                  self.serverport))[0]
-      self.__debug(str(resp))
-      if (resp[0] != REPLY) or (peerid in self.getpeerids()):
-        return
+  #--------------------------------------------------------------------------
+  def __timedrequest(self, host, port, msgtype, msgdata=''):
+  #--------------------------------------------------------------------------
+    """ Returns (seconds taken, replies) for one connectandsend. """
+    start = time.time()
+    resp = self.connectandsend(host, port, msgtype, msgdata)
+    return time.time() - start, resp
+
+
+
+  #--------------------------------------------------------------------------
+  def __joinpeers(self, executor, candidates):
+  #--------------------------------------------------------------------------
+    """ Sends INSERTPEER to the (rtt, peerid, host, port) candidates, in
+    order, as many at a time as there are free slots in the peer list, and
+    adds those that accept. Their round-trip times seed self.health. """
+    msg = '%s %s %d' % (self.myid, self.serverhost, self.serverport)
+    known = set(self.getpeerids())
+    candidates = [c for c in candidates
+            if c[1] not in known and c[1] != self.myid]
+
+    while candidates and not self.maxpeersreached():
+      free = (self.maxpeers - self.numberofpeers() if self.maxpeers
+          else len(candidates))
+      batch, candidates = candidates[:free], candidates[free:]
+      replies = [executor.submit(self.connectandsend, h, p, INSERTPEER, msg)
+            for rtt, peerid, h, p in batch]
+      for (rtt, peerid, h, p), reply in zip(batch, replies):
+        resp = reply.result()
+        self.__debug("%s: %s" % (peerid, resp))
+        if resp and resp[0][0] == REPLY:
+          with self.peerlock:
+            if self.addpeer(peerid, h, p):
+              self.recordcheck(peerid, rtt)
+
+
+
+  #--------------------------------------------------------------------------
+  def fetchfile(self, host, port, fname, localname=None, resume=True,
+                timeout=FETCHTIMEOUT):
+  #--------------------------------------------------------------------------
+    """ fetchfile(host, port, file name, local name, resume, timeout)
+    -> (bytes received, MB/s) or None
+
+    Fetches a file with FILEGET, writing it to disk as it arrives
+    rather than holding it in memory. Data goes to "localname.part",
+    which is renamed to localname (default: fname) once complete; if
+    resume is set and a .part file is left over from an interrupted
+    transfer, only the missing bytes are requested. A peer that sends
+    nothing for timeout seconds interrupts the transfer.
+
+    """
+    localname = localname or fname
+    partname = localname + '.part'
+    offset = 0
+    if resume and os.path.exists(partname):
+      offset = os.path.getsize(partname)
 
-      self.addpeer(peerid, host, port)
-
-      # do recursive depth first search to add more peers
-      resp = self.connectandsend(host, port, LISTPEERS, '',
-          pid=peerid)
-      if len(resp) > 1:
-        resp.reverse()
-        resp.pop()    # get rid of header count reply
-        while len(resp):
-          nextpid,host,port = resp.pop()[1].split()
-          if nextpid != self.myid:
-            self.buildpeers(host, port, hops - 1)
+    start = time.time()
+    try:
+      peerconn = BTPeerConnection(None, host, port, debug=self.debug,
+            timeout=timeout)
+      try:
+        peerconn.senddata(FILEGET, '%s %d' % (fname, offset))
+        with open(partname, 'r+b' if offset else 'wb') as fd:
+          fd.seek(offset)
+          msgtype, msgdata = peerconn.recvtofile(fd, REPLY)
+      finally:
+        peerconn.close()
     except:
       if self.debug:
         traceback.print_exc()
-      self.removepeer(peerid)
+      return None
+
+    if msgtype != REPLY:
+      self.__debug('Fetch %s failed: %s' % (fname, msgdata))
+      # keep what an interrupted transfer (msgtype None) got, for resume
+      if msgtype is not None and not offset and os.path.exists(partname):
+        os.remove(partname)
+      return None
+
+    os.replace(partname, localname)
+    mbps = throughput(msgdata, time.time() - start)
+    self.__debug('Fetched %s (%d bytes from offset %d) at %.1f MB/s'
+          % (fname, msgdata, offset, mbps))
+    return (msgdata, mbps)
+
+
+
+  #--------------------------------------------------------------------------
+  def swarmfetch(self, fname, peerids=None, localname=None,
+                 piecesize=PIECESIZE, perpeer=2, maxstrikes=3,
+                 timeout=FETCHTIMEOUT):
+  #--------------------------------------------------------------------------
+    """ swarmfetch(file name, peer ids, local name, piece size,
+    connections per peer, bad pieces allowed per peer, timeout)
+    -> (bytes received, MB/s) or None
+
+    Downloads a file from every peer that holds it at once (by default
+    the seeders learned from QRESPONSE messages). The file is split into
+    pieces of piecesize bytes; each peer serves pieces over perpeer
+    parallel connections with ranged FILEGETs, and every piece is
+    received straight into a memory-mapped, preallocated
+    "localname.part" and checked against the SHA-1 hashes announced by
+    FILEINFO. A piece that fails, or stalls for timeout seconds, is
+    fetched again from another peer; peers that fail maxstrikes times
+    are dropped. Pieces already valid
+    in a leftover .part file are kept, so an interrupted download
+    resumes.
+
+    """
+    if peerids is None:
+      peerids = self.seeders.get(fname) or [self.catalog.getpeer(fname)]
+    peerids = [pid for pid in peerids if pid]
+    localname = localname or fname
+    partname = localname + '.part'
+
+    # agree on size and hashes: the answer given by most peers wins
+    infos = {}
+    for pid in peerids:
+      host, port = pid.split(':')
+      resp = self.connectandsend(host, int(port), FILEINFO,
+            '%s %d' % (fname, piecesize), pid=pid)
+      if resp and resp[0][0] == REPLY:
+        infos.setdefault(resp[0][1], []).append(pid)
+    if not infos:
+      self.__debug('Swarm %s: no peer answered FILEINFO' % fname)
+      return None
+    info, seeders = max(infos.items(), key=lambda item: len(item[1]))
+    fields = info.split()
+    size, piecesize, hashes = int(fields[0]), int(fields[1]), fields[2:]
+
+    start = time.time()
+    with open(partname, 'r+b' if os.path.exists(partname) else 'w+b') as fd:
+      fd.truncate(size)
+      if size:
+        mm = mmap.mmap(fd.fileno(), size)
+        try:
+          received = self.__swarm(fname, seeders, mm, size, piecesize,
+                hashes, perpeer, maxstrikes, timeout)
+          mm.flush()
+        finally:
+          mm.close()
+      else:
+        received = 0
+    if received is None:
+      return None
+
+    os.replace(partname, localname)
+    mbps = throughput(received, time.time() - start)
+    self.__debug('Swarm fetched %s (%d bytes from %d peers) at %.1f MB/s'
+          % (fname, received, len(seeders), mbps))
+    return (received, mbps)
+
+
+
+  #--------------------------------------------------------------------------
+  def __swarm(self, fname, seeders, mm, size, piecesize, hashes, perpeer,
+              maxstrikes, timeout):
+  #--------------------------------------------------------------------------
+    """ Fills the memory map with verified pieces. Returns the number of
+    bytes downloaded, or None if some pieces could not be fetched. """
+    view = memoryview(mm)
+    todo = queue.Queue()
+    for i, digest in enumerate(hashes):
+      piece = view[i * piecesize:min((i + 1) * piecesize, size)]
+      if hashlib.sha1(piece).hexdigest() != digest:
+        todo.put(i)
+      piece.release()
+
+    lock = threading.Lock()
+    strikes = dict((pid, 0) for pid in seeders)
+    received = [0]
+
+    def fetchpiece(host, port, i):
+      offset = i * piecesize
+      piece = view[offset:min(offset + piecesize, size)]
+      try:
+        peerconn = BTPeerConnection(None, host, port, timeout=timeout)
+        try:
+          peerconn.senddata(FILEGET, '%s %d %d' % (fname, offset, len(piece)))
+          msgtype, _ = peerconn.recvinto(piece, REPLY)
+        finally:
+          peerconn.close()
+        return (msgtype == REPLY and
+                hashlib.sha1(piece).hexdigest() == hashes[i])
+      except:
+        if self.debug:
+          traceback.print_exc()
+        return False
+      finally:
+        piece.release()
+
+    def worker(pid):
+      host, port = pid.split(':')
+      while strikes[pid] < maxstrikes:
+        try:
+          i = todo.get_nowait()
+        except queue.Empty:
+          return
+        if fetchpiece(host, int(port), i):
+          with lock:
+            received[0] += min(piecesize, size - i * piecesize)
+        else:
+          self.__debug('Swarm %s: bad piece %d from %s' % (fname, i, pid))
+          todo.put(i)
+          with lock:
+            strikes[pid] += 1
+
+    try:
+      # a round ends when the queue runs dry; pieces that failed at the
+      # very end are put back and picked up by the next round
+      while not todo.empty():
+        alive = [pid for pid in seeders if strikes[pid] < maxstrikes]
+        if not alive:
+          self.__debug('Swarm %s: no usable peers left' % fname)
+          return None
+        workers = [threading.Thread(target=worker, args=[pid])
+              for pid in alive for n in range(perpeer)]
+        for t in workers:
+          t.start()
+        for t in workers:
+          t.join()
+    finally:
+      view.release()
+    return received[0]
+
+
+
+  #--------------------------------------------------------------------------
+  @property
+  def files(self):
+  #--------------------------------------------------------------------------
+    """ Snapshot of every known file: name --> peerid mapping, with local
+    files mapped to None. """
+    return self.catalog.items()
 
 
 
@@ -330,5 +838,17 @@ class FilerPeer(BTPeer):
   #--------------------------------------------------------------------------
     """ Registers a locally-stored file with the peer. """
     
-    self.files[filename] = None
-    self.__debug("Added local file %s" % filename)
\ No newline at end of file
+    self.catalog.addlocal(filename)
+    self.__debug("Added local file %s" % filename)
+
+
+
+#==============================================================================
+class AsyncFilerPeer(FilerPeer, AsyncBTPeer):
+#==============================================================================
+  """ The same file-sharing peer running on the asyncio engine: one event
+  loop and a bounded handler thread pool instead of a thread per
+  connection.
+
+  """
+  pass
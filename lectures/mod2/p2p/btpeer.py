@@ -2,6 +2,11 @@
 
 # [P2P Programming Framework - Python](https://cs.berry.edu/~nhamid/p2p/btpeer.py)
 
+import errno
+import os
+import queue
+import select
+import selectors
 import socket
 import struct
 import threading
@@ -9,11 +14,62 @@ import time
 import traceback
 
 
+# Reserved message types used by persistent (multiplexed) connections.
+MUXCONNECT = 'MUXC'  # client asks to switch a connection to multiplexed mode
+MUXACCEPT = 'MUXA'   # server agrees to the switch
+MUXDONE = 'MUXD'     # no more replies will follow for a request id
+MUXPOLL = 1          # seconds between shutdown checks on a quiet
+                     # multiplexed server connection
+
+# Frame headers, compiled once: message type, [request id,] payload length.
+HEADER = struct.Struct( "!4sL" )
+MUXHEADER = struct.Struct( "!4sLL" )
+
+
 def btdebug( msg ):
 	""" Prints a messsage to the screen with the name of the current thread """
 	print ("[%s] %s" % ( str(threading.currentThread().getName()), msg ))
 
 
+
+_localaddress = None
+
+def localaddress():
+	""" Returns this machine's IP address as other peers should see it,
+	without sending anything on the network. In order of preference:
+	the BTPEER_HOST environment variable; the source address the kernel
+	would use to reach a public address (found by connecting a UDP
+	socket, which sends no packet); a non-loopback address of this host
+	name; 127.0.0.1. The result is cached for the life of the process.
+
+	"""
+	global _localaddress
+	if _localaddress:
+		return _localaddress
+
+	addr = os.environ.get( 'BTPEER_HOST' )
+	if not addr:
+		s = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+		try:
+			s.connect( ( '192.0.2.1', 9 ) )   # TEST-NET-1: routed, never used
+			addr = s.getsockname()[0]
+		except OSError:                       # no route: isolated host
+			pass
+		finally:
+			s.close()
+	if not addr or addr.startswith( '0.' ):
+		try:
+			addrs = [ a[4][0] for a in socket.getaddrinfo( socket.gethostname(),
+								None, socket.AF_INET ) ]
+		except OSError:
+			addrs = []
+		addrs = [ a for a in addrs if not a.startswith( '127.' ) ]
+		addr = addrs[0] if addrs else '127.0.0.1'
+
+	_localaddress = addr
+	return addr
+
+
 #==============================================================================
 class BTPeer:
 	""" Implements the core functionality that might be used by a peer in a
@@ -29,8 +85,8 @@ class BTPeer:
 		be set to 0 to allow unlimited number of peers), listening on
 		a given server port , with a given canonical peer name (id)
 		and host address. If not supplied, the host address
-		(serverhost) will be determined by attempting to connect to an
-		Internet host like Google.
+		(serverhost) will be determined by localaddress(), which does
+		not need network access.
 
 		"""
 		self.debug = 0
@@ -51,24 +107,26 @@ class BTPeer:
 																# peers list (maybe better to use
 																# threading.RLock (reentrant))
 		self.peers = {}        # peerid ==> (host, port) mapping
+		self.health = {}       # peerid ==> liveness check results, see
+		                       # recordcheck
 		self.shutdown = False  # used to stop the main loop
 
 		self.handlers = {}
 		self.router = None
 
+		self.pool = None       # optional BTPeerPool used by connectandsend
+		self.muxidle = 60      # seconds a multiplexed server connection may
+		                       # stay silent before it is closed
+		self.muxworkers = 16   # requests handled at once on one multiplexed
+		                       # server connection
+
 
 
 	#--------------------------------------------------------------------------
 	def __initserverhost( self ):
 	#--------------------------------------------------------------------------
-		""" Attempt to connect to an Internet host in order to determine the
-		local machine's IP address.
-
-		"""
-		s = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
-		s.connect( ( "www.google.com", 80 ) )
-		self.serverhost = s.getsockname()[0]
-		s.close()
+		""" Determine the local machine's IP address (see localaddress). """
+		self.serverhost = localaddress()
 
 
 
@@ -99,7 +157,10 @@ class BTPeer:
 			msgtype, msgdata = peerconn.recvdata()
 			if msgtype: 
 				msgtype = msgtype.upper()
-			if msgtype not in self.handlers:
+			if msgtype == MUXCONNECT:
+				peerconn.senddata( MUXACCEPT, '' )
+				self.__handlemux( peerconn )
+			elif msgtype not in self.handlers:
 				self.__debug( 'Not handled: %s: %s' % (msgtype, msgdata) )
 			else:
 				self.__debug( 'Handling peer msg: %s: %s' % (msgtype, msgdata) )
@@ -117,6 +178,104 @@ class BTPeer:
 
 
 
+	#--------------------------------------------------------------------------
+	def __handlemux( self, peerconn ):
+	#--------------------------------------------------------------------------
+		"""
+		handlemux( peer connection ) -> ()
+
+		Serves a persistent connection that was switched to multiplexed
+		mode. Every frame carries a request id; requests are handled by
+		up to self.muxworkers threads of this connection, started as
+		needed and reused, so a slow request does not hold up the others.
+		The handler replies through a BTMuxReply tagged with that id, and
+		a MUXDONE frame closes the request; sendmux serialises the
+		writes. Returns when the client disconnects or the connection
+		stays idle, with no request in progress, for self.muxidle seconds.
+		"""
+		# replies and the MUXDONE that follows them are small separate
+		# writes; without NODELAY, Nagle waits for the client's delayed ACK
+		peerconn.s.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+		peerconn.s.settimeout( self.muxidle )
+		jobs = queue.Queue( self.muxworkers )  # full: stop reading requests
+		workers = []
+		state = { 'active': 0,    # requests received and not yet done
+				'idle': 0,      # workers with nothing to do
+				'queued': 0 }   # requests queued for the next free worker
+		lock = threading.Lock()
+
+		def work():
+			while True:
+				job = jobs.get()
+				if job is None:
+					return
+				reqid, msgtype, msgdata = job
+				reply = BTMuxReply( peerconn, reqid )
+				try:
+					if msgtype not in self.handlers:
+						self.__debug( 'Not handled: %s: %s'
+										% (msgtype, msgdata) )
+					else:
+						self.__debug( 'Handling mux msg %d: %s: %s'
+										% (reqid, msgtype, msgdata) )
+						self.handlers[ msgtype ]( reply, msgdata )
+				except KeyboardInterrupt:
+					raise
+				except:
+					if self.debug:
+						traceback.print_exc()
+				peerconn.sendmux( reqid, MUXDONE, '' )
+				with lock:
+					state['active'] -= 1
+					if state['queued']:
+						state['queued'] -= 1   # take it at once
+					else:
+						state['idle'] += 1
+
+		sel = selectors.DefaultSelector()
+		sel.register( peerconn.s, selectors.EVENT_READ )
+		lastbusy = time.time()
+		try:
+			while not self.shutdown:
+				# wait for the next frame here rather than in recvmux, so
+				# that a connection that is only busy is not taken for idle;
+				# wake every MUXPOLL seconds to notice self.shutdown
+				if not sel.select( min( MUXPOLL, self.muxidle ) ):
+					with lock:
+						busy = state['active']
+					if busy:
+						lastbusy = time.time()
+					elif time.time() - lastbusy >= self.muxidle:
+						break
+					continue
+				lastbusy = time.time()
+				reqid, msgtype, msgdata = peerconn.recvmux()
+				if msgtype is None:
+					break
+				with lock:
+					state['active'] += 1
+					start = False
+					if state['idle']:
+						state['idle'] -= 1
+					elif len(workers) < self.muxworkers:
+						start = True
+					else:
+						state['queued'] += 1
+				if start:
+					t = threading.Thread( target = work )
+					t.start()
+					workers.append( t )
+				jobs.put( ( reqid, msgtype.upper(), msgdata ) )
+		finally:
+			sel.close()
+			# the caller closes the connection: let the workers finish first
+			for t in workers:
+				jobs.put( None )
+			for t in workers:
+				t.join()
+
+
+
 	#--------------------------------------------------------------------------
 	def __runstabilizer( self, stabilizer, delay ):
 	#--------------------------------------------------------------------------
@@ -126,6 +285,17 @@ class BTPeer:
 
 	    
 
+	#--------------------------------------------------------------------------
+	def spawn( self, target, args=() ):
+	#--------------------------------------------------------------------------
+		""" Runs target(*args) in the background, for handlers that answer
+		right away and finish their work later. This engine starts a
+		thread; others may override it (e.g. to use a pool). """
+		t = threading.Thread( target = target, args = args )
+		t.start()
+
+
+
 	#--------------------------------------------------------------------------
 	def setmyid( self, myid ):
 	#--------------------------------------------------------------------------
@@ -146,6 +316,21 @@ class BTPeer:
 
 	
 
+	#--------------------------------------------------------------------------
+	def enablepool( self, maxidle=30, timeout=None ):
+	#--------------------------------------------------------------------------
+		""" Makes connectandsend (and therefore sendtopeer) reuse one
+		persistent, multiplexed connection per neighbor instead of
+		opening a new socket for every message. Connections unused for
+		maxidle seconds are closed; timeout bounds how long a request
+		waits for its replies (None waits forever).
+
+		"""
+		self.pool = BTPeerPool( maxidle, timeout, debug=self.debug )
+		return self.pool
+
+
+
 	#--------------------------------------------------------------------------
 	def addhandler( self, msgtype, handler ):
 	#--------------------------------------------------------------------------
@@ -203,6 +388,7 @@ class BTPeer:
 		""" Removes peer information from the known list of peers. """
 		if peerid in self.peers:
 			del self.peers[ peerid ]
+		self.health.pop( peerid, None )
 
 
 
@@ -320,6 +506,20 @@ class BTPeer:
 		reply, if expected, will be returned as a list of tuples.
 
 		"""
+		if self.pool:
+			try:
+				msgreply = self.pool.request( host, port, msgtype, msgdata,
+										pid=pid, waitreply=waitreply )
+				if msgreply is not None:
+					return msgreply
+				# peer does not speak the multiplexed protocol: fall back
+			except KeyboardInterrupt:
+				raise
+			except:
+				if self.debug:
+					traceback.print_exc()
+				return []
+
 		msgreply = []
 		try:
 			peerconn = BTPeerConnection( pid, host, port, debug=self.debug )
@@ -347,33 +547,117 @@ class BTPeer:
 
 
 	#--------------------------------------------------------------------------
-	def checklivepeers( self ):
+	def getpeerrtt( self, peerid ):
 	#--------------------------------------------------------------------------
-		""" Attempts to ping all currently known peers in order to ensure that
-		they are still active. Removes any from the peer list that do
-		not reply. This function can be used as a simple stabilizer.
+		""" Returns the smoothed round-trip time (seconds) measured to a
+		peer by the liveness checks, or None if it was never reached. """
+		h = self.health.get( peerid )
+		return h and h['rtt']
+
+
+
+	#--------------------------------------------------------------------------
+	def recordcheck( self, peerid, rtt, backoff=3, maxfailures=3 ):
+	#--------------------------------------------------------------------------
+		""" Records the result of one liveness check: the connect time in
+		seconds, or None if the peer could not be reached. A peer that
+		fails is not checked again for backoff * 2**(failures - 1)
+		seconds (at most 64 * backoff), so flapping peers are probed less
+		and less often; it is removed after maxfailures failures in a row.
+		Returns True if the peer was removed. Call with peerlock held.
 
 		"""
-		todelete = []
-		for pid in self.peers:
-			isconnected = False
-			try:
+		h = self.health.setdefault( peerid,
+						{ 'rtt': None, 'failures': 0, 'nextcheck': 0 } )
+		if rtt is not None:
+			h['rtt'] = rtt if h['rtt'] is None else 0.8 * h['rtt'] + 0.2 * rtt
+			h['failures'] = 0
+			h['nextcheck'] = 0
+			return False
+
+		h['failures'] += 1
+		if h['failures'] >= maxfailures:
+			self.__debug( 'Removing dead peer %s' % peerid )
+			self.removepeer( peerid )
+			return True
+		h['nextcheck'] = time.time() + backoff * 2 ** min(h['failures'] - 1, 6)
+		return False
+
+
+
+	#--------------------------------------------------------------------------
+	def checklivepeers( self, timeout=2, maxparallel=512, maxfailures=3 ):
+	#--------------------------------------------------------------------------
+		""" Attempts to ping the known peers that are due for a check, in
+		order to ensure that they are still active. This function can be
+		used as a simple stabilizer.
+
+		A peer is not removed the first time it fails to answer: see
+		recordcheck. It is checked again after a backoff that doubles
+		with each consecutive failure, and dropped from the peer list
+		only after maxfailures failures in a row; one success resets
+		the count.
+
+		Up to maxparallel non-blocking connects are in flight at once, from
+		this one thread, and each gets timeout seconds, so one sweep over
+		thousands of peers takes about one timeout. The connect time is
+		recorded as the peer's RTT.
+
+		"""
+		now = time.time()
+		with self.peerlock:
+			todo = [ (pid, host, port) for pid, (host, port)
+						in self.peers.items()
+						if self.health.get( pid, {} ).get( 'nextcheck', 0 ) <= now ]
+		todo.reverse()
+		results = {}              # peerid ==> rtt or None
+		sel = selectors.DefaultSelector()
+		ping = HEADER.pack( b'PING', 0 )
+
+		def finish( key, rtt ):
+			sel.unregister( key.fileobj )
+			key.fileobj.close()
+			results[ key.data[0] ] = rtt
+
+		while todo or sel.get_map():
+			while todo and len(sel.get_map()) < maxparallel:
+				pid, host, port = todo.pop()
 				self.__debug( 'Check live %s' % pid )
-				host,port = self.peers[pid]
-				peerconn = BTPeerConnection( pid, host, port, debug=self.debug )
-				peerconn.senddata( 'PING', '' )
-				isconnected = True
-			except:
-				todelete.append( pid )
-			if isconnected:
-				peerconn.close()
+				s = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+				s.setblocking( False )
+				try:
+					err = s.connect_ex( ( host, int(port) ) )
+				except OSError:          # e.g. the host name does not resolve
+					err = errno.EHOSTUNREACH
+				if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+					s.close()
+					results[ pid ] = None
+					continue
+				sel.register( s, selectors.EVENT_WRITE, (pid, time.time()) )
 
-		self.peerlock.acquire()
-		try:
-			for pid in todelete: 
-				if pid in self.peers: del self.peers[pid]
-		finally:
-			self.peerlock.release()
+			for key, events in sel.select( timeout=0.05 ):
+				pid, start = key.data
+				s = key.fileobj
+				if s.getsockopt( socket.SOL_SOCKET, socket.SO_ERROR ):
+					finish( key, None )
+					continue
+				rtt = time.time() - start
+				try:
+					s.send( ping )
+				except OSError:
+					pass
+				finish( key, rtt )
+
+			deadline = time.time() - timeout
+			for key in list( sel.get_map().values() ):
+				if key.data[1] < deadline:
+					finish( key, None )
+		sel.close()
+
+		with self.peerlock:
+			for pid, rtt in results.items():
+				if pid in self.peers:
+					self.recordcheck( pid, rtt, maxfailures=maxfailures )
 	# end checklivepeers method
 
 
@@ -408,6 +692,8 @@ class BTPeer:
 		self.__debug( 'Main loop exiting' )
 
 		s.close()
+		if self.pool:
+			self.pool.closeall()
 
 		# end mainloop method
 
@@ -422,30 +708,80 @@ class BTPeer:
 
 
 class BTPeerConnection:
+	""" One framed connection to a peer. A frame is an 8-byte HEADER (or a
+	12-byte MUXHEADER in multiplexed mode) followed by the payload. The
+	header is read into a preallocated buffer and the payload straight
+	into a bytearray of the announced length, and both are sent with one
+	scatter-gather sendmsg, so a payload is never copied or concatenated
+	in Python.
+
+	"""
 
 	#--------------------------------------------------------------------------
-	def __init__( self, peerid, host, port, sock=None, debug=False ):
+	def __init__( self, peerid, host, port, sock=None, debug=False,
+		timeout=None ):
 	#--------------------------------------------------------------------------
-		# any exceptions thrown upwards
+		# any exceptions thrown upwards; with a timeout (seconds), a
+		# connect or any later send or receive that takes longer fails
 
 		self.id = peerid
 		self.debug = debug
 
 		if not sock:
 			self.s = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+			self.s.settimeout( timeout )
 			self.s.connect( ( host, int(port) ) )
 		else:
 			self.s = sock
 
-		self.sd = self.s.makefile( 'rwb', 0 )
+		self.hbuf = bytearray( MUXHEADER.size )   # reused for every header
+		self.sendlock = threading.Lock()  # frames from several threads may
+		                                  # share a multiplexed connection
+
+
+	#--------------------------------------------------------------------------
+	def __recvinto( self, view ):
+	#--------------------------------------------------------------------------
+		""" Fills the memoryview from the socket. Returns False if the peer
+		closed the connection first. """
+		while len(view):
+			n = self.s.recv_into( view )
+			if not n:
+				return False
+			view = view[n:]
+		return True
+
+
+	#--------------------------------------------------------------------------
+	def __sendframe( self, header, msgdata ):
+	#--------------------------------------------------------------------------
+		""" Sends header and payload with as few system calls as possible,
+		resuming after partial writes. """
+		with self.sendlock:
+			if not hasattr( self.s, 'sendmsg' ):    # e.g. Windows
+				self.s.sendall( header )
+				self.s.sendall( msgdata )
+				return
+			buffers = [ memoryview( header ), memoryview( msgdata ).cast( 'B' ) ]
+			while buffers:
+				n = self.s.sendmsg( buffers )
+				while buffers and n >= len(buffers[0]):
+					n -= len(buffers[0])
+					buffers.pop( 0 )
+				if buffers:
+					buffers[0] = buffers[0][n:]
 
 
 	#--------------------------------------------------------------------------
-	def __makemsg( self, msgtype, msgdata ):
+	def __sendfileframe( self, header, fileobj, offset, count ):
 	#--------------------------------------------------------------------------
-		msglen = len(msgdata)
-		msg = struct.pack( "!4sL%ds" % msglen, msgtype, msglen, msgdata )
-		return msg
+		""" Sends header followed by count bytes of fileobj from offset;
+		socket.sendfile lets the kernel copy the file (os.sendfile). """
+		with self.sendlock:
+			self.s.sendall( header )
+			sent = self.s.sendfile( fileobj, offset, count ) if count else 0
+		if sent != count:
+			raise IOError( 'file shrank: sent %d of %d bytes' % (sent, count) )
 
 
 	#--------------------------------------------------------------------------
@@ -455,20 +791,67 @@ class BTPeerConnection:
 			btdebug( msg )
 
 
+	#--------------------------------------------------------------------------
+	def sendfile( self, msgtype, fileobj, offset=0, count=None ):
+	#--------------------------------------------------------------------------
+		"""
+		sendfile( message type, binary file, offset, byte count )
+		-> boolean status
+
+		Sends count bytes of an open binary file, starting at offset, as
+		the payload of one message without reading it into memory. count
+		defaults to the rest of the file.
+		"""
+
+		try:
+			if count is None:
+				count = os.fstat( fileobj.fileno() ).st_size - offset
+			header = HEADER.pack( tobytes( msgtype ), count )
+			self.__sendfileframe( header, fileobj, offset, count )
+		except KeyboardInterrupt:
+			raise
+		except:
+			if self.debug:
+				traceback.print_exc()
+			return False
+		return True
+
+
+	#--------------------------------------------------------------------------
+	def sendmuxfile( self, reqid, msgtype, fileobj, offset=0, count=None ):
+	#--------------------------------------------------------------------------
+		""" sendfile for connections in multiplexed mode. Other requests
+		on the connection wait until the whole file has been sent. """
+
+		try:
+			if count is None:
+				count = os.fstat( fileobj.fileno() ).st_size - offset
+			header = MUXHEADER.pack( tobytes( msgtype ), reqid, count )
+			self.__sendfileframe( header, fileobj, offset, count )
+		except KeyboardInterrupt:
+			raise
+		except:
+			if self.debug:
+				traceback.print_exc()
+			return False
+		return True
+
+
 	#--------------------------------------------------------------------------
 	def senddata( self, msgtype, msgdata ):
 	#--------------------------------------------------------------------------
 		"""
 		senddata( message type, message data ) -> boolean status
 
-		Send a message through a peer connection. Returns True on success
-		or False if there was an error.
+		Send a message through a peer connection. The message data may be
+		a str or any bytes-like object. Returns True on success or False
+		if there was an error.
 		"""
 
 		try:
-			msg = self.__makemsg( msgtype, msgdata )
-			self.sd.write( msg )
-			self.sd.flush()
+			msgdata = tobytes( msgdata )
+			header = HEADER.pack( tobytes( msgtype ), len(msgdata) )
+			self.__sendframe( header, msgdata )
 		except KeyboardInterrupt:
 			raise
 		except:
@@ -478,32 +861,110 @@ class BTPeerConnection:
 		return True
 	    
 
+	#--------------------------------------------------------------------------
+	def recvframe( self ):
+	#--------------------------------------------------------------------------
+		"""
+		recvframe() -> (msgtype, bytearray msgdata)
+
+		Like recvdata, but the payload is returned as received, without
+		decoding it. Returns (None, None) if there was any error.
+		"""
+
+		try:
+			msgtype, msglen = self.__recvheader()
+			if msgtype is None:
+				return (None, None)
+			msg = bytearray( msglen )
+			if not self.__recvinto( memoryview( msg ) ):
+				return (None, None)
+
+		except KeyboardInterrupt:
+			raise
+		except:
+			if self.debug:
+				traceback.print_exc()
+			return (None, None)
+
+		return ( msgtype, msg )
+
+		# end recvframe method
+
+
 	#--------------------------------------------------------------------------
 	def recvdata( self ):
 	#--------------------------------------------------------------------------
 		"""
 		recvdata() -> (msgtype, msgdata)
 
-		Receive a message from a peer connection. Returns (None, None)
-		if there was any error.
+		Receive a message from a peer connection. The payload is a str,
+		or bytes if it is not UTF-8 text (see frompayload). Returns
+		(None, None) if there was any error.
+		"""
+
+		msgtype, msg = self.recvframe()
+		if msgtype is None:
+			return (None, None)
+		return ( msgtype, frompayload( msg ) )
+
+
+	#--------------------------------------------------------------------------
+	def recvtofile( self, fileobj, filetype, bufsize=1 << 20 ):
+	#--------------------------------------------------------------------------
+		"""
+		recvtofile( binary file, message type, buffer size )
+		-> (msgtype, msgdata)
+
+		Receives one message. If it is of type filetype, its payload is
+		written to fileobj as it arrives, through one reusable buffer, and
+		msgdata is the number of bytes written. Any other message is
+		returned as by recvdata. Returns (None, None) if there was any
+		error, including a connection lost part way through the payload.
 		"""
 
 		try:
-			msgtype = self.sd.read( 4 )
-			if not msgtype: 
-				return (None, None)
-			
-			lenstr = self.sd.read( 4 )
-			msglen = int(struct.unpack( "!L", lenstr )[0])
-			msg = ""
+			msgtype, msglen = self.__recvheader()
+			if msgtype != filetype:
+				return self.__recvother( msgtype, msglen )
+
+			buf = memoryview( bytearray( min(bufsize, msglen) ) )
+			remaining = msglen
+			while remaining:
+				n = self.s.recv_into( buf[:min(remaining, len(buf))] )
+				if not n:
+					return (None, None)
+				fileobj.write( buf[:n] )
+				remaining -= n
 
-			while len(msg) != msglen:
-				data = self.sd.read( min(2048, msglen - len(msg)) )
-				if not len(data):
-						break
-				msg += data
+		except KeyboardInterrupt:
+			raise
+		except:
+			if self.debug:
+				traceback.print_exc()
+			return (None, None)
+
+		return ( msgtype, msglen )
+
+		# end recvtofile method
+
+
+	#--------------------------------------------------------------------------
+	def recvinto( self, view, filetype ):
+	#--------------------------------------------------------------------------
+		"""
+		recvinto( writable buffer, message type ) -> (msgtype, msgdata)
+
+		Like recvtofile, but a payload of type filetype is received
+		straight into the given buffer (e.g. a slice of a memory-mapped
+		file). The payload must fill the buffer exactly; msgdata is its
+		length.
+		"""
 
-			if len(msg) != msglen:
+		try:
+			msgtype, msglen = self.__recvheader()
+			if msgtype != filetype:
+				return self.__recvother( msgtype, msglen )
+			if msglen != len(view) or not self.__recvinto( view ):
 				return (None, None)
 
 		except KeyboardInterrupt:
@@ -513,9 +974,90 @@ class BTPeerConnection:
 				traceback.print_exc()
 			return (None, None)
 
-		return ( msgtype, msg )
+		return ( msgtype, msglen )
+
+		# end recvinto method
+
+
+	#--------------------------------------------------------------------------
+	def __recvheader( self ):
+	#--------------------------------------------------------------------------
+		""" Reads a HEADER into the reusable buffer. Returns (msgtype,
+		msglen), or (None, None) if the connection was closed. """
+		header = memoryview( self.hbuf )[:HEADER.size]
+		if not self.__recvinto( header ):
+			return (None, None)
+		msgtype, msglen = HEADER.unpack( header )
+		return ( msgtype.decode(), msglen )
 
-		# end recvdata method
+
+	#--------------------------------------------------------------------------
+	def __recvother( self, msgtype, msglen ):
+	#--------------------------------------------------------------------------
+		""" Finishes reading a message whose header has been read, returning
+		it as recvdata would. """
+		if msgtype is None:
+			return (None, None)
+		msg = bytearray( msglen )
+		if not self.__recvinto( memoryview( msg ) ):
+			return (None, None)
+		return ( msgtype, frompayload( msg ) )
+
+
+	#--------------------------------------------------------------------------
+	def sendmux( self, reqid, msgtype, msgdata ):
+	#--------------------------------------------------------------------------
+		"""
+		sendmux( request id, message type, message data ) -> boolean status
+
+		Like senddata, but for connections in multiplexed mode: the frame
+		is tagged with the request id it belongs to. Safe to call from
+		several threads at once.
+		"""
+
+		try:
+			msgdata = tobytes( msgdata )
+			header = MUXHEADER.pack( tobytes( msgtype ), reqid, len(msgdata) )
+			self.__sendframe( header, msgdata )
+		except KeyboardInterrupt:
+			raise
+		except:
+			if self.debug:
+				traceback.print_exc()
+			return False
+		return True
+
+
+	#--------------------------------------------------------------------------
+	def recvmux( self ):
+	#--------------------------------------------------------------------------
+		"""
+		recvmux() -> (reqid, msgtype, msgdata)
+
+		Receive one frame from a connection in multiplexed mode. The
+		payload is decoded as by recvdata. Returns (None, None, None) if
+		there was any error.
+		"""
+
+		try:
+			header = memoryview( self.hbuf )
+			if not self.__recvinto( header ):
+				return (None, None, None)
+			msgtype, reqid, msglen = MUXHEADER.unpack( header )
+			msg = bytearray( msglen )
+			if not self.__recvinto( memoryview( msg ) ):
+				return (None, None, None)
+			msgtype = msgtype.decode()
+		except KeyboardInterrupt:
+			raise
+		except:
+			if self.debug:
+				traceback.print_exc()
+			return (None, None, None)
+
+		return ( reqid, msgtype, frompayload( msg ) )
+
+		# end recvmux method
 
 
 	#--------------------------------------------------------------------------
@@ -530,13 +1072,345 @@ class BTPeerConnection:
 
 		self.s.close()
 		self.s = None
-		self.sd = None
 
 
 	#--------------------------------------------------------------------------
 	def __str__( self ):
 	#--------------------------------------------------------------------------
-		return f"|{self.id}|" 
+		return f"|{self.id}|"
+
+# end BTPeerConnection class
+
+
+
+def tobytes( data ):
+	""" Encodes message types and payloads given as str; bytes-like
+	objects pass through unchanged (and uncopied). """
+	if isinstance( data, str ):
+		return data.encode()
+	return data
+
+
+
+def frompayload( msg ):
+	""" Decodes a received payload: text comes back as a str, anything
+	that is not UTF-8 (e.g. the contents of a binary file) as bytes. """
+	try:
+		return msg.decode()
+	except UnicodeDecodeError:
+		return bytes( msg )
+
+
+
+
+# **********************************************************
+
+
+
+
+class BTMuxReply:
+	""" Stands in for a BTPeerConnection when a handler serves one request
+	of a multiplexed connection: replies are tagged with the request id.
+
+	"""
+
+	#--------------------------------------------------------------------------
+	def __init__( self, peerconn, reqid ):
+	#--------------------------------------------------------------------------
+		self.peerconn = peerconn
+		self.reqid = reqid
+		self.id = peerconn.id
+
+
+	#--------------------------------------------------------------------------
+	def senddata( self, msgtype, msgdata ):
+	#--------------------------------------------------------------------------
+		return self.peerconn.sendmux( self.reqid, msgtype, msgdata )
+
+
+	#--------------------------------------------------------------------------
+	def sendfile( self, msgtype, fileobj, offset=0, count=None ):
+	#--------------------------------------------------------------------------
+		return self.peerconn.sendmuxfile( self.reqid, msgtype, fileobj,
+											offset, count )
+
+
+	#--------------------------------------------------------------------------
+	def __str__( self ):
+	#--------------------------------------------------------------------------
+		return f"|{self.id}#{self.reqid}|"
+
+
+
+
+class BTMuxChannel:
+	""" Client end of a persistent, multiplexed connection to one peer.
+	Any number of threads may have requests in flight at the same time;
+	a reader thread hands every reply frame to the request waiting for
+	its id.
+
+	"""
+
+	#--------------------------------------------------------------------------
+	def __init__( self, peerid, host, port, debug=False, timeout=10 ):
+	#--------------------------------------------------------------------------
+		""" Connects and asks the peer to switch to multiplexed mode,
+		allowing timeout seconds for both. Raises BTMuxUnsupported if
+		the peer answers like an old, one-shot peer (by closing the
+		connection), and OSError if it does not answer in time.
+
+		"""
+		self.debug = debug
+		sock = socket.create_connection( ( host, int(port) ), timeout )
+		sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+		self.conn = BTPeerConnection( peerid, host, port, sock, debug=debug )
+		self.conn.senddata( MUXCONNECT, '' )
+		# an old peer answers by hanging up; one that says nothing at all
+		# is not marked as one-shot, just given up on for now
+		if not select.select( [ sock ], [], [], timeout )[0]:
+			self.conn.close()
+			raise socket.timeout( 'no answer to %s from %s:%s'
+									% (MUXCONNECT, host, port) )
+		msgtype, _ = self.conn.recvdata()
+		if msgtype != MUXACCEPT:
+			self.conn.close()
+			raise BTMuxUnsupported( '%s:%s' % (host, port) )
+		sock.settimeout( None )
+
+		self.lock = threading.Lock()
+		self.pending = {}     # reqid ==> [ replies, Event, keep replies?,
+		                      #             got MUXDONE? ]
+		self.nextid = 0
+		self.closed = False
+		self.lastused = time.time()
+
+		t = threading.Thread( target = self.__readloop )
+		t.daemon = True
+		t.start()
+
+
+	#--------------------------------------------------------------------------
+	def __readloop( self ):
+	#--------------------------------------------------------------------------
+		try:
+			while True:
+				reqid, msgtype, msgdata = self.conn.recvmux()
+				if msgtype is None:
+					break
+				with self.lock:
+					entry = self.pending.get( reqid )
+					if entry is None:
+						continue
+					if msgtype == MUXDONE:
+						del self.pending[ reqid ]
+						entry[3] = True
+						entry[1].set()
+					elif entry[2]:
+						entry[0].append( (msgtype, msgdata) )
+		finally:
+			# connection lost (or the reader failed): wake up everybody
+			# still waiting
+			with self.lock:
+				self.closed = True
+				for entry in self.pending.values():
+					entry[1].set()
+				self.pending.clear()
+
+
+	#--------------------------------------------------------------------------
+	def request( self, msgtype, msgdata, waitreply=True, timeout=None ):
+	#--------------------------------------------------------------------------
+		"""
+		request( message type, message data, wait for a reply, timeout )
+		-> [ ( reply type, reply data ), ... ]
+
+		Sends one request over the shared connection. If waitreply is set,
+		blocks until the peer has sent all of its replies. Raises
+		BTMuxTimeout if that takes more than timeout seconds, and IOError
+		if the connection is (or becomes) unusable.
+		"""
+		done = threading.Event()
+		replies = []
+		entry = [ replies, done, waitreply, False ]
+		with self.lock:
+			if self.closed:
+				raise IOError( 'multiplexed connection closed' )
+			reqid = self.nextid
+			self.nextid = (self.nextid + 1) & 0xFFFFFFFF
+			self.pending[ reqid ] = entry
+			self.lastused = time.time()
+
+		if not self.conn.sendmux( reqid, msgtype, msgdata ):
+			self.close()
+			raise IOError( 'multiplexed send failed' )
+		if not waitreply:
+			return replies
+
+		if not done.wait( timeout ):
+			with self.lock:
+				self.pending.pop( reqid, None )
+			raise BTMuxTimeout( 'timed out waiting for reply %d' % reqid )
+		if not entry[3]:
+			raise IOError( 'multiplexed connection closed' )
+		with self.lock:
+			self.lastused = time.time()
+		return replies
+
+
+	#--------------------------------------------------------------------------
+	def isidle( self, maxidle ):
+	#--------------------------------------------------------------------------
+		with self.lock:
+			return not self.pending and time.time() - self.lastused > maxidle
+
+
+	#--------------------------------------------------------------------------
+	def close( self ):
+	#--------------------------------------------------------------------------
+		with self.lock:
+			if self.conn.s is None:
+				return
+			self.closed = True
+			try:
+				self.conn.s.shutdown( socket.SHUT_RDWR )
+			except OSError:
+				pass
+			self.conn.close()
+
+# end BTMuxChannel class
+
+
+
+
+class BTMuxUnsupported( Exception ):
+	""" The remote peer does not understand multiplexed connections. """
+
+
+
+
+class BTMuxTimeout( IOError ):
+	""" One request got no complete answer in time. The connection itself
+	may be fine: other requests on it carry on. """
+
+
+
+
+class BTPeerPool:
+	""" Keeps one long-lived BTMuxChannel per neighbor (host, port) so that
+	repeated messages to the same peer skip the TCP handshake. Channels
+	left unused for maxidle seconds are evicted; peers that only speak the
+	one-shot protocol are remembered so that they are not asked again.
+
+	"""
+
+	#--------------------------------------------------------------------------
+	def __init__( self, maxidle=30, timeout=None, debug=False ):
+	#--------------------------------------------------------------------------
+		self.maxidle = maxidle
+		self.timeout = timeout
+		self.debug = debug
+		self.lock = threading.Lock()
+		self.channels = {}     # (host, port) ==> BTMuxChannel
+		self.oneshot = set()   # (host, port) of peers without mux support
+
+
+	#--------------------------------------------------------------------------
+	def __debug( self, msg ):
+	#--------------------------------------------------------------------------
+		if self.debug:
+			btdebug( msg )
+
+
+	#--------------------------------------------------------------------------
+	def getchannel( self, host, port, pid=None ):
+	#--------------------------------------------------------------------------
+		""" Returns the pooled channel to host:port, connecting if needed,
+		or None if that peer only supports one-shot connections. """
+		key = (host, int(port))
+		self.evictidle()
+		with self.lock:
+			if key in self.oneshot:
+				return None
+			chan = self.channels.get( key )
+			if chan and not chan.closed:
+				return chan
+
+		# connect outside the lock so that a slow peer does not hold up
+		# requests to every other neighbor
+		try:
+			chan = BTMuxChannel( pid, host, port, debug=self.debug )
+		except BTMuxUnsupported:
+			self.__debug( 'One-shot only peer %s:%s' % key )
+			with self.lock:
+				self.oneshot.add( key )
+			return None
+
+		with self.lock:
+			other = self.channels.get( key )
+			if other and not other.closed:
+				chan.close()     # lost a race with another thread
+				return other
+			self.channels[ key ] = chan
+		self.__debug( 'Pooled connection to %s:%s' % key )
+		return chan
 
 
+	#--------------------------------------------------------------------------
+	def request( self, host, port, msgtype, msgdata, pid=None,
+				waitreply=True ):
+	#--------------------------------------------------------------------------
+		"""
+		request( host, port, message type, message data, peer id,
+		wait for a reply ) -> [ ( reply type, reply data ), ... ] or None
+
+		Sends a message over the pooled connection to host:port. Returns
+		None if the peer needs a one-shot connection instead.
+		"""
+		chan = self.getchannel( host, port, pid )
+		if chan is None:
+			return None
+		try:
+			return chan.request( msgtype, msgdata, waitreply, self.timeout )
+		except BTMuxTimeout:
+			raise        # only this request failed: keep the connection
+		except IOError:
+			self.discard( host, port, chan )
+			raise
+
+
+	#--------------------------------------------------------------------------
+	def discard( self, host, port, chan=None ):
+	#--------------------------------------------------------------------------
+		""" Closes and forgets the pooled connection to host:port. """
+		with self.lock:
+			key = (host, int(port))
+			if chan is None or self.channels.get( key ) is chan:
+				chan = self.channels.pop( key, chan )
+		if chan:
+			chan.close()
+
+
+	#--------------------------------------------------------------------------
+	def evictidle( self ):
+	#--------------------------------------------------------------------------
+		""" Closes channels that were unused for more than maxidle seconds
+		(or that the peer already closed). Can also be registered as a
+		stabilizer. """
+		with self.lock:
+			stale = [ key for key, chan in self.channels.items()
+						if chan.closed or chan.isidle( self.maxidle ) ]
+			chans = [ self.channels.pop( key ) for key in stale ]
+		for chan in chans:
+			chan.close()
+
+
+	#--------------------------------------------------------------------------
+	def closeall( self ):
+	#--------------------------------------------------------------------------
+		with self.lock:
+			chans = list( self.channels.values() )
+			self.channels.clear()
+		for chan in chans:
+			chan.close()
 
+# end BTPeerPool class
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# In-process simulation of FilerPeer query flooding: thousands of peers
+# exchange messages through a FIFO event queue instead of sockets, so the
+# real handlers run unchanged. Reports messages per query with duplicate
+# suppression and reverse-path QUERYHIT routing (FilerPeer.seen) against
+# the original flooding, for several overlay topologies.
+
+import argparse, random
+from collections import Counter, deque
+
+from btfiler import *
+
+
+class SimConn:
+    """Stands in for the connection a handler replies on."""
+    id = None
+
+    def senddata(self, msgtype, msgdata):
+        return True
+
+
+class SimNet:
+    def __init__(self, budget):
+        self.peers = []
+        self.events = deque()
+        self.messages = Counter()
+        self.budget = budget         # stop a run after this many messages
+        self.truncated = False
+
+    def send(self, port, msgtype, msgdata):
+        self.messages[msgtype] += 1
+        if sum(self.messages.values()) > self.budget:
+            self.truncated = True
+            return
+        handler = self.peers[port].handlers[msgtype]
+        self.events.append((handler, (SimConn(), msgdata)))
+
+    def later(self, target, args):
+        self.events.append((target, args))
+
+    def run(self):
+        while self.events:
+            target, args = self.events.popleft()
+            target(*args)
+
+
+class SimPeer(FilerPeer):
+    def __init__(self, net, port, dedup):
+        FilerPeer.__init__(self, 0, port, serverhost='sim')
+        self.net = net
+        if not dedup:
+            self.seen = None
+
+    def connectandsend(self, host, port, msgtype, msgdata, pid=None,
+                       waitreply=True):
+        self.net.send(int(port), msgtype, msgdata)
+        # what the handler would acknowledge a QUERY with
+        return [(REPLY, 'Query ACK: - ' + QIDS if self.seen is not None
+                 else '')]
+
+    def spawn(self, target, args=()):
+        self.net.later(target, args)
+
+
+def link(a, b):
+    if a is not b:
+        a.addpeer(b.myid, b.serverhost, b.serverport)
+        b.addpeer(a.myid, a.serverhost, a.serverport)
+
+
+def random_graph(peers, degree, rnd):
+    for p in peers:
+        for q in rnd.sample(peers, degree // 2):
+            link(p, q)
+
+
+def ring(peers, degree, rnd):
+    n = len(peers)
+    for i, p in enumerate(peers):
+        for k in range(1, degree // 2 + 1):
+            link(p, peers[(i + k) % n])
+
+
+def scale_free(peers, degree, rnd):
+    m = max(1, degree // 2)
+    targets = list(peers[:m + 1])
+    for p in peers[:m + 1]:
+        for q in peers[:m + 1]:
+            link(p, q)
+    for p in peers[m + 1:]:
+        for q in set(rnd.choice(targets) for i in range(m)):
+            link(p, q)
+            targets.append(q)
+        targets.extend([p] * m)
+
+
+TOPOLOGIES = {'random': random_graph, 'ring': ring, 'scale-free': scale_free}
+
+
+def simulate(size, topology, degree, ttl, queries, replicas, dedup, seed,
+             budget):
+    """Returns (messages per query, fraction of queries that found the
+    file, whether the message budget ran out)."""
+    rnd = random.Random(seed)
+    net = SimNet(budget * queries)
+    net.peers = [SimPeer(net, i, dedup) for i in range(size)]
+    TOPOLOGIES[topology](net.peers, degree, rnd)
+    for p in rnd.sample(net.peers, replicas):
+        p.addlocalfile('wanted.dat')
+
+    found = 0
+    for i in range(queries):
+        origin = rnd.choice(net.peers)
+        origin.query('wanted', ttl)
+        net.run()
+        found += 'wanted.dat' in origin.catalog
+        origin.catalog.remove('wanted.dat')
+        if net.truncated:
+            return budget, found / (i + 1), True
+    return sum(net.messages.values()) / queries, found / queries, False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='query flooding simulator')
+    parser.add_argument('-n', metavar='peers', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help='overlay sizes (default 100 1000 10000)')
+    parser.add_argument('-t', metavar='topology', nargs='+',
+                        default=sorted(TOPOLOGIES), choices=sorted(TOPOLOGIES))
+    parser.add_argument('-d', metavar='degree', type=int, default=6,
+                        help='average neighbors per peer (default 6)')
+    parser.add_argument('--ttl', type=int, default=4,
+                        help='query TTL (default 4)')
+    parser.add_argument('-q', metavar='queries', type=int, default=5,
+                        help='queries per run (default 5)')
+    parser.add_argument('-b', metavar='budget', type=int, default=200000,
+                        help='give up on a run after this many messages per '
+                             'query (default 200000)')
+    parser.add_argument('-r', metavar='replicas', type=int, default=1,
+                        help='peers holding the wanted file (default 1)')
+    args = parser.parse_args()
+
+    print('{:>11} {:>6} {:>16} {:>16} {:>8}'.format(
+        'topology', 'peers', 'flood msg/query', 'dedup msg/query', 'found'))
+    for topology in args.t:
+        for size in args.n:
+            runs = [simulate(size, topology, args.d, args.ttl, args.q,
+                             args.r, dedup, size, args.b)
+                    for dedup in (False, True)]
+            cells = [('>%d' if truncated else '%d') % msgs
+                     for msgs, found, truncated in runs]
+            print('{:>11} {:>6} {:>16} {:>16} {:>3.0%}/{:.0%}'.format(
+                topology, size, cells[0], cells[1], runs[0][1], runs[1][1]))
@@ -54,8 +54,7 @@ class BTGui(Frame):
    def updateFileList(self):
       if self.fileList.size() > 0:
          self.fileList.delete(0, self.fileList.size() - 1)
-      for f in self.btpeer.files:
-         p = self.btpeer.files[f]
+      for f, p in self.btpeer.files.items():
          if not p:
                p = '(local)'
          self.fileList.insert(END, "%s:%s" % (f, p))
@@ -147,9 +146,7 @@ class BTGui(Frame):
       key = self.searchEntry.get()
       self.searchEntry.delete(0, len(key))
 
-      for p in self.btpeer.getpeerids():
-         self.btpeer.sendtopeer(p,
-                                 QUERY, "%s %s 4" % (self.btpeer.myid, key))
+      self.btpeer.query(key, 4)
 
    def onFetch(self):
       sels = self.fileList.curselection()
@@ -157,12 +154,10 @@ class BTGui(Frame):
          sel = self.fileList.get(sels[0]).split(':')
          if len(sel) > 2:  # fname:host:port
                fname, host, port = sel
-               resp = self.btpeer.connectandsend(host, port, FILEGET, fname)
-               if len(resp) and resp[0][0] == REPLY:
-                  fd = open(fname, 'w')
-                  fd.write(resp[0][1])
-                  fd.close()
-                  self.btpeer.files[fname] = None  # because it's local now
+               result = self.btpeer.fetchfile(host, port, fname)
+               if result:
+                  self.btpeer.addlocalfile(fname)  # because it's local now
+                  self.updateFileList()
 
    def onRemove(self):
       sels = self.peerList.curselection()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# What the answer cache saves when get_answer() is expensive: first the
+# cost of one call with each cache, then requests/s and latency of
+# srv_asyncio1.py (get_answer on the event loop) and srv_prefork.py with
+# --cache none, lru and shared. Clients only ask the three known
+# aphorisms, so after three misses every answer comes from the cache.
+
+import argparse, time
+import bench_zen, zen_utils, zenload
+
+def time_call(cache, delay, calls):
+    zen_utils.answer_delay = delay
+    zen_utils.answer_cache = cache
+    question = next(iter(zen_utils.aphorisms))
+    zen_utils.get_answer(question)  # fill the cache
+    start = time.perf_counter()
+    for i in range(calls):
+        zen_utils.get_answer(question)
+    return (time.perf_counter() - start) / calls
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='answer cache benchmark')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-c', metavar='connections', type=int, default=50,
+                        help='concurrent connections (default 50)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=3.0,
+                        help='duration of each run (default 3)')
+    parser.add_argument('--delay', type=float, default=0.005,
+                        help='simulated cost of get_answer, seconds '
+                             '(default 0.005)')
+    args = parser.parse_args()
+
+    print('one get_answer() call, {:g} ms simulated cost:'.format(
+        1000 * args.delay))
+    for name, cache in (('none', None), ('lru', zen_utils.LRUCache()),
+                        ('shared', zen_utils.SharedCache())):
+        calls = 20 if cache is None else 100000
+        print('{:>8} {:>10.2f} us'.format(
+            name, 1e6 * time_call(cache, args.delay, calls)))
+
+    print('\n{} connections, {} s per run:'.format(args.c, args.t))
+    print('{:>16} {:>7} {:>11} {:>8} {:>8}'.format(
+        'server', 'cache', 'requests/s', 'p50 ms', 'p99 ms'))
+    port = args.p
+    for script, caches in (('srv_asyncio1.py', ['none', 'lru']),
+                           ('srv_prefork.py', ['none', 'lru', 'shared'])):
+        for cache in caches:
+            address = ('127.0.0.1', port)
+            port += 1
+            server = bench_zen.start_server(script, address, [
+                '--delay', str(args.delay), '--cache', cache])
+            if server is None:
+                print('{:>16} {:>7} did not start'.format(script, cache))
+                continue
+            try:
+                total = zenload.run_load(address, args.c, 1, args.t)
+            finally:
+                bench_zen.stop_server(server)
+            h = total['histogram']
+            print('{:>16} {:>7} {:>11.0f} {:>8.2f} {:>8.2f}'.format(
+                script, cache, total['rate'], 1000 * h.percentile(50),
+                1000 * h.percentile(99)))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Restarts a Zen server again and again under load and counts the errors
+# its clients see. With a handoff (zen_handoff.py), each new process takes
+# over the listening socket and the old one drains; a plain restart
+# terminates the old process and then starts the new one. Half the client
+# processes open a connection per question; the others keep theirs and,
+# like an HTTP client, ask again on a new connection if the server closed
+# the old one before answering.
+
+import argparse, collections, multiprocessing, os, socket, tempfile, time
+import bench_zen, zen_utils
+
+SERVERS = ['srv_threaded.py', 'srv_legacy1.py', 'srv_legacy2.py',
+           'srv_async.py', 'srv_asyncio1.py', 'srv_asyncio2.py',
+           'srv_prefork.py', 'srv_epoll.py']  # srv_single: one client only
+
+def ask(sock, question):
+    """Send `question` and return the answer; raise EOFError if the server
+    closed the connection before sending any of it."""
+    sock.sendall(question)
+    answer = b''
+    while not answer.endswith(b'.'):
+        data = sock.recv(4096)
+        if not data:
+            if answer:
+                raise IOError('answer cut short: {!r}'.format(answer))
+            raise EOFError('closed before answering')
+        answer += data
+    return answer
+
+def client(address, persistent, seconds, results):
+    counts = collections.Counter()
+    questions = list(zen_utils.aphorisms)
+    sock = None
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        question = questions[counts['answered'] % len(questions)]
+        reused = sock is not None
+        try:
+            if sock is None:
+                sock = socket.create_connection(address, timeout=5.0)
+            answer = ask(sock, question)
+        except (EOFError, ConnectionResetError, BrokenPipeError) as e:
+            sock.close()
+            sock = None
+            counts['retried' if reused else type(e).__name__] += 1
+            continue
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+                sock = None
+            counts[type(e).__name__] += 1
+            continue
+        counts['answered'] += 1
+        if answer != zen_utils.aphorisms[question]:
+            counts['wrong'] += 1
+        if not persistent:
+            sock.close()
+            sock = None
+    results.put(counts)
+
+def run(script, address, handoff, restarts, interval, clients, drain):
+    """Return the clients' counts, and how many old processes did not
+    exit within `drain` seconds of a handoff."""
+    path = os.path.join(tempfile.gettempdir(),
+                        'zen-handoff-{}.sock'.format(address[1]))
+    args = ['--handoff', path, '--drain', str(drain)] if handoff else []
+    server = bench_zen.start_server(script, address, args)
+    if server is None:
+        return None, 0
+    results = multiprocessing.Queue()
+    seconds = interval * (restarts + 1)
+    procs = [multiprocessing.Process(target=client, args=(
+        address, i % 2 == 1, seconds, results)) for i in range(clients)]
+    for p in procs:
+        p.start()
+    stuck = 0
+    try:
+        for i in range(restarts):
+            time.sleep(interval)
+            if handoff:
+                new = bench_zen.start_server(script, address, args)
+                try:
+                    server.wait(drain + 5)
+                except Exception:
+                    stuck += 1
+                    bench_zen.stop_server(server)
+                server = new
+            else:
+                bench_zen.stop_server(server)
+                server = bench_zen.start_server(script, address, args)
+        total = collections.Counter()
+        for p in procs:
+            total.update(results.get())
+        for p in procs:
+            p.join()
+    finally:
+        if server is not None:
+            bench_zen.stop_server(server)
+    return total, stuck
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='restarts under load')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-r', metavar='restarts', type=int, default=5,
+                        help='restarts per run (default 5)')
+    parser.add_argument('-i', metavar='seconds', type=float, default=2.0,
+                        help='time between restarts (default 2)')
+    parser.add_argument('-c', metavar='clients', type=int, default=4,
+                        help='client processes (default 4)')
+    parser.add_argument('-d', metavar='seconds', type=float, default=10.0,
+                        help='--drain given to the servers (default 10)')
+    parser.add_argument('-s', metavar='server', nargs='+', default=SERVERS,
+                        help='server scripts to restart (default: all but '
+                             'srv_single.py)')
+    args = parser.parse_args()
+
+    print('{} restarts, {} s apart, {} clients'.format(args.r, args.i,
+                                                       args.c))
+    print('{:>16} {:>9} {:>9} {:>8} {:>7} {:>6}  {}'.format(
+        'server', 'restart', 'answered', 'retried', 'errors', 'stuck',
+        'error types'))
+    port = args.p
+    for script in args.s:
+        for handoff in (False, True):
+            total, stuck = run(script, ('127.0.0.1', port), handoff, args.r,
+                               args.i, args.c, args.d)
+            port += 1
+            if total is None:
+                print('{:>16} did not start'.format(script))
+                continue
+            errors = {k: v for k, v in total.items()
+                      if k not in ('answered', 'retried')}
+            print('{:>16} {:>9} {:>9} {:>8} {:>7} {:>6}  {}'.format(
+                script, 'handoff' if handoff else 'plain',
+                total['answered'], total['retried'],
+                sum(errors.values()), stuck,
+                ' '.join('{}={}'.format(k, v)
+                         for k, v in sorted(errors.items()))))
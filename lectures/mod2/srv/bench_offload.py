@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Tail latency of srv_asyncio1.py as get_answer() gets more expensive
+# (zen_utils.answer_delay), with get_answer called on the event loop
+# versus in a thread pool or a process pool (-x). On the loop, every
+# client waits for every other client's answer.
+
+import argparse
+import bench_zen, zenload
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='get_answer offload benchmark')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-c', metavar='connections', type=int, default=50,
+                        help='concurrent connections (default 50)')
+    parser.add_argument('-d', metavar='depth', type=int, default=1,
+                        help='questions in flight per connection (default 1)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=3.0,
+                        help='duration of each run (default 3)')
+    parser.add_argument('-w', metavar='workers', type=int, default=16,
+                        help='pool size (default 16)')
+    parser.add_argument('--delay', type=float, nargs='+',
+                        default=[0, 0.001, 0.005, 0.02],
+                        help='simulated cost of get_answer, seconds '
+                             '(default 0 0.001 0.005 0.02)')
+    parser.add_argument('-s', metavar='server', default='srv_asyncio1.py',
+                        help='server script (default srv_asyncio1.py)')
+    args = parser.parse_args()
+
+    print('{}: {} connections, depth {}, pools of {} workers'.format(
+        args.s, args.c, args.d, args.w))
+    print('{:>8} {:>8} {:>11} {:>8} {:>8} {:>8} {:>7}'.format(
+        'delay ms', 'mode', 'requests/s', 'p50 ms', 'p99 ms', 'p99.9 ms',
+        'wrong'))
+    port = args.p
+    for delay in args.delay:
+        for mode in ('none', 'thread', 'process'):
+            address = ('127.0.0.1', port)
+            port += 1
+            server = bench_zen.start_server(args.s, address, [
+                '-x', mode, '-w', str(args.w), '--delay', str(delay)])
+            if server is None:
+                print('{:>8} {:>8} did not start'.format(1000 * delay, mode))
+                continue
+            try:
+                total = zenload.run_load(address, args.c, args.d, args.t)
+            finally:
+                bench_zen.stop_server(server)
+            h = total['histogram']
+            print('{:>8g} {:>8} {:>11.0f} {:>8.2f} {:>8.2f} {:>8.2f} {:>7}'
+                  .format(1000 * delay, mode, total['rate'],
+                          1000 * h.percentile(50), 1000 * h.percentile(99),
+                          1000 * h.percentile(99.9), total['errors']))
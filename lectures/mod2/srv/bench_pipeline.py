@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Requests per second of the poll() server in srv_async.py when clients
+# pipeline: each client sends `depth` questions in one write, then reads
+# the `depth` answers. The original serve(), which only answered when its
+# buffer ended with b'?', is kept for comparison at depth 1: with more
+# than one question in flight it answers them all with one error.
+
+import argparse, multiprocessing, os, select, socket, time
+import srv_async, zen_utils
+
+def legacy_serve(listener):
+    """The original srv_async.serve, without its log messages."""
+    sockets = {listener.fileno(): listener}
+    bytes_received = {}
+    bytes_to_send = {}
+    poll_object = select.poll()
+    poll_object.register(listener, select.POLLIN)
+    for fd, event in srv_async.all_events_forever(poll_object):
+        sock = sockets[fd]
+        if event & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+            bytes_received.pop(sock, b'')
+            bytes_to_send.pop(sock, b'')
+            poll_object.unregister(fd)
+            del sockets[fd]
+        elif sock is listener:
+            sock, address = sock.accept()
+            sock.setblocking(False)
+            sockets[sock.fileno()] = sock
+            poll_object.register(sock, select.POLLIN)
+        elif event & select.POLLIN:
+            more_data = sock.recv(4096)
+            if not more_data:
+                sock.close()
+                continue
+            data = bytes_received.pop(sock, b'') + more_data
+            if data.endswith(b'?'):
+                bytes_to_send[sock] = zen_utils.get_answer(data)
+                poll_object.modify(sock, select.POLLOUT)
+            else:
+                bytes_received[sock] = data
+        elif event & select.POLLOUT:
+            data = bytes_to_send.pop(sock)
+            n = sock.send(data)
+            if n < len(data):
+                bytes_to_send[sock] = data[n:]
+            else:
+                poll_object.modify(sock, select.POLLIN)
+
+def run_server(serve, address, delay):
+    zen_utils.answer_delay = delay
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)  # silence the log
+    serve(zen_utils.create_srv_socket(address, backlog=1024))
+
+def client(address, depth, seconds, counter):
+    sock = socket.create_connection(address)
+    questions = list(zen_utils.aphorisms)
+    batch = [questions[i % len(questions)] for i in range(depth)]
+    message = b''.join(batch)
+    expected = b''.join(zen_utils.aphorisms[q] for q in batch)
+    answers = bytearray(len(expected))
+    count = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        sock.sendall(message)
+        view = memoryview(answers)
+        while view:
+            n = sock.recv_into(view)
+            if not n:
+                raise EOFError('server closed the connection')
+            view = view[n:]
+        assert answers == expected
+        count += depth
+    sock.close()
+    with counter.get_lock():
+        counter.value += count
+
+def measure(serve, address, clients, depth, seconds, delay):
+    server = multiprocessing.Process(target=run_server,
+                                     args=(serve, address, delay))
+    server.start()
+    time.sleep(0.5)
+    try:
+        counter = multiprocessing.Value('l', 0)
+        procs = [multiprocessing.Process(target=client, args=(
+            address, depth, seconds, counter)) for i in range(clients)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        return counter.value / seconds
+    finally:
+        server.terminate()
+        server.join()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pipelining benchmark')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-c', metavar='clients', type=int, default=4,
+                        help='client processes (default 4)')
+    parser.add_argument('-d', metavar='depth', type=int, nargs='+',
+                        default=[1, 4, 16, 64],
+                        help='questions in flight per client '
+                             '(default 1 4 16 64)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=3.0,
+                        help='duration of each run (default 3)')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='zen_utils.answer_delay, seconds (default 0)')
+    args = parser.parse_args()
+
+    port = args.p
+    print('{:>9} {:>6} {:>12}'.format('server', 'depth', 'requests/s'))
+    runs = [('original', legacy_serve, 1)]
+    runs += [('current', srv_async.serve, depth) for depth in args.d]
+    for name, serve, depth in runs:
+        rate = measure(serve, ('127.0.0.1', port), args.c, depth, args.t,
+                       args.delay)
+        print('{:>9} {:>6} {:>12.0f}'.format(name, depth, rate))
+        port += 1
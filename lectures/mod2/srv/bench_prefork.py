@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Requests per second of srv_prefork.py with 1, 2, 4, ... worker processes
+# (up to the number of cores), against srv_threaded.py as the baseline.
+# Each server runs as a subprocess; client processes keep one connection
+# each and ask one aphorism after another for a fixed time.
+
+import argparse, multiprocessing, os, socket, subprocess, sys, time
+import zen_utils
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def client(address, seconds, counter):
+    sock = socket.create_connection(address)
+    question = next(iter(zen_utils.aphorisms))
+    count = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        sock.sendall(question)
+        zen_utils.recv_until(sock, b'.')
+        count += 1
+    sock.close()
+    with counter.get_lock():
+        counter.value += count
+
+def wait_until_listening(address, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(address).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server at {} did not start'.format(address))
+
+def measure(command, address, clients, seconds):
+    server = subprocess.Popen([sys.executable] + command, cwd=HERE,
+                              stdout=subprocess.DEVNULL)
+    try:
+        wait_until_listening(address)
+        time.sleep(0.5)  # let every worker bind
+        counter = multiprocessing.Value('l', 0)
+        procs = [multiprocessing.Process(target=client,
+                                         args=(address, seconds, counter))
+                 for i in range(clients)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        return counter.value / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pre-fork server benchmark')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-c', metavar='clients', type=int,
+                        default=4 * os.cpu_count(),
+                        help='client processes (default 4 per core)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=5.0,
+                        help='duration of each run (default 5)')
+    args = parser.parse_args()
+
+    host, port = '127.0.0.1', args.p
+    cores = os.cpu_count()
+    runs = [('srv_threaded', ['srv_threaded.py', host, '-p'])]
+    workers = 1
+    while workers < cores:
+        runs.append(('prefork -w {}'.format(workers),
+                     ['srv_prefork.py', host, '-w', str(workers), '-p']))
+        workers *= 2
+    runs.append(('prefork -w {}'.format(cores),
+                 ['srv_prefork.py', host, '-w', str(cores), '-p']))
+
+    print('{} cores, {} clients, {} s per run'.format(cores, args.c, args.t))
+    print('{:>16} {:>12}'.format('server', 'requests/s'))
+    for name, command in runs:
+        rate = measure(command + [str(port)], (host, port), args.c, args.t)
+        print('{:>16} {:>12.0f}'.format(name, rate))
+        port += 1
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Many concurrent connections against the event-driven Zen servers: poll()
+# (srv_async.py), asyncio callbacks (srv_asyncio1.py) and the edge-
+# triggered epoll reactor (srv_epoll.py). Client processes open their share
+# of the connections, then keep one question in flight on each for a fixed
+# time. Reports requests/s, connect time and the server's peak RSS.
+# Needs a file descriptor limit above the number of connections.
+
+import argparse, multiprocessing, os, selectors, socket, subprocess, sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUESTION, ANSWER = b'Simple is better than?', b'Complex.'
+
+def client(address, conns, seconds, results, go):
+    socks = []
+    try:
+        for i in range(conns):
+            socks.append(socket.create_connection(address))
+            if i % 32 == 31:
+                time.sleep(0.001)  # let the server accept: its backlog may
+                                   # be as short as zen_utils' 64
+    except OSError as e:
+        results.put((0, len(socks), e))
+        return
+    results.put(('connected', conns, None))
+    go.wait()  # until every client process has its connections open
+
+    selector = selectors.DefaultSelector()
+    for sock in socks:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, [0])  # bytes received
+        sock.send(QUESTION)
+    count = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        for key, mask in selector.select(timeout=0.1):
+            data = key.fileobj.recv(4096)
+            if not data:
+                raise EOFError('server closed a connection')
+            key.data[0] += len(data)
+            while key.data[0] >= len(ANSWER):
+                key.data[0] -= len(ANSWER)
+                count += 1
+                key.fileobj.send(QUESTION)
+    for sock in socks:
+        sock.close()
+    results.put((count, conns, None))
+
+def peak_rss(pid):
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) // 1024
+
+def measure(script, address, conns, procs, seconds):
+    server = subprocess.Popen(
+        [sys.executable, script, address[0], '-p', str(address[1])],
+        cwd=HERE, stdout=subprocess.DEVNULL)
+    time.sleep(1.0)
+    try:
+        results = multiprocessing.Queue()
+        go = multiprocessing.Event()
+        share = [conns // procs + (i < conns % procs) for i in range(procs)]
+        workers = [multiprocessing.Process(
+            target=client, args=(address, n, seconds, results, go))
+            for n in share]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            status, n, error = results.get()
+            if error:
+                raise RuntimeError('only {} connections: {}'.format(n, error))
+        connect_time = time.perf_counter() - start
+        go.set()
+        total = sum(results.get()[0] for w in workers)
+        for w in workers:
+            w.join()
+        return total / seconds, connect_time, peak_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='event loop benchmark')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-n', metavar='connections', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help='concurrent connections (default 100 1000 10000)')
+    parser.add_argument('-c', metavar='clients', type=int, default=2,
+                        help='client processes (default 2)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=5.0,
+                        help='duration of each run (default 5)')
+    args = parser.parse_args()
+
+    servers = ['srv_async.py', 'srv_asyncio1.py', 'srv_epoll.py']
+    port = args.p
+    print('{:>16} {:>12} {:>12} {:>12} {:>9}'.format(
+        'server', 'connections', 'requests/s', 'connect s', 'peak RSS'))
+    for conns in args.n:
+        for script in servers:
+            rate, connect_time, rss = measure(script, ('127.0.0.1', port),
+                                              conns, args.c, args.t)
+            print('{:>16} {:>12} {:>12.0f} {:>12.2f} {:>6} MB'.format(
+                script, conns, rate, connect_time, rss))
+            port += 1
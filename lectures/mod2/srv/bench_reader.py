@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Checks that zen_utils.handle_conversation answers pipelined questions
+# (several sent in one segment), then measures how fast delimited
+# messages of growing size are read: zen_utils.RecvBuffer versus the
+# original recv_until, which grew the message with += and checked
+# endswith() after every 4096-byte recv.
+
+import argparse, socket, threading, time
+import zen_utils
+
+def legacy_recv_until(sock, suffix):
+    """The original zen_utils.recv_until, kept only for comparison."""
+    message = sock.recv(4096)
+    if not message:
+        raise EOFError('socket closed')
+    while not message.endswith(suffix):
+        data = sock.recv(4096)
+        if not data:
+            raise IOError('received {!r} then socket closed'.format(message))
+        message += data
+    return message
+
+def check_pipelining():
+    a, b = socket.socketpair()
+    t = threading.Thread(target=zen_utils.handle_conversation, args=(b, 'b'))
+    t.start()
+    questions = list(zen_utils.aphorisms) * 3
+    a.sendall(b''.join(questions))  # every question in one write
+    reader = zen_utils.RecvBuffer(a)
+    for question in questions:
+        answer = reader.recv_until(b'.')
+        assert answer == zen_utils.aphorisms[question], answer
+    a.close()
+    t.join()
+    print('pipelining: {} questions in one write, all answered in order'
+          .format(len(questions)))
+
+def measure(size, count, legacy):
+    """Ping-pong `count` messages of `size` bytes; return MB/s."""
+    a, b = socket.socketpair()
+    message = b'x' * (size - 1) + b'?'
+
+    def send():
+        for i in range(count):
+            a.sendall(message)
+            a.recv(1)
+
+    t = threading.Thread(target=send)
+    reader = zen_utils.RecvBuffer(b, maxsize=size)
+    start = time.perf_counter()
+    t.start()
+    for i in range(count):
+        if legacy:
+            received = legacy_recv_until(b, b'?')
+        else:
+            received = reader.recv_until(b'?')
+        assert len(received) == size
+        b.sendall(b'.')
+    t.join()
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return size * count / elapsed / 2**20
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RecvBuffer benchmark')
+    parser.add_argument('--legacy-max', type=int, default=2**20,
+                        help='largest message size to run through the '
+                             'quadratic legacy reader (default 1 MB)')
+    args = parser.parse_args()
+
+    check_pipelining()
+    cases = [('100 B', 100, 20000), ('64 KB', 2**16, 2000),
+             ('1 MB', 2**20, 20), ('16 MB', 2**24, 4)]
+    print('{:>7} {:>12} {:>10}'.format('size', 'reader', 'MB/s'))
+    for label, size, count in cases:
+        for name, legacy in (('recv_until', True), ('RecvBuffer', False)):
+            if legacy and size > args.legacy_max:
+                print('{:>7} {:>12} {:>10}'.format(label, name, 'skipped'))
+                continue
+            print('{:>7} {:>12} {:>10.1f}'.format(
+                label, name, measure(size, count, legacy)))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Stress test for the flow control in srv_asyncio1.py: thousands of clients
+# that pipeline questions but never read the answers, plus clients sending
+# one endless question and slowloris clients trickling a byte a second.
+# Runs ZenServer with and without its limits and reports the server's RSS,
+# how many attackers it hung up on and how a well-behaved client fared.
+
+import argparse, logging, multiprocessing, os, selectors, socket, time
+import srv_asyncio1, zen_metrics, zen_utils, zenload
+
+QUESTION = b'Beautiful is better than?'
+
+class UnboundedZenServer(srv_asyncio1.ZenServer):
+    """ZenServer without flow control: no request limit, no timeouts, and
+    it keeps reading however much it has yet to write."""
+    max_request = 0
+    max_pending = float('inf')
+    idle_timeout = read_timeout = 0
+
+    def pause_writing(self):
+        pass
+
+    def resume_writing(self):
+        pass
+
+def run_server(protocol, address):
+    import asyncio
+    # Silence the server: hung-up attackers would flood the zen log's
+    # warnings, which go to stderr when no handler is configured
+    zen_metrics.log.setLevel(logging.ERROR)
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(loop.create_server(protocol, *address,
+                                               backlog=1024))
+    loop.run_forever()
+
+def attack(address, kind, n, seconds, results, go):
+    """Open n connections and misbehave on them in the manner `kind`."""
+    socks, failed = zenload.connect_all(address, n, 10.0)
+    results.put(len(socks))
+    go.wait()
+    payload = {'reader': QUESTION * 2000, 'oversize': b'x' * 65536,
+               'slowloris': b'x'}[kind]
+    selector = selectors.DefaultSelector()
+    for sock in socks:
+        selector.register(sock, selectors.EVENT_WRITE)
+    closed = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline and selector.get_map():
+        if kind == 'slowloris':
+            ready = [key for key, mask in selector.select(timeout=0)]
+            time.sleep(1.0)
+        else:
+            ready = [key for key, mask in selector.select(timeout=0.1)]
+        for key in ready:
+            try:
+                key.fileobj.send(payload)
+            except OSError:  # the server hung up on us
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                closed += 1
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    results.put(closed)
+
+def probe(address, seconds):
+    """Ask one question at a time on a fresh connection; return a latency
+    histogram and the number of questions that went unanswered."""
+    histogram = zenload.Histogram()
+    failures = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            with socket.create_connection(address, timeout=5.0) as sock:
+                sock.sendall(QUESTION)
+                zen_utils.recv_until(sock, b'.')
+            histogram.record(time.perf_counter() - start)
+        except (OSError, EOFError):
+            failures += 1
+        time.sleep(0.05)
+    return histogram, failures
+
+def rss(pid):
+    """Current and peak resident set size of a process, in MB."""
+    values = {}
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            values[key] = value
+    return tuple(int(values[k].split()[0]) // 1024 for k in ('VmRSS', 'VmHWM'))
+
+def measure(protocol, address, attackers, seconds):
+    server = multiprocessing.Process(target=run_server,
+                                     args=(protocol, address))
+    server.start()
+    time.sleep(0.5)
+    results = multiprocessing.Queue()
+    go = multiprocessing.Event()
+    clients = [multiprocessing.Process(target=attack, args=(
+        address, kind, n, seconds, results, go))
+        for kind, n in attackers if n]
+    try:
+        for c in clients:
+            c.start()
+        connected = sum(results.get() for c in clients)
+        go.set()
+        histogram, failures = probe(address, seconds / 2)
+        halfway = rss(server.pid)[0]
+        more, more_failures = probe(address, seconds / 2)
+        histogram.merge(more)
+        closed = sum(results.get() for c in clients)
+        for c in clients:
+            c.join()
+        return (connected, closed, histogram, failures + more_failures,
+                halfway) + rss(server.pid)
+    finally:
+        server.terminate()
+        server.join()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='slow client stress test')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-r', metavar='readers', type=int, default=3000,
+                        help='clients that never read (default 3000)')
+    parser.add_argument('-o', metavar='oversize', type=int, default=100,
+                        help='clients sending an endless question '
+                        '(default 100)')
+    parser.add_argument('-s', metavar='slowloris', type=int, default=500,
+                        help='clients sending a byte a second (default 500)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=15.0,
+                        help='duration of each run (default 15)')
+    args = parser.parse_args()
+
+    attackers = [('reader', args.r), ('oversize', args.o),
+                 ('slowloris', args.s)]
+    print('{} slow readers, {} oversize, {} slowloris; {} s per run'.format(
+        args.r, args.o, args.s, args.t))
+    print('{:>12} {:>10} {:>8} {:>8} {:>8} {:>10} {:>9} {:>9} {:>9}'.format(
+        'server', 'connected', 'closed', 'probe ms', 'max ms', 'no answer',
+        'RSS t/2', 'RSS t', 'peak RSS'))
+    port = args.p
+    for name, protocol in [('unbounded', UnboundedZenServer),
+                           ('ZenServer', srv_asyncio1.ZenServer)]:
+        connected, closed, h, failures, halfway, now, peak = measure(
+            protocol, ('127.0.0.1', port), attackers, args.t)
+        port += 1
+        print('{:>12} {:>10} {:>8} {:>8.2f} {:>8.2f} {:>10} {:>6} MB {:>6} MB '
+              '{:>6} MB'.format(name, connected, closed,
+                                1000 * h.percentile(50), 1000 * h.max,
+                                failures, halfway, now, peak))
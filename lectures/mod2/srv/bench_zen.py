@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Runs every Zen server variant on a local port in turn, drives it with
+# zenload.py and prints one comparison table. Servers that serve only a few
+# connections at a time (srv_single, srv_threaded) leave the rest starved
+# (never answered); servers that cannot split pipelined questions answer
+# them wrongly once the depth is above 1.
+
+import argparse, os, socket, subprocess, sys, time
+import zenload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVERS = ['srv_single.py', 'srv_threaded.py', 'srv_legacy1.py',
+           'srv_legacy2.py', 'srv_async.py', 'srv_asyncio1.py',
+           'srv_asyncio2.py', 'srv_prefork.py', 'srv_epoll.py']
+
+def start_server(script, address, args=(), timeout=10):
+    """Start a server script (with extra command line `args`); return the
+    process once it accepts connections, or None if it exits or never
+    listens."""
+    server = subprocess.Popen(
+        [sys.executable, '-W', 'ignore', script, address[0],
+         '-p', str(address[1])] + list(args), cwd=HERE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline and server.poll() is None:
+        try:
+            socket.create_connection(address).close()
+            time.sleep(0.5)  # e.g. let every pre-forked worker bind
+            return server
+        except OSError:
+            time.sleep(0.1)
+    stop_server(server)
+    return None
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()  # e.g. srv_threaded's non-daemon threads
+        server.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Zen server comparison')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='first TCP port to use (default 1060)')
+    parser.add_argument('-c', metavar='connections', type=int, default=100,
+                        help='concurrent connections (default 100)')
+    parser.add_argument('-d', metavar='depth', type=int, default=1,
+                        help='questions in flight per connection (default 1)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=5.0,
+                        help='duration of each run (default 5)')
+    parser.add_argument('-w', metavar='processes', type=int, default=2,
+                        help='load generating processes (default 2)')
+    parser.add_argument('-s', metavar='server', nargs='+', default=SERVERS,
+                        help='server scripts to compare (default: all)')
+    args = parser.parse_args()
+
+    print('{} connections, depth {}, {} s per server'.format(
+        args.c, args.d, args.t))
+    print('{:>16} {:>10} {:>11} {:>8} {:>8} {:>8} {:>8} {:>7} {:>8}'.format(
+        'server', 'connected', 'requests/s', 'p50 ms', 'p99 ms', 'p99.9 ms',
+        'max ms', 'wrong', 'starved'))
+    port = args.p
+    for script in args.s:
+        address = ('127.0.0.1', port)
+        port += 1
+        server = start_server(script, address)
+        if server is None:
+            print('{:>16} did not start'.format(script))
+            continue
+        try:
+            total = zenload.run_load(address, args.c, args.d, args.t, args.w)
+        finally:
+            stop_server(server)
+        h = total['histogram']
+        print('{:>16} {:>10} {:>11.0f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} '
+              '{:>7} {:>8}'.format(
+                  script, total['connected'], total['rate'],
+                  1000 * h.percentile(50), 1000 * h.percentile(99),
+                  1000 * h.percentile(99.9), 1000 * h.max,
+                  total['errors'], total['starved']))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# A small edge-triggered epoll reactor (Linux only). Compare tae.py, which
+# is level-triggered: it gets woken up for every socket that still has
+# data and reads 1024 bytes each time. Here every socket is registered
+# once with EPOLLET, so epoll reports only changes, and each wakeup reads
+# (or writes) until the socket says EAGAIN.
+#
+# A server plugs in a handler object with the methods
+#   connection_made(conn), data_received(conn, data), connection_lost(conn)
+# and keeps whatever per-connection state it needs in conn.state.
+#
+#   python3 reactor.py           # echo server on 127.0.0.1:8888, like tae.py
+
+import heapq, itertools, select, socket, time
+
+READ_EVENTS = select.EPOLLIN | select.EPOLLRDHUP
+ERROR_EVENTS = select.EPOLLHUP | select.EPOLLERR
+ACCEPT_RETRY = 0.1  # seconds to wait when accept() fails, e.g. with EMFILE
+
+class Connection(object):
+    """One client socket and its pending output."""
+
+    __slots__ = ('reactor', 'sock', 'fd', 'address', 'handler', 'outbuf',
+                 'closing', 'closed', 'state')
+
+    def __init__(self, reactor, sock, address, handler):
+        self.reactor = reactor
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.address = address
+        self.handler = handler
+        self.outbuf = bytearray()  # accepted by write() but not yet sent
+        self.closing = False       # close once outbuf is empty
+        self.closed = False
+        self.state = None          # for the handler's own use
+
+    def write(self, data):
+        """Send `data` as soon as the socket accepts it, in order."""
+        if self.closed:
+            return
+        if self.outbuf:
+            self.outbuf += data
+            return
+        try:
+            n = self.sock.send(data)
+        except BlockingIOError:
+            n = 0
+        except OSError:
+            self.abort()
+            return
+        if n < len(data):
+            self.outbuf += data[n:]  # EPOLLOUT will tell us when to go on
+
+    def flush(self):
+        while self.outbuf:
+            try:
+                n = self.sock.send(self.outbuf)
+            except BlockingIOError:
+                return
+            except OSError:
+                self.abort()
+                return
+            del self.outbuf[:n]
+        if self.closing:
+            self.abort()
+
+    def close(self):
+        """Close the connection once the pending output has been sent."""
+        self.closing = True
+        if not self.outbuf:
+            self.abort()
+
+    def abort(self):
+        """Close the connection now, dropping any pending output."""
+        if self.closed:
+            return
+        self.closed = True
+        self.reactor.forget(self)
+        self.sock.close()
+        self.handler.connection_lost(self)
+
+class Timer(object):
+    __slots__ = ('when', 'callback', 'args')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        self.callback = None
+
+class Reactor(object):
+    """Runs handlers for any number of listening and client sockets."""
+
+    def __init__(self, bufsize=65536):
+        self.bufsize = bufsize
+        self.epoll = select.epoll()
+        self.listeners = {}    # fd --> (listening socket, handler)
+        self.connections = {}  # fd --> Connection
+        self.timers = []       # heap of (when, sequence number, Timer)
+        self.sequence = itertools.count()
+        self.running = False
+
+    def listen(self, listener, handler):
+        """Accept connections on `listener` and hand them to `handler`."""
+        listener.setblocking(False)
+        self.listeners[listener.fileno()] = (listener, handler)
+        self.epoll.register(listener.fileno(), select.EPOLLIN | select.EPOLLET)
+
+    def unlisten(self, listener):
+        """Stop accepting connections on `listener` (but leave it open)."""
+        if self.listeners.pop(listener.fileno(), None):
+            self.epoll.unregister(listener.fileno())
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after `delay` seconds; returns a Timer
+        whose cancel() method prevents it."""
+        timer = Timer(time.monotonic() + delay, callback, args)
+        heapq.heappush(self.timers, (timer.when, next(self.sequence), timer))
+        return timer
+
+    def forget(self, conn):
+        self.connections.pop(conn.fd, None)
+        try:
+            self.epoll.unregister(conn.fd)
+        except (OSError, ValueError):
+            pass
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        while self.running:
+            for fd, event in self.epoll.poll(self.run_timers()):
+                conn = self.connections.get(fd)
+                if conn is not None:
+                    self.serve(conn, event)
+                elif fd in self.listeners:
+                    self.accept(*self.listeners[fd])
+
+    def run_timers(self):
+        """Run the timers that are due; return the poll() timeout until
+        the next one (-1: none)."""
+        while self.timers:
+            when, sequence, timer = self.timers[0]
+            delay = when - time.monotonic()
+            if delay > 0:
+                return delay
+            heapq.heappop(self.timers)
+            if timer.callback is not None:
+                timer.callback(*timer.args)
+        return -1
+
+    def accept(self, listener, handler):
+        while True:
+            try:
+                sock, address = listener.accept()
+            except BlockingIOError:
+                return
+            except ConnectionAbortedError:  # reset while in the backlog
+                continue
+            except OSError:  # e.g. out of file descriptors
+                # The backlog is not drained, so no new edge will come:
+                # try again later instead of waiting for one.
+                self.call_later(ACCEPT_RETRY, self.retry_accept, listener)
+                return
+            sock.setblocking(False)
+            conn = Connection(self, sock, address, handler)
+            self.connections[conn.fd] = conn
+            self.epoll.register(conn.fd, READ_EVENTS | select.EPOLLOUT
+                                | select.EPOLLET)
+            handler.connection_made(conn)
+
+    def retry_accept(self, listener):
+        entry = self.listeners.get(listener.fileno())
+        if entry is not None and entry[0] is listener:  # still listening
+            self.accept(listener, entry[1])
+
+    def serve(self, conn, event):
+        if event & select.EPOLLOUT and conn.outbuf:
+            conn.flush()
+        if event & (READ_EVENTS | ERROR_EVENTS) and not conn.closed:
+            chunks = []
+            eof = False
+            closing = event & (select.EPOLLRDHUP | ERROR_EVENTS)
+            while True:
+                try:
+                    data = conn.sock.recv(self.bufsize)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    eof = True
+                    break
+                if not data:
+                    eof = True
+                    break
+                chunks.append(data)
+                if len(data) < self.bufsize and not closing:
+                    break  # drained: new data will raise a new edge
+            if chunks:
+                conn.handler.data_received(conn, b''.join(chunks))
+            if eof:
+                conn.close()  # after sending what the handler wrote
+
+class EchoHandler(object):
+    def connection_made(self, conn):
+        print('Accepted new connection from {}'.format(conn.address))
+
+    def data_received(self, conn, data):
+        conn.write(data)
+
+    def connection_lost(self, conn):
+        print('Closed connection from {}'.format(conn.address))
+
+if __name__ == '__main__':
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 8888))
+    listener.listen(1024)
+    print('TCP server running on 127.0.0.1:8888')
+    reactor = Reactor()
+    reactor.listen(listener, EchoHandler())
+    reactor.run()
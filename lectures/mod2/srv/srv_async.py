@@ -4,13 +4,21 @@
 # Asynchronous I/O driven directly by the poll() system call.
 
 # [select — Waiting for I/O completion](https://docs.python.org/3/library/select.html)
-import select, zen_utils
+import select, time, zen_handoff, zen_utils
+from zen_metrics import log, metrics
+
+MAX_REQUEST = 4096  # bytes of a question without its '?' before we hang up
 
 def all_events_forever(poll_object):
     while True:
-        for fd, event in poll_object.poll():
+        events = poll_object.poll()
+        start = time.perf_counter()
+        for fd, event in events:
             # [Yield in Python: An Ultimate Tutorial on Yield Keyword in Python](https://www.simplilearn.com/tutorials/python-tutorial/yield-in-python)
             yield fd, event
+        # The last event in a batch waits for all the others: that is the
+        # loop's lag (there are no timers to measure it with instead).
+        metrics.loop_lag(time.perf_counter() - start)
 
 def serve(listener):
     sockets = {listener.fileno(): listener}
@@ -21,60 +29,122 @@ def serve(listener):
     poll_object = select.poll()
     poll_object.register(listener, select.POLLIN)
 
+    def close(sock, error=False):
+        # Forget the socket as we close it, rather than at the POLLNVAL
+        # the next poll() would report: by then accept() may have given
+        # its descriptor number to a new client, whom we would drop.
+        address = addresses.pop(sock)
+        rb = bytes_received.pop(sock, b'')
+        sb = bytes_to_send.pop(sock, b'')
+        if rb:
+            log.debug('Client %s sent %s but then closed', address, rb)
+        elif sb:
+            log.debug('Client %s closed before we sent %s', address, sb)
+        else:
+            log.debug('Client %s closed socket normally', address)
+        poll_object.unregister(sock)
+        del sockets[sock.fileno()]
+        sock.close()
+        metrics.connection_lost(error)
+
     for fd, event in all_events_forever(poll_object):
         sock = sockets[fd]
 
         # Socket closed: remove it from our data structures.
 
         if event & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
-            address = addresses.pop(sock)
-            rb = bytes_received.pop(sock, b'')
-            sb = bytes_to_send.pop(sock, b'')
-            if rb:
-                print('Client {} sent {} but then closed'.format(address, rb))
-            elif sb:
-                print('Client {} closed before we sent {}'.format(address, sb))
-            else:
-                print('Client {} closed socket normally'.format(address))
-            poll_object.unregister(fd)
-            del sockets[fd]
+            close(sock, event & select.POLLERR)
 
         # New socket: add it to our data structures.
 
         elif sock is listener:
-            sock, address = sock.accept()
-            print('Accepted connection from {}'.format(address))
+            if zen_handoff.draining.is_set():
+                poll_object.unregister(fd)  # our successor accepts now
+                continue
+            try:
+                sock, address = sock.accept()
+            except BlockingIOError:
+                continue  # another process got there first
+            log.debug('Accepted connection from %s', address)
+            metrics.connection_made()
             sock.setblocking(False)     # force socket.timeout if we blunder
             # Could it be set as blocking mode?
             sockets[sock.fileno()] = sock
             addresses[sock] = address
             poll_object.register(sock, select.POLLIN)
 
-        # Incoming data: keep receiving until we see the suffix.
+        # Incoming data: answer every complete question received so far,
+        # in order, and send all the answers at once. Clients may send
+        # several questions without waiting for the answers (pipelining).
 
         elif event & select.POLLIN:
-            more_data = sock.recv(4096)
+            try:
+                more_data = sock.recv(4096)
+            except OSError:  # e.g. reset by the client
+                close(sock, error=True)
+                continue
             if not more_data:  # end-of-file
-                sock.close()  # next poll() will POLLNVAL, and thus clean up
+                close(sock)
                 continue
-            data = bytes_received.pop(sock, b'') + more_data
-            if data.endswith(b'?'):
-                bytes_to_send[sock] = zen_utils.get_answer(data)
-                poll_object.modify(sock, select.POLLOUT)
-            else:
-                bytes_received[sock] = data
+            partial = bytes_received.pop(sock, b'')
+            data = partial + more_data
+            received = time.perf_counter()
+            answers = []
+            start = 0
+            end = data.find(b'?', len(partial)) + 1  # partial has no '?'
+            while end:
+                answers.append(zen_utils.get_answer(data[start:end]))
+                start = end
+                end = data.find(b'?', start) + 1
+            if start < len(data):
+                bytes_received[sock] = data[start:]
+            answer = b''.join(answers)
+            rest = b''
+            if answer:
+                rest = send_some(sock, answer)  # one send for all
+                if rest:
+                    bytes_to_send[sock] = rest
+                    poll_object.modify(sock, select.POLLOUT)
+            metrics.request(len(more_data), len(answer),
+                            time.perf_counter() - received, len(answers))
+            if rest is None:
+                close(sock, error=True)
+            elif len(bytes_received.get(sock, b'')) > MAX_REQUEST:
+                log.info('Client %s sent a request over %s bytes, closing',
+                         addresses[sock], MAX_REQUEST)
+                close(sock)
+            elif (answer and not rest and zen_handoff.draining.is_set()
+                    and sock not in bytes_received):
+                close(sock)  # after its answers: the client can reconnect
 
         # Socket ready to send: keep sending until all bytes are delivered.
+        # Nothing more is read from it meanwhile.
 
         elif event & select.POLLOUT:
-            data = bytes_to_send.pop(sock)
-            n = sock.send(data)
-            if n < len(data):
-                bytes_to_send[sock] = data[n:]
+            rest = send_some(sock, bytes_to_send.pop(sock))
+            if rest:
+                bytes_to_send[sock] = rest
+            elif rest is None:
+                close(sock, error=True)
+            elif (zen_handoff.draining.is_set()
+                    and sock not in bytes_received):
+                close(sock)  # after its answers: the client can reconnect
             else:
                 poll_object.modify(sock, select.POLLIN)
 
+def send_some(sock, data):
+    """Send what the socket accepts now and return the bytes left over,
+    or None if the connection broke."""
+    try:
+        n = sock.send(data)
+    except BlockingIOError:
+        n = 0
+    except OSError:
+        return None
+    return data[n:]
+
 if __name__ == '__main__':
     address = zen_utils.parse_command_line('low-level async server')
     listener = zen_utils.create_srv_socket(address)
+    zen_handoff.serve_handoff([listener])
     serve(listener)
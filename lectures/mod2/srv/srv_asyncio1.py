@@ -4,39 +4,197 @@
 # Asynchronous I/O inside "asyncio" callback methods.
 
 # - [Transports and Protocols](https://docs.python.org/3/library/asyncio-protocol.html)
+# - [Executing code in thread or process pools](https://docs.python.org/3/library/asyncio-eventloop.html#executing-code-in-thread-or-process-pools)
 
-import asyncio, zen_utils
+import asyncio, collections, zen_handoff, zen_metrics, zen_utils
+from zen_metrics import log, metrics
 
 class ZenServer(asyncio.Protocol):
 
+    # Pool that runs get_answer() off the event loop, or None to call it
+    # right here, which stalls every other client while it runs.
+    executor = None
+
+    # Flow control, so that no client can make us buffer without bound. A
+    # question still without its '?' after max_request bytes gets the
+    # connection closed. A client that asks without reading the answers
+    # fills the transport's write buffer: past write_high, asyncio calls
+    # pause_writing() and we stop reading from it until the buffer drains
+    # below write_low. max_pending likewise bounds the answers queued in
+    # the executor.
+    max_request = 4096
+    write_high = 64 * 1024
+    write_low = 16 * 1024
+    max_pending = 1024
+
+    # Seconds a connection may stay silent, and seconds a client may take
+    # to finish a question it has started (against slowloris clients that
+    # trickle a byte at a time); 0 turns either check off.
+    idle_timeout = 300.0
+    read_timeout = 10.0
+
     def connection_made(self, transport):
         self.transport = transport
         self.address = transport.get_extra_info('peername')
         self.data = b''
-        print('Accepted connection from {}'.format(self.address))
+        self.answers = collections.deque()  # (future, time asked), in order
+        self.loop = asyncio.get_running_loop()
+        self.last_active = self.loop.time()
+        self.started = None  # when the partial question in self.data began
+        self.writing_paused = self.reading_paused = False
+        self.timer = None
+        transport.set_write_buffer_limits(self.write_high, self.write_low)
+        self.check_timeouts()
+        metrics.connection_made()
+        log.debug('Accepted connection from %s', self.address)
 
     def data_received(self, data):
-        self.data += data
-        if self.data.endswith(b'?'):
-            answer = zen_utils.get_answer(self.data)
-            self.transport.write(answer)
+        # Several questions may arrive at once (pipelining): answer each.
+        questions = (self.data + data).split(b'?')
+        self.data = questions.pop()
+        self.last_active = self.loop.time()
+        if self.executor is None:
+            answer = b''.join(zen_utils.get_answer(q + b'?')
+                              for q in questions)
+            if answer:  # one write for them all
+                self.transport.write(answer)
+            metrics.request(len(data), len(answer),
+                            self.loop.time() - self.last_active,
+                            len(questions))
+        else:
+            for question in questions:
+                future = self.loop.run_in_executor(
+                    self.executor, zen_utils.get_answer, question + b'?')
+                future.add_done_callback(self.send_answers)
+                self.answers.append((future, self.last_active))
+            metrics.request(len(data), 0, 0.0, 0)  # the rest in send_answers
+        if self.max_request and len(self.data) > self.max_request:
+            log.info('Client %s sent a request over %s bytes, closing',
+                     self.address, self.max_request)
             self.data = b''
+            self.transport.close()
+            return
+        if not self.data:
+            self.started = None
+        elif questions or self.started is None:
+            self.started = self.last_active
+            if self.read_timeout and (self.timer is None or self.timer.when()
+                                      > self.started + self.read_timeout):
+                self.check_timeouts()
+        self.update_reading()
+        if questions and zen_handoff.draining.is_set():
+            self.close_if_done()
+
+    def send_answers(self, future):
+        # Answers may finish in any order; send the ones at the front of
+        # the queue, so the client gets them in the order it asked.
+        if self.transport.is_closing():
+            return
+        ready = []
+        while self.answers and self.answers[0][0].done():
+            future, asked = self.answers.popleft()
+            ready.append(future.result())
+            metrics.request(0, len(ready[-1]), self.loop.time() - asked)
+        if ready:
+            self.transport.write(b''.join(ready))
+            self.update_reading()
+            if zen_handoff.draining.is_set():
+                self.close_if_done()
+
+    def close_if_done(self):
+        # While draining, hang up once the client has all its answers and
+        # has not started another question: it can reconnect.
+        if not self.answers and not self.data:
+            self.transport.close()
+
+    def pause_writing(self):
+        self.writing_paused = True
+        self.update_reading()
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self.last_active = self.loop.time()  # the client is reading again
+        self.update_reading()
+
+    def update_reading(self):
+        pause = self.writing_paused or len(self.answers) >= self.max_pending
+        if pause == self.reading_paused or self.transport.is_closing():
+            return
+        self.reading_paused = pause
+        if pause:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
+            if self.data:
+                self.started = self.loop.time()  # paused time is not theirs
+                self.check_timeouts()
+
+    def check_timeouts(self):
+        # One timer per connection, set for the nearest deadline; data
+        # that arrives in the meantime only moves the deadlines later, so
+        # the timer is rescheduled when it fires rather than on every read.
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        deadlines = []
+        if self.idle_timeout:
+            deadlines.append(self.last_active + self.idle_timeout)
+        if self.read_timeout and self.started and not self.reading_paused:
+            deadlines.append(self.started + self.read_timeout)
+        if not deadlines or self.transport.is_closing():
+            return
+        deadline = min(deadlines)
+        if deadline > self.loop.time():
+            self.timer = self.loop.call_at(deadline, self.check_timeouts)
+            return
+        log.info('Client %s timed out, closing', self.address)
+        self.transport.abort()  # drop whatever it never read
 
     def connection_lost(self, exc):
+        if self.timer:
+            self.timer.cancel()
+        for future, asked in self.answers:
+            future.cancel()
+        metrics.connection_lost(exc)
         if exc:
-            print('Client {} error: {}'.format(self.address, exc))
+            log.warning('Client %s error: %s', self.address, exc)
         elif self.data:
-            print('Client {} sent {} but then closed'
-                  .format(self.address, self.data))
+            log.debug('Client %s sent %s but then closed',
+                      self.address, self.data)
         else:
-            print('Client {} closed socket'.format(self.address))
+            log.debug('Client %s closed socket', self.address)
+
+def add_arguments(parser):
+    """Add the flow control options, whose defaults are ZenServer's."""
+    parser.add_argument('--max-request', metavar='bytes', type=int,
+                        default=ZenServer.max_request,
+                        help='longest question accepted (default %(default)s,'
+                        ' 0: no limit)')
+    parser.add_argument('--idle-timeout', metavar='seconds', type=float,
+                        default=ZenServer.idle_timeout,
+                        help='close silent connections (default %(default)s)')
+    parser.add_argument('--read-timeout', metavar='seconds', type=float,
+                        default=ZenServer.read_timeout,
+                        help='close clients slow to finish a question '
+                        '(default %(default)s)')
 
 if __name__ == '__main__':
-    address = zen_utils.parse_command_line('asyncio server using callbacks')
+    args = zen_utils.parse_arguments('asyncio server using callbacks',
+                                     zen_utils.add_executor_arguments,
+                                     add_arguments)
+    address = (args.host, args.p)
+    ZenServer.executor = zen_utils.create_executor(args.x, args.w)
+    ZenServer.max_request = args.max_request
+    ZenServer.idle_timeout = args.idle_timeout
+    ZenServer.read_timeout = args.read_timeout
+
     loop = asyncio.get_event_loop()
-    coro = loop.create_server(ZenServer, *address)
+    listener = zen_utils.create_srv_socket(address)  # or taken over
+    coro = loop.create_server(ZenServer, sock=listener)
     server = loop.run_until_complete(coro)
-    print('Listening at {}'.format(address))
+    metrics.watch(loop.call_later)
+    zen_handoff.serve_handoff(
+        [listener], lambda: zen_handoff.call_in_loop(loop, server.close))
     try:
         loop.run_forever()
     finally:
@@ -3,36 +3,71 @@
 # https://github.com/brandon-rhodes/fopnp/blob/m/py3/chapter07/srv_asyncio2.py
 # Asynchronous I/O inside an "asyncio" coroutine.
 
-import asyncio, zen_utils
+import asyncio, time, zen_handoff, zen_metrics, zen_utils
+from zen_metrics import log, metrics
 
-@asyncio.coroutine
-def handle_conversation(reader, writer):
+executor = None  # pool that runs get_answer() off the event loop, if any
+
+async def handle_conversation(reader, writer):
     address = writer.get_extra_info('peername')
-    print('Accepted connection from {}'.format(address))
+    log.debug('Accepted connection from %s', address)
+    metrics.connection_made()
+    try:
+        await converse(reader, writer, address)
+    except Exception as e:
+        metrics.connection_lost(e)
+        log.warning('Client %s error: %s', address, e)
+    else:
+        metrics.connection_lost()
+
+async def converse(reader, writer, address):
+    data = b''
     while True:
-        data = b''
-        while not data.endswith(b'?'):
-            # the 'yield from' is put in front of the code that
-            # performs a blocking operation and waited for the operating system to respond
-            # this let the generator plug into the asyncio subsystem without blocking it
-            more_data = yield from reader.read(4096)
-            if not more_data:
-                if data:
-                    print('Client {} sent {!r} but then closed'
-                          .format(address, data))
-                else:
-                    print('Client {} closed socket normally'.format(address))
+        # the 'await' (the book's 'yield from', before Python 3.5) is put
+        # in front of the code that performs a blocking operation and
+        # waits for the operating system to respond
+        # this lets the coroutine plug into the asyncio subsystem without blocking it
+        more_data = await reader.read(4096)
+        if not more_data:
+            if data:
+                log.debug('Client %s sent %r but then closed', address, data)
+            else:
+                log.debug('Client %s closed socket normally', address)
+            return
+        # Several questions may arrive at once (pipelining): answer each,
+        # in order, and send all the answers with one write.
+        questions = (data + more_data).split(b'?')
+        data = questions.pop()
+        answers = []
+        for question in questions:
+            received = time.perf_counter()
+            if executor is None:
+                answer = zen_utils.get_answer(question + b'?')
+            else:
+                # one at a time, so answers keep the order of the questions
+                answer = await asyncio.get_running_loop().run_in_executor(
+                    executor, zen_utils.get_answer, question + b'?')
+            answers.append(answer)
+            metrics.request(len(question) + 1, len(answer),
+                            time.perf_counter() - received)
+        if answers:
+            writer.write(b''.join(answers))
+            if zen_handoff.draining.is_set() and not data:
+                writer.close()  # after an answer: the client can reconnect
                 return
-            data += more_data
-        answer = zen_utils.get_answer(data)
-        writer.write(answer)
 
 if __name__ == '__main__':
-    address = zen_utils.parse_command_line('asyncio server using coroutine')
+    args = zen_utils.parse_arguments('asyncio server using coroutine',
+                                     zen_utils.add_executor_arguments)
+    address = (args.host, args.p)
+    executor = zen_utils.create_executor(args.x, args.w)
     loop = asyncio.get_event_loop()
-    coro = asyncio.start_server(handle_conversation, *address)
+    listener = zen_utils.create_srv_socket(address)  # or taken over
+    coro = asyncio.start_server(handle_conversation, sock=listener)
     server = loop.run_until_complete(coro)
-    print('Listening at {}'.format(address))
+    metrics.watch(loop.call_later)
+    zen_handoff.serve_handoff(
+        [listener], lambda: zen_handoff.call_in_loop(loop, server.close))
     try:
         loop.run_forever()
     finally:
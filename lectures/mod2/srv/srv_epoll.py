@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Zen server on the edge-triggered epoll reactor in reactor.py (Linux).
+# Like srv_async.py it answers pipelined questions in order with one write;
+# a timer also closes connections that stay idle for too long, and a
+# question still without its '?' after max_request bytes gets the
+# connection closed.
+
+import threading, time, zen_handoff, zen_utils
+from reactor import Reactor
+from zen_metrics import log, metrics
+
+class ZenHandler(object):
+
+    def __init__(self, reactor, idle=300.0, max_request=4096):
+        self.reactor = reactor
+        self.idle = idle           # seconds of silence before we hang up
+        self.max_request = max_request  # bytes of an unfinished question
+        self.connections = set()
+        if idle:
+            reactor.call_later(idle / 2, self.close_idle)
+
+    def connection_made(self, conn):
+        log.debug('Accepted connection from %s', conn.address)
+        conn.state = [b'', time.monotonic()]  # partial question, last active
+        self.connections.add(conn)
+        metrics.connection_made()
+
+    def data_received(self, conn, data):
+        if conn.closing:
+            return  # over max_request: only the answers are still sent
+        received = time.monotonic()
+        nbytes = len(data)
+        data = conn.state[0] + data
+        answers = []
+        start = 0
+        end = data.find(b'?') + 1
+        while end:
+            answers.append(zen_utils.get_answer(data[start:end]))
+            start = end
+            end = data.find(b'?', start) + 1
+        conn.state = [data[start:], received]
+        answer = b''.join(answers)
+        if answer:
+            conn.write(answer)
+        metrics.request(nbytes, len(answer), time.monotonic() - received,
+                        len(answers))
+        if self.max_request and len(conn.state[0]) > self.max_request:
+            log.info('Client %s sent a request over %s bytes, closing',
+                     conn.address, self.max_request)
+            conn.state[0] = b''
+            conn.close()
+            return
+        if answer and zen_handoff.draining.is_set() and not conn.state[0]:
+            conn.close()  # after its answers: the client can reconnect
+
+    def connection_lost(self, conn):
+        self.connections.discard(conn)
+        metrics.connection_lost()
+        if conn.state[0]:
+            log.debug('Client %s sent %s but then closed',
+                      conn.address, conn.state[0])
+        else:
+            log.debug('Client %s closed socket', conn.address)
+
+    def close_idle(self):
+        deadline = time.monotonic() - self.idle
+        for conn in [c for c in self.connections if c.state[1] < deadline]:
+            log.info('Client %s idle, closing', conn.address)
+            conn.close()
+        self.reactor.call_later(self.idle / 2, self.close_idle)
+
+if __name__ == '__main__':
+    address = zen_utils.parse_command_line('edge-triggered epoll server')
+    listener = zen_utils.create_srv_socket(address, backlog=1024)
+    reactor = Reactor()
+    reactor.listen(listener, ZenHandler(reactor))
+    metrics.watch(reactor.call_later)
+    stopped = threading.Event()  # accepting no more, after a handoff
+
+    def check_handoff():
+        if zen_handoff.draining.is_set():
+            reactor.unlisten(listener)
+            stopped.set()
+        else:
+            reactor.call_later(zen_handoff.POLL, check_handoff)
+
+    check_handoff()
+    zen_handoff.serve_handoff([listener], stopped.wait)
+    reactor.run()
@@ -4,7 +4,7 @@
 # Uses the legacy "socketserver" Standard Library module to write a server.
 
 from socketserver import BaseRequestHandler, TCPServer, ThreadingMixIn
-import zen_utils
+import zen_handoff, zen_utils
 
 class ZenHandler(BaseRequestHandler):
     def handle(self):
@@ -17,5 +17,8 @@ class ZenServer(ThreadingMixIn, TCPServer):
 
 if __name__ == '__main__':
     address = zen_utils.parse_command_line('legacy "SocketServer" server')
-    server = ZenServer(address, ZenHandler)
+    server = ZenServer(address, ZenHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = zen_utils.create_srv_socket(address)  # or taken over
+    zen_handoff.serve_handoff([server.socket], server.shutdown)
     server.serve_forever()
@@ -6,7 +6,8 @@
 # [asyncore](https://docs.python.org/3/library/asyncore.html)
 # [asynchat](https://docs.python.org/3/library/asynchat.html)
 
-import asyncore, asynchat, zen_utils
+import asyncore, asynchat, time, zen_handoff, zen_utils
+from zen_metrics import log, metrics
 
 class ZenRequestHandler(asynchat.async_chat):
 
@@ -14,20 +15,40 @@ class ZenRequestHandler(asynchat.async_chat):
         asynchat.async_chat.__init__(self, sock)
         self.set_terminator(b'?')
         self.data = b''
+        metrics.connection_made()
 
     def collect_incoming_data(self, more_data):
         self.data += more_data
 
     def found_terminator(self):
+        received = time.perf_counter()
         answer = zen_utils.get_answer(self.data + b'?')
         self.push(answer)
         self.initiate_send()
+        metrics.request(len(self.data) + 1, len(answer),
+                        time.perf_counter() - received)
         self.data = b''
+        if zen_handoff.draining.is_set():
+            self.close_when_done()  # the client can reconnect
+
+    def handle_close(self):
+        log.debug('Client %s closed socket', self.addr)
+        metrics.connection_lost()
+        self.close()
 
 class ZenServer(asyncore.dispatcher):
 
+    def readable(self):
+        return not zen_handoff.draining.is_set()
+
     def handle_accept(self):
-        sock, address = self.accept()
+        if zen_handoff.draining.is_set():
+            return
+        pair = self.accept()
+        if pair is None:  # another process got there first
+            return
+        sock, address = pair
+        log.debug('Accepted connection from %s', address)
         ZenRequestHandler(sock)
 
 if __name__ == '__main__':
@@ -35,4 +56,5 @@ if __name__ == '__main__':
     listener = zen_utils.create_srv_socket(address)
     server = ZenServer(listener)
     server.accepting = True  # we already called listen()
-    asyncore.loop()
+    zen_handoff.serve_handoff([listener])
+    asyncore.loop(zen_handoff.POLL)  # so readable() is asked again
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Pre-forked server: N worker processes, each with its own SO_REUSEPORT
+# listener and its own few threads (as in srv_threaded.py), so requests
+# are handled in parallel on every core instead of by threads sharing one
+# GIL. The parent only supervises: it opens the listeners, restarts any
+# worker that dies on the same listener, and with --handoff passes all of
+# them to its replacement, then has its workers drain (SIGUSR2).
+# POSIX only (os.fork).
+
+import argparse, os, signal, time, zen_handoff, zen_metrics, zen_utils
+from srv_threaded import start_threads
+from zen_metrics import log
+
+stats = None  # where each worker serves its stats; see zen_metrics
+
+def worker(listener, threads):
+    """Run in a child process: serve connections on `listener` until the
+    supervisor sends SIGUSR2, then drain them and exit."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR2, lambda signum, frame:
+                  zen_handoff.draining.set())
+    status = 1
+    try:
+        zen_metrics.metrics.started = time.time()  # not the supervisor's
+        if stats:
+            try:
+                zen_metrics.serve_stats(stats)
+            except OSError as e:  # e.g. every worker given the same port
+                log.warning('Worker %s serves no stats: %s', os.getpid(), e)
+        start_threads(listener, threads)
+        while not zen_handoff.draining.wait(1.0):
+            pass
+        zen_handoff.drain()
+        status = 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os._exit(status)  # never return into the supervisor's code
+
+def start_worker(listener, threads):
+    pid = os.fork()
+    if pid == 0:
+        worker(listener, threads)
+    return pid
+
+def stop(signum, frame):
+    raise SystemExit(0)
+
+def supervise(address, workers, threads=4, min_uptime=1.0):
+    """Start `workers` processes and replace each one that exits.
+
+    A worker that dies within `min_uptime` seconds of starting is
+    restarted only after that delay, so a persistent failure does not
+    turn into a fork loop. After a handoff, workers that exit are not
+    replaced, and the supervisor returns once they all have.
+    """
+    # Every listener taken over gets a worker, even beyond `workers`:
+    # closing one would reset the connections queued on it.
+    count = max(workers, len(zen_handoff.inherited))
+    listeners = [zen_utils.create_srv_socket(address, reuseport=True)
+                 for i in range(count)]
+    started = {}  # pid --> (start time, listener)
+    for listener in listeners:
+        started[start_worker(listener, threads)] = time.time(), listener
+
+    def stop_workers():
+        for pid in list(started):
+            try:
+                os.kill(pid, signal.SIGUSR2)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    zen_handoff.serve_handoff(listeners, stop_workers,
+                              drained=lambda: not started)
+    try:
+        while started:
+            pid, status = os.wait()
+            if pid not in started:
+                continue
+            start, listener = started.pop(pid)
+            if zen_handoff.draining.is_set():
+                continue
+            log.warning('Worker %s exited with status %s, restarting',
+                        pid, status)
+            uptime = time.time() - start
+            if uptime < min_uptime:
+                time.sleep(min_uptime - uptime)
+            started[start_worker(listener, threads)] = time.time(), listener
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in started:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pre-forked server')
+    parser.add_argument('host', help='IP or hostname')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='TCP port (default 1060)')
+    parser.add_argument('-w', metavar='workers', type=int,
+                        default=os.cpu_count(),
+                        help='worker processes (default: number of cores)')
+    parser.add_argument('-t', metavar='threads', type=int, default=4,
+                        help='threads per worker (default 4)')
+    zen_utils.add_answer_arguments(parser)
+    zen_metrics.add_arguments(parser)
+    zen_handoff.add_arguments(parser)
+    args = parser.parse_args()
+    zen_metrics.configure(args, stats=False)  # each worker has its own
+    zen_handoff.configure(args)
+    zen_utils.configure_answers(args)  # before forking: workers inherit it
+    stats = args.stats
+    supervise((args.host, args.p), args.w, args.t)
@@ -3,9 +3,10 @@
 # https://github.com/brandon-rhodes/fopnp/blob/m/py3/chapter07/srv_single.py
 # Single-threaded server that serves one client at a time; others must wait.
 
-import zen_utils
+import zen_handoff, zen_utils
 
 if __name__ == '__main__':
     address = zen_utils.parse_command_line('simple single-threaded server')
     listener = zen_utils.create_srv_socket(address)
+    zen_handoff.serve_handoff([listener])
     zen_utils.accept_connections_forever(listener)
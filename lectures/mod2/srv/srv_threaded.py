@@ -3,7 +3,7 @@
 # https://github.com/brandon-rhodes/fopnp/blob/m/py3/chapter07/srv_threaded.py
 # Using multiple threads to serve several clients in parallel.
 
-import zen_utils
+import zen_handoff, zen_utils
 from threading import Thread # memory image and file descriptor space
 
 #  multiprocessing.Process gives each thread of control 
@@ -22,6 +22,7 @@ if __name__ == '__main__':
     listener = zen_utils.create_srv_socket(address)
     # option 1: the main thread starts several server threads then exits
     start_threads(listener)
+    zen_handoff.serve_handoff([listener])
 
     # option 2: the main thread acts as a monitor
     # restarts replacement threads if any of them die
\ No newline at end of file
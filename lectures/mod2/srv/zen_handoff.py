@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# Zero-downtime restarts for the Zen servers. Start a server with
+# --handoff PATH, then start its replacement with the same command line:
+# the new process connects to the UNIX socket at PATH, receives the old
+# one's listening sockets (SCM_RIGHTS, socket.send_fds) and starts
+# accepting on them; only then does the old process stop accepting,
+# finish the conversations it has (closing each after its next answer)
+# and exit, at the latest after --drain seconds. The kernel queues any
+# connection that arrives meanwhile, so no client is ever refused.
+#
+#   python3 srv_epoll.py 127.0.0.1 --handoff /tmp/zen.sock &
+#   python3 srv_epoll.py 127.0.0.1 --handoff /tmp/zen.sock &  # replaces it
+#
+# Both processes share the listening sockets for a moment, so every Zen
+# listener is non-blocking and every accept loop copes with another
+# process (or thread) taking the connection it was woken up for.
+
+import logging, os, socket, sys, threading, time
+from zen_metrics import log, metrics
+
+POLL = 0.5  # seconds; how often accept loops look at `draining`
+
+draining = threading.Event()  # set once a successor has our listeners
+inherited = []      # listening sockets received from our predecessor
+predecessor = None  # its control connection, until we tell it to go
+path = None         # where this process offers its listeners
+drain_timeout = 30.0
+
+def add_arguments(parser):
+    """Add the --handoff and --drain options to an ArgumentParser."""
+    parser.add_argument('--handoff', metavar='path',
+                        help='take over the listening socket of the server '
+                             'offering it at this UNIX socket path, if any, '
+                             'and offer ours there in turn')
+    parser.add_argument('--drain', metavar='seconds', type=float,
+                        default=30.0,
+                        help='after a handoff, longest wait for open '
+                             'conversations to end (default 30)')
+
+def configure(args):
+    """Apply the options added by add_arguments(): with --handoff, take
+    over the listeners of the process serving at that path."""
+    global path, drain_timeout
+    path = args.handoff
+    drain_timeout = args.drain
+    if path:
+        inherited.extend(take_over(path))
+
+def take_over(path):
+    """Receive the listening sockets of the process offering them at
+    `path`; return [] if there is none."""
+    global predecessor
+    control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        control.connect(path)
+        message, fds, flags, address = socket.recv_fds(control, 64, 64)
+    except OSError:
+        control.close()
+        return []
+    if not fds:
+        control.close()
+        return []
+    predecessor = control
+    log.info('Took over %s listening socket(s) from %s', len(fds),
+             message.decode('ascii', 'replace'))
+    listeners = []
+    for fd in fds:
+        listener = socket.socket(fileno=fd)
+        listener.setblocking(False)  # it already is; tell the socket object
+        listeners.append(listener)
+    return listeners
+
+def serve_handoff(listeners, stop_accepting=None, drained=None):
+    """Offer `listeners` at `path` to the next process started with the
+    same --handoff option. When it has them, set `draining`, call
+    stop_accepting(), which must return only once this process accepts
+    no more connections, wait until drained() (default: no connection
+    left open) or --drain seconds, and exit.
+
+    Started without --handoff, this does nothing. Called with the
+    listeners taken over, it also tells the predecessor to go.
+    """
+    global predecessor
+    if not path:
+        return
+    # Duplicates stay open even if the server closes its own sockets when
+    # it stops accepting (as asyncio's Server.close() does).
+    fds = [os.dup(listener.fileno()) for listener in listeners]
+    control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(path):
+        os.unlink(path)  # our predecessor's, or left over by a crash
+    control.bind(path)
+    control.listen(1)
+    if predecessor is not None:
+        predecessor.sendall(b'ok')  # we are serving: it may stop now
+        predecessor.close()
+        predecessor = None
+    threading.Thread(target=hand_off, daemon=True, args=(
+        control, fds, stop_accepting, drained)).start()
+    log.info('Offering %s listening socket(s) at %s', len(fds), path)
+
+def hand_off(control, fds, stop_accepting, drained):
+    while True:
+        successor, address = control.accept()
+        try:
+            socket.send_fds(successor, [str(os.getpid()).encode()], fds)
+            successor.settimeout(60.0)
+            ok = successor.recv(16) == b'ok'
+        except OSError:
+            ok = False
+        successor.close()
+        if ok:
+            break
+        log.warning('The new process failed to take over; still serving')
+    control.close()
+    log.info('Handed off; draining')
+    draining.set()
+    if stop_accepting is not None:
+        stop_accepting()
+    # Let every accept loop see `draining`, and connections accepted just
+    # before (asyncio counts them a loop pass or two later) be counted.
+    time.sleep(POLL)
+    drain(drained)
+    # os._exit() skips the interpreter's shutdown: flush the log first
+    logging.shutdown()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(0)
+
+def call_in_loop(loop, function):
+    """Run function() in the thread of an asyncio event loop and wait
+    for it to return: a stop_accepting() for asyncio servers."""
+    done = threading.Event()
+    def call():
+        try:
+            function()
+        finally:
+            done.set()
+    loop.call_soon_threadsafe(call)
+    done.wait()
+
+def drain(drained=None):
+    """Wait until drained() (default: no connection open) or until
+    --drain seconds have passed."""
+    drained = drained or (lambda: metrics.active <= 0)
+    deadline = time.monotonic() + drain_timeout
+    while not drained() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if drained():
+        log.info('Drained')
+    else:
+        log.warning('%s connection(s) still open after %s s, closing',
+                    metrics.active, drain_timeout)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Live instrumentation shared by the Zen servers: counters for connections,
+# requests and bytes, histograms of request latency and event loop lag, a
+# small HTTP endpoint that serves them as JSON (on a local port or a UNIX
+# socket), and the "zen" logger the servers use instead of print().
+#
+#   python3 srv_epoll.py 127.0.0.1 --stats 127.0.0.1:9060
+#   curl -s http://127.0.0.1:9060/stats
+#   python3 srv_asyncio1.py 127.0.0.1 --stats /tmp/zen.sock
+#   curl -s --unix-socket /tmp/zen.sock http://zen/stats
+
+import http.server, json, logging, math, os, socketserver, sys, threading
+import time
+
+log = logging.getLogger('zen')
+
+class Histogram(object):
+    """Latency histogram with logarithmic buckets about 2% wide, so any
+    number of samples fits in a few hundred counters."""
+
+    SCALE = 50  # buckets per factor of e
+
+    def __init__(self):
+        self.buckets = {}  # bucket: samples (a Counter is 2x slower)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds, count=1):
+        if seconds > 1e-6:  # 1 us and below share bucket 0
+            bucket = int(math.log(seconds * 1e6) * self.SCALE)
+        else:
+            bucket = 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += count
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """Latency in seconds below which p percent of the samples fall."""
+        if not self.count:
+            return float('nan')
+        rank = math.ceil(self.count * p / 100.0)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(math.exp((bucket + 0.5) / self.SCALE) / 1e6,
+                           self.max)
+        return self.max
+
+    def summary(self):
+        """Sample count and percentiles in milliseconds, for JSON."""
+        if not self.count:
+            return {'count': 0}
+        summary = {'count': self.count, 'max': round(1000 * self.max, 3)}
+        for p in (50, 90, 99, 99.9):
+            summary['p{:g}'.format(p)] = round(1000 * self.percentile(p), 3)
+        return summary
+
+class Metrics(object):
+    """Counters for one server process. Every method takes a lock, so the
+    threaded servers can share one instance; a call costs about a
+    microsecond, so event loops record a whole batch of pipelined
+    requests at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.accepted = 0        # connections, in total
+        self.active = 0          # connections open now
+        self.errors = 0          # connections that ended in an error
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram()  # question(s) received to answer(s) written
+        self.lag = Histogram()      # how late the event loop runs callbacks
+        self.sources = {}        # name: function returning more stats
+
+    def connection_made(self):
+        with self.lock:
+            self.accepted += 1
+            self.active += 1
+
+    def connection_lost(self, error=False):
+        with self.lock:
+            self.active -= 1
+            self.errors += bool(error)
+
+    def request(self, bytes_in, bytes_out, seconds, count=1):
+        """Record `count` requests answered together in `seconds`. The
+        batch is one latency sample: counting its time once for each of
+        its requests would inflate the percentiles by the batch size."""
+        with self.lock:
+            self.requests += count
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if count:
+                self.latency.record(seconds)
+
+    def loop_lag(self, seconds):
+        with self.lock:
+            self.lag.record(seconds)
+
+    def watch(self, call_later, interval=0.25):
+        """Sample event loop lag: `call_later(delay, callback)` is that of
+        an asyncio loop or a reactor.Reactor, and lag is how much later
+        than asked for the callback runs."""
+        def tick(expected):
+            now = time.monotonic()
+            self.loop_lag(max(now - expected, 0.0))
+            call_later(interval, tick, now + interval)
+        call_later(interval, tick, time.monotonic() + interval)
+
+    def snapshot(self):
+        with self.lock:
+            stats = {
+                'pid': os.getpid(),
+                'uptime': round(time.time() - self.started, 3),
+                'connections': {'active': self.active,
+                                'accepted': self.accepted,
+                                'errors': self.errors},
+                'requests': self.requests,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'latency_ms': self.latency.summary(),
+                'loop_lag_ms': self.lag.summary(),
+            }
+        for name, source in self.sources.items():
+            stats[name] = source()
+        return stats
+
+metrics = Metrics()  # this process's counters
+
+class StatsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ('/', '/stats'):
+            self.send_error(404)
+            return
+        body = json.dumps(metrics.snapshot(), indent=1).encode() + b'\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug('stats: ' + format, *args)
+
+class UnixStatsServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve_stats(where):
+    """Serve metrics.snapshot() as JSON from a daemon thread, so that any
+    server can do it whatever runs its own connections. `where` is
+    'host:port' or the path of a UNIX socket; '{pid}' in it is replaced
+    with the process id, so that forked workers can each have their own.
+    """
+    where = where.format(pid=os.getpid())
+    if ':' in where:
+        host, port = where.rsplit(':', 1)
+        server = http.server.ThreadingHTTPServer(
+            (host or '127.0.0.1', int(port)), StatsHandler)
+    else:
+        if os.path.exists(where):
+            os.unlink(where)  # left over by an earlier run
+        server = UnixStatsServer(where, StatsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info('Serving stats at %s', where)
+    return server
+
+def add_arguments(parser):
+    """Add the logging and --stats options to an ArgumentParser."""
+    parser.add_argument('--log-level', default='info',
+                        choices=['debug', 'info', 'warning', 'error'],
+                        help='messages to print; every connection is '
+                             'logged at debug (default info)')
+    parser.add_argument('--stats', metavar='address',
+                        help='serve live counters as JSON at host:port or '
+                             'at a UNIX socket path, where {pid} stands for '
+                             'the process id (one per pre-forked worker)')
+
+def configure(args, stats=True):
+    """Apply the options added by add_arguments(). Pass stats=False in a
+    parent process whose forked children serve their own stats."""
+    logging.basicConfig(stream=sys.stdout, format='%(message)s')
+    log.setLevel(args.log_level.upper())  # not asyncio's and the like
+    if stats and args.stats:
+        serve_stats(args.stats)
@@ -3,69 +3,376 @@
 # https://github.com/brandon-rhodes/fopnp/blob/m/py3/chapter07/zen_utils.py
 # Constants and routines for supporting a certain network conversation.
 
-import argparse, socket, time
+import argparse, collections, concurrent.futures, mmap, multiprocessing
+import os, select, signal, socket, struct, threading, time, zlib
+import zen_handoff, zen_metrics
+from zen_metrics import log, metrics
 
 aphorisms = {b'Beautiful is better than?': b'Ugly.',
              b'Explicit is better than?': b'Implicit.',
              b'Simple is better than?': b'Complex.'}
 
+answer_delay = 0.0  # seconds; increase to simulate an expensive operation
+answer_cache = None  # LRUCache or SharedCache consulted by get_answer()
+
 def get_answer(aphorism):
     """Return the string response to a particular Zen-of-Python aphorism."""
-    time.sleep(0.0)  # increase to simulate an expensive operation
+    cache = answer_cache
+    if cache is None:
+        return compute_answer(aphorism)
+    answer = cache.get(aphorism)
+    if answer is None:
+        answer = compute_answer(aphorism)
+        cache.put(aphorism, answer)
+    return answer
+
+def compute_answer(aphorism):
+    """get_answer() without the cache: pays the simulated cost every time."""
+    if answer_delay:
+        time.sleep(answer_delay)  # even sleep(0) costs a system call
     return aphorisms.get(aphorism, b'Error: unknown aphorism.')
 
-def parse_command_line(description):
-    """Parse command line and return a socket address."""
+class LRUCache(object):
+    """In-process cache of at most `maxsize` answers, each kept for `ttl`
+    seconds; the least recently used answer goes first. Thread-safe."""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # key --> (expiry, value)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self.entries)}
+
+class SharedCache(object):
+    """Cache in an anonymous shared memory map, so processes forked after
+    it is created (e.g. srv_prefork.py workers) share answers and counters.
+
+    It is a fixed table of `slots` slots of `slotsize` bytes; a key can only
+    live in the slot its CRC-32 picks, so a newer key replaces an older one
+    there. Keys and values too large for a slot are not cached.
+    """
+
+    COUNTERS = struct.Struct('=QQQ')  # hits, misses, evictions
+    SLOT = struct.Struct('=dHH')      # expiry, key length, value length
+
+    def __init__(self, slots=4096, slotsize=256, ttl=60.0):
+        self.slots = slots
+        self.slotsize = slotsize
+        self.ttl = ttl
+        self.map = mmap.mmap(-1, self.COUNTERS.size + slots * slotsize)
+        self.lock = multiprocessing.Lock()
+
+    def offset(self, key):
+        return (self.COUNTERS.size
+                + zlib.crc32(key) % self.slots * self.slotsize)
+
+    def count(self, field):
+        counters = list(self.COUNTERS.unpack_from(self.map, 0))
+        counters[field] += 1
+        self.COUNTERS.pack_into(self.map, 0, *counters)
+
+    def get(self, key):
+        offset = self.offset(key)
+        start = offset + self.SLOT.size
+        with self.lock:
+            expiry, keylen, valuelen = self.SLOT.unpack_from(self.map, offset)
+            if (keylen == len(key) and expiry >= time.monotonic()
+                    and self.map[start:start + keylen] == key):
+                self.count(0)
+                return self.map[start + keylen:start + keylen + valuelen]
+            self.count(1)
+            return None
+
+    def put(self, key, value):
+        if self.SLOT.size + len(key) + len(value) > self.slotsize:
+            return
+        offset = self.offset(key)
+        start = offset + self.SLOT.size
+        with self.lock:
+            expiry, keylen, valuelen = self.SLOT.unpack_from(self.map, offset)
+            if keylen and self.map[start:start + keylen] != key:
+                self.count(2)
+            self.SLOT.pack_into(self.map, offset, time.monotonic() + self.ttl,
+                                len(key), len(value))
+            self.map[start:start + len(key) + len(value)] = key + value
+
+    def stats(self):
+        with self.lock:
+            hits, misses, evictions = self.COUNTERS.unpack_from(self.map, 0)
+        return {'hits': hits, 'misses': misses, 'evictions': evictions}
+
+def add_answer_arguments(parser):
+    """Add the options that configure get_answer() to an ArgumentParser."""
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='simulated cost of each answer, seconds '
+                             '(default 0)')
+    parser.add_argument('--cache', choices=['none', 'lru', 'shared'],
+                        default='none',
+                        help='cache answers in this process (lru) or in '
+                             'memory shared with forked workers (shared); '
+                             'default none')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='answers (lru) or slots (shared) kept '
+                             '(default 1024)')
+    parser.add_argument('--cache-ttl', type=float, default=60.0,
+                        help='seconds an answer stays cached (default 60)')
+
+def configure_answers(args):
+    """Apply the options added by add_answer_arguments(). With a cache,
+    SIGUSR1 makes the process log the cache counters."""
+    global answer_delay, answer_cache
+    answer_delay = args.delay
+    if args.cache == 'lru':
+        answer_cache = LRUCache(args.cache_size, args.cache_ttl)
+    elif args.cache == 'shared':
+        answer_cache = SharedCache(args.cache_size, ttl=args.cache_ttl)
+    else:
+        answer_cache = None
+    if answer_cache is not None:
+        metrics.sources['cache'] = answer_cache.stats
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, on_sigusr1)
+    else:
+        metrics.sources.pop('cache', None)
+
+def on_sigusr1(signum, frame):
+    # Log from another thread: the handler may have interrupted this one
+    # inside the logging module, holding a lock that it would wait for.
+    threading.Thread(target=log_cache_stats, daemon=True).start()
+
+def log_cache_stats():
+    if answer_cache is not None:
+        log.info('Answer cache: %s', answer_cache.stats())
+
+def add_executor_arguments(parser):
+    """Add the -x and -w options, for create_executor(args.x, args.w)."""
+    parser.add_argument('-x', choices=['none', 'thread', 'process'],
+                        default='none',
+                        help='run get_answer in a pool (default: none)')
+    parser.add_argument('-w', metavar='workers', type=int,
+                        help='pool size (default: the executor\'s own)')
+
+def parse_arguments(description, *add_arguments):
+    """Parse the command line of a server and apply the options every
+    server shares; return the arguments. Each of `add_arguments` is a
+    function that adds more options to the ArgumentParser."""
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument('host', help='IP or hostname')
     parser.add_argument('-p', metavar='port', type=int, default=1060,
                         help='TCP port (default 1060)')
+    for add in add_arguments:
+        add(parser)
+    add_answer_arguments(parser)
+    zen_metrics.add_arguments(parser)
+    zen_handoff.add_arguments(parser)
     args = parser.parse_args()
+    zen_metrics.configure(args)
+    zen_handoff.configure(args)
+    configure_answers(args)
+    return args
+
+def parse_command_line(description):
+    """Parse command line and return a socket address."""
+    args = parse_arguments(description)
     address = (args.host, args.p)
     return address
 
-def create_srv_socket(address):
-    """Build and return a listening server socket."""
+def create_executor(kind, workers=None):
+    """Return a 'thread' or 'process' pool to run get_answer() in, so that
+    an expensive answer does not stall an event loop, or None for 'none'.
+
+    A process pool inherits answer_delay and answer_cache from the moment
+    its workers are forked, so set them first.
+    """
+    if kind == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(workers)
+    if kind == 'process':
+        return concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=exit_with_parent)
+    return None
+
+def exit_with_parent(interval=1.0):
+    """Process pool initializer: exit once the server that forked this
+    worker is gone (killed, or exited after a handoff) instead of lingering
+    with a copy of its listening socket, which would keep the port bound
+    and accept connections that nobody answers."""
+    parent = os.getppid()
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(interval)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+def create_srv_socket(address, reuseport=False, backlog=64):
+    """Build and return a listening server socket.
+
+    With `reuseport`, several processes can each bind their own listener
+    to the same address (SO_REUSEPORT) and the kernel spreads incoming
+    connections across them.
+
+    The socket is non-blocking, so that it can be handed to another
+    process (see zen_handoff) while this one still accepts on it; if this
+    process took over a listener from its predecessor, that is returned
+    instead.
+    """
+    if zen_handoff.inherited:
+        listener = zen_handoff.inherited.pop(0)
+        log.info('Listening at %s', listener.getsockname())
+        return listener
     listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise OSError('SO_REUSEPORT is not supported on this platform')
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     listener.bind(address)
-    listener.listen(64)
-    print('Listening at {}'.format(address))
+    listener.listen(backlog)
+    listener.setblocking(False)
+    log.info('Listening at %s', address)
     return listener
 
 def accept_connections_forever(listener):
-    """Forever answer incoming connections on a listening socket."""
-    while True:
-        sock, address = listener.accept()
-        print('Accepted connection from {}'.format(address))
+    """Answer incoming connections on a listening socket until this
+    process hands it off (see zen_handoff). A listener with a timeout
+    (as in in_zen2.py) raises socket.timeout when none arrives in time."""
+    while not zen_handoff.draining.is_set():
+        if listener.gettimeout() == 0.0:  # as from create_srv_socket()
+            ready = select.select([listener], [], [], zen_handoff.POLL)[0]
+            if not ready or zen_handoff.draining.is_set():
+                continue
+        try:
+            sock, address = listener.accept()
+        except BlockingIOError:
+            continue  # another thread or process got there first
+        log.debug('Accepted connection from %s', address)
         handle_conversation(sock, address)
 
 def handle_conversation(sock, address):
     """Converse with a client over `sock` until they are done talking."""
+    # Answers are small writes; do not let Nagle hold one back waiting
+    # for the client's delayed ACK of the previous one
+    if sock.family != socket.AF_UNIX:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    reader = RecvBuffer(sock)
+    metrics.connection_made()
+    error = None
     try:
         while True:
-            handle_request(sock)
+            handle_request(sock, reader)
+            if zen_handoff.draining.is_set():
+                break  # after an answer: the client can reconnect
     except EOFError:
-        print('Client socket to {} has closed'.format(address))
+        log.debug('Client socket to %s has closed', address)
     except Exception as e:
-        print('Client {} error: {}'.format(address, e))
+        error = e
+        log.warning('Client %s error: %s', address, e)
     finally:
         sock.close()
+        metrics.connection_lost(error)
+
+def handle_request(sock, reader=None):
+    """Receive a client request on `sock` and send the answer.
 
-def handle_request(sock):
-    """Receive a single client request on `sock` and send the answer."""
-    aphorism = recv_until(sock, b'?')
-    answer = get_answer(aphorism)
+    Pass the connection's RecvBuffer as `reader`: requests the client
+    pipelined behind this one that have already arrived whole are
+    answered too, all in one sendall(), and the rest are kept for the
+    next call.
+    """
+    if reader is None:
+        reader = RecvBuffer(sock)
+    aphorism = reader.recv_until(b'?')
+    answers = []
+    received = 0
+    start = time.perf_counter()
+    while aphorism is not None:
+        answers.append(get_answer(aphorism))
+        received += len(aphorism)
+        aphorism = reader.buffered(b'?')
+    answer = b''.join(answers)
     sock.sendall(answer)
+    metrics.request(received, len(answer), time.perf_counter() - start,
+                    len(answers))
 
 def recv_until(sock, suffix):
-    """Receive bytes over socket `sock` until we receive the `suffix`."""
-    message = sock.recv(4096)
-    if not message:
-        raise EOFError('socket closed')
-    while not message.endswith(suffix):
-        data = sock.recv(4096)
-        if not data:
-            raise IOError('received {!r} then socket closed'.format(message))
-        message += data
-    return message
+    """Receive bytes over socket `sock` until we receive the `suffix`.
+
+    Any bytes received after the suffix are lost; use a RecvBuffer to
+    read several messages from one socket.
+    """
+    return RecvBuffer(sock).recv_until(suffix)
+
+class RecvBuffer(object):
+    """Buffered reader for delimited messages arriving on a socket.
+
+    Bytes received after a delimiter stay in the buffer for the next
+    call, and each byte is searched for the delimiter only once, so a
+    long message costs linear rather than quadratic time.
+    """
+
+    def __init__(self, sock, bufsize=65536, maxsize=65536):
+        self.sock = sock
+        self.bufsize = bufsize  # bytes asked for per recv()
+        self.maxsize = maxsize  # longest message accepted
+        self.buffer = bytearray()
+        self.scanned = 0        # leading bytes known not to end a suffix
+
+    def recv_until(self, suffix):
+        """Return the next message, up to and including `suffix`."""
+        if not self.buffer:
+            # common case: one recv() brings exactly one whole message
+            data = self.sock.recv(self.bufsize)
+            if not data:
+                raise EOFError('socket closed')
+            if (data.endswith(suffix) and
+                    data.find(suffix) == len(data) - len(suffix)):
+                return data
+            self.buffer += data
+        while True:
+            message = self.buffered(suffix)
+            if message is not None:
+                return message
+            if len(self.buffer) >= self.maxsize:
+                raise ValueError('no {!r} in the first {} bytes'.format(
+                    suffix, len(self.buffer)))
+            data = self.sock.recv(self.bufsize)
+            if not data:
+                if not self.buffer:
+                    raise EOFError('socket closed')
+                raise IOError('received {!r} then socket closed'.format(
+                    bytes(self.buffer)))
+            self.buffer += data
+
+    def buffered(self, suffix):
+        """Return the next message if it has already been received whole,
+        or None; never calls recv()."""
+        end = self.buffer.find(suffix, self.scanned)
+        if end < 0:
+            self.scanned = max(0, len(self.buffer) - len(suffix) + 1)
+            return None
+        end += len(suffix)
+        message = bytes(self.buffer[:end])
+        del self.buffer[:end]  # cheap: bytearray trims in place
+        self.scanned = 0
+        return message
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Load generator for the Zen servers: opens many concurrent connections
+# from several processes, keeps `depth` questions in flight on each one
+# (pipelining; depth 1 is plain request-reply) and reports requests/s and
+# latency percentiles. Answers are checked against zen_utils.aphorisms.
+# See bench_zen.py to run it against every server variant.
+
+import argparse, collections, errno, multiprocessing, random, selectors
+import socket, time
+import zen_utils
+from zen_metrics import Histogram
+
+class Connection(object):
+    __slots__ = ('sock', 'pending', 'buffer', 'answered')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = collections.deque()  # (expected answer, time sent)
+        self.buffer = b''
+        self.answered = 0
+
+def connect_all(address, n, timeout):
+    """Open up to n connections at once; return (connected, failed) after
+    at most `timeout` seconds."""
+    selector = selectors.DefaultSelector()
+    for i in range(n):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        err = sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS):
+            sock.close()
+            continue
+        selector.register(sock, selectors.EVENT_WRITE)
+        if i % 32 == 31:
+            time.sleep(0.001)  # let the server accept
+    connected = []
+    deadline = time.time() + timeout
+    while selector.get_map() and time.time() < deadline:
+        for key, mask in selector.select(timeout=0.1):
+            selector.unregister(key.fileobj)
+            if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                key.fileobj.close()
+            else:
+                connected.append(key.fileobj)
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    selector.close()
+    return connected, n - len(connected)
+
+def generate(address, n, depth, seconds, connect_timeout, results, go):
+    """Body of one load process; puts its totals on `results`."""
+    socks, failed = connect_all(address, n, connect_timeout)
+    results.put(('connected', len(socks)))
+    go.wait()
+
+    questions = list(zen_utils.aphorisms)
+    histogram = Histogram()
+    answered = errors = 0
+    selector = selectors.DefaultSelector()
+
+    def send_batch(conn):
+        batch = [random.choice(questions) for i in range(depth)]
+        now = time.perf_counter()
+        conn.pending.extend((zen_utils.aphorisms[q], now) for q in batch)
+        conn.sock.sendall(b''.join(batch))  # small: fits the send buffer
+
+    conns = [Connection(sock) for sock in socks]
+    for conn in conns:
+        selector.register(conn.sock, selectors.EVENT_READ, conn)
+        send_batch(conn)
+
+    deadline = time.time() + seconds
+    while time.time() < deadline and selector.get_map():
+        for key, mask in selector.select(timeout=0.1):
+            conn = key.data
+            try:
+                data = conn.sock.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                selector.unregister(conn.sock)
+                conn.sock.close()
+                continue
+            now = time.perf_counter()
+            answers = (conn.buffer + data).split(b'.')
+            conn.buffer = answers.pop()
+            for answer in answers:
+                if not conn.pending:
+                    errors += 1
+                    continue
+                expected, sent = conn.pending.popleft()
+                if answer + b'.' != expected:
+                    errors += 1
+                histogram.record(now - sent)
+                conn.answered += 1
+                answered += 1
+            if not conn.pending:
+                send_batch(conn)
+
+    starved = sum(1 for conn in conns if not conn.answered)
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    results.put(('done', answered, errors, starved, failed, histogram))
+
+def run_load(address, connections=100, depth=1, seconds=5.0, procs=2,
+             connect_timeout=5.0):
+    """Run the load from `procs` processes and return a dict of totals."""
+    results = multiprocessing.Queue()
+    go = multiprocessing.Event()
+    share = [connections // procs + (i < connections % procs)
+             for i in range(procs)]
+    workers = [multiprocessing.Process(target=generate, args=(
+        address, n, depth, seconds, connect_timeout, results, go))
+        for n in share if n]
+    for w in workers:
+        w.start()
+    connected = sum(results.get()[1] for w in workers)
+    go.set()
+    total = {'connected': connected, 'answered': 0, 'errors': 0,
+             'starved': 0, 'failed': 0, 'seconds': seconds}
+    histogram = Histogram()
+    for w in workers:
+        tag, answered, errors, starved, failed, h = results.get()
+        total['answered'] += answered
+        total['errors'] += errors
+        total['starved'] += starved
+        total['failed'] += failed
+        histogram.merge(h)
+    for w in workers:
+        w.join()
+    total['rate'] = total['answered'] / seconds
+    total['histogram'] = histogram
+    return total
+
+def report(total):
+    h = total['histogram']
+    print('{connected} connected, {failed} failed to connect'.format(**total))
+    print('{answered} answers in {seconds} s: {rate:.0f} requests/s, '
+          '{errors} wrong'.format(**total))
+    print('{starved} connections never got an answer'.format(**total))
+    print('latency ms: p50 {:.3f}  p99 {:.3f}  p99.9 {:.3f}  max {:.3f}'
+          .format(*[1000 * v for v in (h.percentile(50), h.percentile(99),
+                                       h.percentile(99.9), h.max)]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Zen load generator')
+    parser.add_argument('host', help='IP or hostname')
+    parser.add_argument('-p', metavar='port', type=int, default=1060,
+                        help='TCP port (default 1060)')
+    parser.add_argument('-c', metavar='connections', type=int, default=100,
+                        help='concurrent connections (default 100)')
+    parser.add_argument('-d', metavar='depth', type=int, default=1,
+                        help='questions in flight per connection (default 1)')
+    parser.add_argument('-t', metavar='seconds', type=float, default=5.0,
+                        help='duration (default 5)')
+    parser.add_argument('-w', metavar='processes', type=int, default=2,
+                        help='load generating processes (default 2)')
+    args = parser.parse_args()
+    report(run_load((args.host, args.p), args.c, args.d, args.t, args.w))